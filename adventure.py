@@ -0,0 +1,176 @@
+import json
+import logging
+import os
+import pickle
+import threading
+
+logger = logging.getLogger(__name__)
+
+ENGINE_VERSION = 1  # Bump when the compiled form changes so old caches are rebuilt
+CACHE_SUFFIX = ".cache"  # Compiled worlds are cached next to their world file
+
+# A compiled action: text to show, room to move to, item given, item required, text shown without it
+SAY, GO, GIVES, REQUIRES, OTHERWISE = range(5)
+
+
+def normalize(command, words, phrases):
+    """Lowercase a command, map each word through the word synonyms, then the whole phrase through the phrase synonyms."""
+    tokens = []
+    for token in command.lower().split():
+        token = words.get(token, token)
+        if token:  # Words mapped to "" (articles) are dropped
+            tokens.append(token)
+    phrase = " ".join(tokens)
+    return phrases.get(phrase, phrase)
+
+
+def compile_world(data):
+    """
+    Turn a world definition into per-room hash maps from normalized command to action.
+    Raises ValueError if the world refers to rooms that do not exist.
+    """
+    words = {word.lower(): meaning.lower() for word, meaning in data.get("words", {}).items()}
+    phrases = {}
+    for phrase, meaning in data.get("phrases", {}).items():
+        phrases[normalize(phrase, words, {})] = normalize(meaning, words, {})
+
+    def key(command):
+        return normalize(command, words, phrases)
+
+    def action(spec):
+        if spec.get("go") is not None and spec["go"] not in data["rooms"]:
+            raise ValueError(f"Action {spec.get('commands')} leads to unknown room '{spec['go']}'")
+        return (spec.get("say"), spec.get("go"), spec.get("gives"), spec.get("requires"), spec.get("otherwise"))
+
+    rooms = {}
+    for name, room in data["rooms"].items():
+        actions = {key("look"): (room["description"], None, None, None, None)}
+        for direction, target in room.get("exits", {}).items():
+            if target not in data["rooms"]:
+                raise ValueError(f"Exit '{direction}' from '{name}' leads to unknown room '{target}'")
+            actions[key(f"go {direction}")] = (None, target, None, None, None)
+        for spec in room.get("actions", []):  # Listed actions override plain exits
+            compiled = action(spec)
+            for command in spec["commands"]:
+                actions[key(command)] = compiled
+        rooms[name] = {"description": room["description"], "fallback": room.get("fallback"), "actions": actions}
+
+    if data["start"] not in rooms:
+        raise ValueError(f"Start room '{data['start']}' does not exist")
+    global_actions = {}
+    if data.get("help"):
+        global_actions[key("help")] = (data["help"], None, None, None, None)
+    for spec in data.get("actions", []):  # Actions available in every room
+        compiled = action(spec)
+        for command in spec["commands"]:
+            global_actions[key(command)] = compiled
+    return {
+        "start": data["start"],
+        "fallback": data.get("fallback", "I don't understand that."),
+        "words": words,
+        "phrases": phrases,
+        "rooms": rooms,
+        "actions": global_actions,
+    }
+
+
+class World:
+    """A compiled text adventure. Resolving a command is one normalization and one or two dict lookups."""
+
+    def __init__(self, compiled):
+        self.start = compiled["start"]
+        self.fallback = compiled["fallback"]
+        self.words = compiled["words"]
+        self.phrases = compiled["phrases"]
+        self.rooms = compiled["rooms"]
+        self.actions = compiled["actions"]
+
+    def new_game(self):
+        """Return the state of a new player: where they are and what they carry."""
+        return {"location": self.start, "inventory": []}
+
+    def describe(self, game):
+        room = self.rooms.get(game["location"])
+        return room["description"] if room else "Unknown game state."
+
+    def play(self, game, command):
+        """Run one command for a player and return the reply."""
+        room = self.rooms.get(game["location"])
+        if room is None:
+            return "Unknown game state."
+        phrase = normalize(command, self.words, self.phrases)
+        if phrase == "inventory":
+            return f"You are carrying: {', '.join(game['inventory'])}." if game["inventory"] else "You are empty-handed."
+        action = room["actions"].get(phrase)
+        if action is None:
+            action = self.actions.get(phrase)
+            if action is None:
+                return room["fallback"] or self.fallback
+
+        if action[REQUIRES] and action[REQUIRES] not in game["inventory"]:
+            return action[OTHERWISE] or room["fallback"] or self.fallback
+        if action[GIVES] and action[GIVES] not in game["inventory"]:
+            game["inventory"].append(action[GIVES])
+        if action[GO]:
+            game["location"] = action[GO]
+            description = self.rooms[action[GO]]["description"]
+            return f"{action[SAY]}\n\n{description}" if action[SAY] else description
+        return action[SAY]
+
+
+_worlds = {}  # world file path -> ((mtime, size), World)
+_lock = threading.Lock()
+
+
+def load_world(path):
+    """
+    Return the compiled world for a world file. The compiled form is kept in
+    memory and in a cache file next to the world, and both are rebuilt when
+    the world file changes, so new content needs no code or restart.
+    """
+    stat = os.stat(path)
+    source = (stat.st_mtime, stat.st_size)
+    cached = _worlds.get(path)
+    if cached and cached[0] == source:
+        return cached[1]
+    with _lock:
+        cached = _worlds.get(path)
+        if cached and cached[0] == source:
+            return cached[1]
+        compiled = _read_cache(path, source)
+        if compiled is None:
+            try:
+                with open(path, "r", encoding="utf-8") as world_file:
+                    compiled = compile_world(json.load(world_file))
+            except (KeyError, TypeError, ValueError) as e:
+                if not cached:
+                    raise
+                logger.error(f"Error in world file '{path}', keeping the previous version: {e}")
+                _worlds[path] = (source, cached[1])  # Not retried until the file changes again
+                return cached[1]
+            _write_cache(path, source, compiled)
+        world = World(compiled)
+        _worlds[path] = (source, world)
+        return world
+
+
+def _read_cache(path, source):
+    try:
+        with open(path + CACHE_SUFFIX, "rb") as cache_file:
+            cached = pickle.load(cache_file)
+    except (OSError, pickle.PickleError, EOFError, AttributeError, ValueError):
+        return None
+    if not isinstance(cached, dict) or cached.get("version") != ENGINE_VERSION or cached.get("source") != source:
+        return None  # Written by something else, an older engine or for an older world file
+    return cached.get("world")
+
+
+def _write_cache(path, source, compiled):
+    temp_path = path + CACHE_SUFFIX + ".tmp"
+    try:
+        with open(temp_path, "wb") as cache_file:
+            pickle.dump({"version": ENGINE_VERSION, "source": source, "world": compiled}, cache_file,
+                        protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temp_path, path + CACHE_SUFFIX)
+    except OSError as e:
+        logger.warning(f"Could not cache compiled world '{path}': {e}")
@@ -1,22 +1,63 @@
 import os
+import time
 import importlib
 from interface import Interface
+from module_loader import ModuleManifest, LazyModule, ModuleWatcher, RELOAD_INTERVAL
+from sessions import Session, SessionStore, SessionSnapshots, SESSION_TTL, MAX_SESSIONS, SNAPSHOT_FILE, SNAPSHOT_INTERVAL
+from timers import TimerWheel
+from commands import parse_command, cache_stats
 
 
 class BBSSystem:
-    def __init__(self):
-        self.users = {}  # Store user states keyed by their IDs
+    def __init__(self, interface=None):
+        self.reloads = 0
+        self.reload_failures = 0
         self.menu_modules = self.load_menu_modules()  # Load menu modules
-        self.interface = Interface()  # Initialize the Meshtastic interface
+        self.menus = self.compile_menus(self.menu_modules)  # Cached menu text and lookup tables
+        self.navigation = {"top": self.go_top, "cd ..": self.go_back}  # Global navigation commands
+        self.interface = interface or Interface()  # Initialize the Meshtastic interface
         self.interface.handle_message = self.handle_message  # Link message handling
+        self.interface.reply_place = self.reply_place  # Replies are only reused where the user still is
+        config = self.interface.config
+        snapshot_file = config.get("session_file", SNAPSHOT_FILE)
+        self.users = SessionStore(  # Store user sessions keyed by their IDs
+            ttl=config.get("session_ttl", SESSION_TTL),
+            max_sessions=config.get("max_sessions", MAX_SESSIONS),
+            snapshots=SessionSnapshots(snapshot_file) if snapshot_file else None,  # Restored lazily per user
+            snapshot_interval=config.get("snapshot_interval", SNAPSHOT_INTERVAL),
+            module_resolver=self.find_module,
+        )
 
-    def load_menu_modules(self):
+        # Shared timers for game rounds, idle timeouts and delayed messages
+        self.timers = TimerWheel(clock=self.interface.clock or time.monotonic)
+        self.timers.repeat(self.users.sweep_interval, self.users.expire, True)  # Drop idle sessions
+
+        # Latency per module, and the session, timer and command cache counters
+        metrics = self.interface.metrics
+        self.message_latency = metrics.histogram(
+            "handle_message_seconds", "Time to handle one message, by the module or menu it went to", labels=("module",))
+        self.latency_by_handler = {}  # Handler name -> its histogram, saving the label lookup on every message
+        metrics.register_stats("sessions", self.users.stats,
+                               counters=("evicted", "expired", "restored", "snapshots_written"))
+        metrics.register_stats("timers", self.timers.stats, counters=("fired", "cancelled", "errors"))
+        metrics.register_stats("command_cache", cache_stats, counters=("hits", "misses"))
+        metrics.register_stats("modules", self.reload_stats, counters=("reloads", "reload_failures"))
+
+        # Reload changed module files while the BBS keeps running
+        reload_interval = config.get("module_reload_interval", RELOAD_INTERVAL)
+        self.module_watcher = None
+        if reload_interval:
+            self.module_watcher = ModuleWatcher(self.modules_folder(), self.reload_modules, reload_interval)
+
+    def load_menu_modules(self, lazy=True, previous=None):
         """
-        Dynamically load all menu modules from the 'modules' folder.
+        Discover all menu modules in the 'modules' folder.
+        With lazy discovery, menu names are read from the source (cached in a
+        manifest) and each module is only imported when a user first opens it.
+        previous maps file paths to already loaded modules, which are kept if their file no longer parses.
         """
         menu_modules = {}
-        current_dir = os.path.dirname(os.path.abspath(__file__))
-        modules_folder = os.path.join(current_dir, "modules")
+        modules_folder = self.modules_folder()
 
         print(f"Looking for modules in: {modules_folder}")
 
@@ -24,178 +65,351 @@ class BBSSystem:
             print("Modules folder does not exist!")
             return menu_modules
 
-        for item in os.listdir(modules_folder):
+        manifest = ModuleManifest(modules_folder) if lazy else None
+        seen_files = []
+
+        def load(import_name, path, key):
+            seen_files.append(key)
+            if not lazy:
+                return self.import_module(import_name)
+            module = self.discover_module(import_name, path, key, manifest)
+            if module is None and previous and path in previous and manifest.lookup(path, key).get("error"):
+                self.reload_failures += 1
+                print(f"Keeping the previous version of '{import_name}' until its file is fixed")
+                return previous[path]
+            return module
+
+        for item in sorted(os.listdir(modules_folder)):
             item_path = os.path.join(modules_folder, item)
             if os.path.isfile(item_path) and item.endswith(".py") and not item.startswith("__"):
                 module_name = item[:-3]  # Remove .py extension
-                try:
-                    module = importlib.import_module(f"modules.{module_name}")
-                    if hasattr(module, "menu_name") and hasattr(module, "process_command"):
-                        menu_name = module.menu_name.strip()
-                        if menu_name:  # Ensure menu_name is valid
-                            print(f"Loaded module: {menu_name}")
-                            menu_modules[menu_name] = module
-                        else:
-                            print(f"Skipping {module_name}: Empty menu_name")
-                    else:
-                        print(f"Skipping {module_name}: Missing required attributes")
-                except Exception as e:
-                    print(f"Error loading module '{module_name}': {e}")
-            elif os.path.isdir(item_path):  # Handle folders as submenus
+                module = load(f"modules.{module_name}", item_path, item)
+                if module:
+                    menu_name = module.menu_name.strip()
+                    print(f"Loaded module: {menu_name}")
+                    menu_modules[menu_name] = module
+            elif os.path.isdir(item_path) and not item.startswith("__"):  # Handle folders as submenus
                 submenu = {}
-                for sub_file in os.listdir(item_path):
+                for sub_file in sorted(os.listdir(item_path)):
                     if sub_file.endswith(".py") and not sub_file.startswith("__"):
                         sub_module_name = sub_file[:-3]  # Remove .py extension
-                        try:
-                            sub_module = importlib.import_module(f"modules.{item}.{sub_module_name}")
-                            if hasattr(sub_module, "menu_name") and hasattr(sub_module, "process_command"):
-                                menu_name = sub_module.menu_name.strip()
-                                if menu_name:
-                                    print(f"Loaded submodule: {menu_name} under menu '{item}'")
-                                    submenu[menu_name] = sub_module
-                                else:
-                                    print(f"Skipping {sub_module_name}: Empty menu_name")
-                            else:
-                                print(f"Skipping {sub_module_name}: Missing required attributes")
-                        except Exception as e:
-                            print(f"Error loading submodule '{sub_module_name}': {e}")
+                        sub_module = load(f"modules.{item}.{sub_module_name}", os.path.join(item_path, sub_file),
+                                          f"{item}/{sub_file}")
+                        if sub_module:
+                            menu_name = sub_module.menu_name.strip()
+                            print(f"Loaded submodule: {menu_name} under menu '{item}'")
+                            submenu[menu_name] = sub_module
                 if submenu:
                     menu_modules[item] = {"submodules": submenu}
+
+        if manifest:
+            manifest.save(seen_files)
+            print(f"Scanned {manifest.scanned} changed module file(s)")
         print(f"Loaded modules: {list(menu_modules.keys())}")
         return menu_modules
 
+    def modules_folder(self):
+        """
+        Return the path of the 'modules' folder next to this file.
+        """
+        return os.path.join(os.path.dirname(os.path.abspath(__file__)), "modules")
+
+    def iter_modules(self):
+        """
+        Yield every module in the menu tree, including submodules.
+        """
+        for entry in self.menu_modules.values():
+            if isinstance(entry, dict):
+                yield from entry["submodules"].values()
+            else:
+                yield entry
+
+    def find_module(self, import_name):
+        """
+        Return the module in the menu tree with the given import name, or None.
+        """
+        for module in self.iter_modules():
+            if module.__name__ == import_name:
+                return module
+        return None
+
+    def reload_modules(self):
+        """
+        Rescan the modules folder and swap in changed modules.
+        Modules whose file did not change keep their current objects, and changed
+        modules are reloaded in place so users inside them keep their session.
+        Users in a module that disappeared are sent back to the menu on their next command.
+        """
+        start = time.perf_counter()
+        old_modules = {module.path: module for module in self.iter_modules() if isinstance(module, LazyModule)}
+        new_tree = self.load_menu_modules(previous=old_modules)
+
+        reloaded = []
+        for entry_name, entry in list(new_tree.items()):
+            container = entry["submodules"] if isinstance(entry, dict) else new_tree
+            for menu_name in list(container) if isinstance(entry, dict) else [entry_name]:
+                module = container[menu_name]
+                old = old_modules.pop(module.path, None)
+                if old is None or old is module:
+                    continue  # New file, or an unchanged copy kept because the file is broken
+                if old.mtime != module.mtime or old.menu_name != module.menu_name:
+                    try:
+                        old.reload(module.menu_name, module.mtime)
+                        reloaded.append(old.__name__)
+                    except Exception as e:
+                        self.reload_failures += 1
+                        print(f"Error reloading module '{old.__name__}', keeping the previous version: {e}")
+                container[menu_name] = old  # Keep the existing object so sessions pointing at it stay valid
+
+        for removed in old_modules.values():
+            removed.retired = True
+
+        menus = self.compile_menus(new_tree)
+        self.menu_modules, self.menus = new_tree, menus  # Swap the tree and its menus together
+        self.reloads += 1
+        elapsed = (time.perf_counter() - start) * 1000
+        print(f"Reloaded modules in {elapsed:.1f} ms: {reloaded or 'none changed'}, "
+              f"removed: {[module.__name__ for module in old_modules.values()] or 'none'}, "
+              f"failures so far: {self.reload_failures}")
+
+    def reload_stats(self):
+        """
+        Return the module reload counters.
+        """
+        return {"reloads": self.reloads, "reload_failures": self.reload_failures}
+
+    def discover_module(self, import_name, path, key, manifest):
+        """
+        Build a lazy stand-in for a module from its cached scan, or return None if it is not a menu module.
+        """
+        info = manifest.lookup(path, key)
+        if info.get("error"):
+            print(f"Error loading module '{import_name}': {info['error']}")
+        elif not info["menu_name"]:
+            print(f"Skipping {import_name}: Missing or empty menu_name")
+        elif not info["process_command"]:
+            print(f"Skipping {import_name}: Missing required attributes")
+        else:
+            return LazyModule(import_name, info["menu_name"], path)
+        return None
+
+    def import_module(self, import_name):
+        """
+        Import a module right away, or return None if it is not a valid menu module.
+        """
+        try:
+            module = importlib.import_module(import_name)
+        except Exception as e:
+            print(f"Error loading module '{import_name}': {e}")
+            return None
+        if hasattr(module, "menu_name") and hasattr(module, "process_command"):
+            if module.menu_name.strip():  # Ensure menu_name is valid
+                return module
+            print(f"Skipping {import_name}: Empty menu_name")
+        else:
+            print(f"Skipping {import_name}: Missing required attributes")
+        return None
+
     def handle_message(self, user_id, message):
         """
         Process messages received from the interface.
         """
+        handler = self.handler_name(user_id)
+        start = time.perf_counter()
         if user_id not in self.users:
             response = self.start_session(user_id)
         else:
-            response = self.process_command(user_id, message)
+            response = self.process_command(user_id, parse_command(message))  # Parsed once for every module
+        elapsed = time.perf_counter() - start
+        latency = self.latency_by_handler.get(handler)
+        if latency is None:
+            latency = self.latency_by_handler[handler] = self.message_latency.labels(handler)
+        latency.observe(elapsed)
         return response
 
+    def handler_name(self, user_id):
+        """
+        Name what will handle a user's next message: the module in control, the current menu, or a new session.
+        """
+        session = self.users.get(user_id)
+        if session is None:
+            return "session start"
+        if session.module_control is not None:
+            return session.module_control.menu_name
+        return f"menu {session.menu[-1]}"
+
+    def reply_place(self, user_id, message):
+        """
+        Name where a user is for the reply cache: the menu path, the module in control and,
+        if the module defines reply_state(user_id, session), its state. Called before and after
+        a command; only a command with a place on both sides is cached. Only looks at sessions
+        already in memory, without refreshing them. None with no session or no module in
+        control (menu choices are cheap, and picking the same number twice goes one level
+        deeper each time), for a module with cache_replies = False, for verbs the module lists
+        in uncached_commands, and where reply_state returns None.
+        """
+        session = self.users.peek(user_id)
+        if session is None or session.module_control is None:
+            return None
+        module = session.module_control
+        if not getattr(module, "cache_replies", True):
+            return None
+        if parse_command(message).verb in getattr(module, "uncached_commands", ()):
+            return None
+        reply_state = getattr(module, "reply_state", None)
+        if reply_state is None:
+            return tuple(session.menu), module.menu_name
+        state = reply_state(user_id, session)
+        if state is None:
+            return None
+        return tuple(session.menu), module.menu_name, state
+
+    def send_later(self, delay, user_id, message):
+        """
+        Send a message to a user after delay seconds. Returns a timer that can be cancelled.
+        """
+        return self.timers.schedule(delay, self.interface.send_message, user_id, message)
+
     def start_session(self, user_id):
         """
         Start a new BBS session for the user.
         """
-        self.users[user_id] = {"menu": ["main"]}  # Menu stack to track navigation
+        self.users[user_id] = Session()
         return self.display_menu(user_id)
 
     def process_command(self, user_id, command):
         """
         Process commands based on the user's current menu.
         """
-        current_menu = self.users[user_id]["menu"][-1]  # Get the current menu from the stack
+        session = self.users[user_id]
+        command = parse_command(command)  # Already parsed when called from handle_message
+        normalized = command.normalized
 
         # Check if a module has taken control
-        if "module_control" in self.users[user_id]:
-            module = self.users[user_id]["module_control"]
-            if command.strip().lower() == "cd ..":  # Exit the module and return to the menu
-                del self.users[user_id]["module_control"]
+        if session.module_control is not None:
+            module = session.module_control
+            if normalized == "cd ..":  # Exit the module and return to the menu
+                session.module_control = None
                 return self.display_menu(user_id)
+            elif getattr(module, "retired", False):  # The module was removed while in use
+                session.module_control = None
+                session.menu = ["main"]
+                return f"This module is no longer available.\n\n{self.display_menu(user_id)}"
             else:
                 # Forward command to the module
-                return module.process_command(user_id, command, self)
+                try:
+                    return module.process_command(user_id, command, self)
+                except Exception as e:
+                    print(f"Error in module '{module.__name__}' for {user_id}: {e}")
+                    session.module_control = None
+                    return f"Something went wrong in this module.\n\n{self.display_menu(user_id)}"
 
         # Handle global navigation commands
-        if command.strip().lower() == "top":  # Go back to the main menu
-            self.users[user_id]["menu"] = ["main"]
-            return self.display_menu(user_id)
-        elif command.strip().lower() == "cd ..":  # Go back one menu level
-            if len(self.users[user_id]["menu"]) > 1:
-                self.users[user_id]["menu"].pop()  # Remove the last menu
-                return self.display_menu(user_id)
-            else:
-                return "You are already at the main menu."
+        navigate = self.navigation.get(normalized)
+        if navigate:
+            return navigate(user_id, session)
 
         # Handle menu-specific commands
-        if current_menu == "main":
-            return self.handle_main_menu(user_id, command)
-        elif current_menu in self.menu_modules:
-            menu_data = self.menu_modules[current_menu]
-            if "submodules" in menu_data:
-                return self.handle_submenu(user_id, command, menu_data["submodules"])
-            elif hasattr(menu_data, "process_command"):
-                # Assign control to the module
-                self.users[user_id]["module_control"] = menu_data
-                return menu_data.display_menu() if hasattr(menu_data, "display_menu") else "Entering module..."
-            else:
-                return "Invalid command."
-        else:
-            return "Invalid command."
+        menu = self.menus.get(session.menu[-1])
+        if menu is not None:
+            return self.select_menu_item(user_id, session, menu, command)
+
+        menu_data = self.menu_modules.get(session.menu[-1])
+        if menu_data is not None and hasattr(menu_data, "process_command"):
+            # Assign control to the module
+            session.module_control = menu_data
+            return menu_data.display_menu() if hasattr(menu_data, "display_menu") else "Entering module..."
+        return "Invalid command."
 
-    def handle_main_menu(self, user_id, command):
+    def go_top(self, user_id, session):
         """
-        Handle user input in the main menu.
+        Go back to the main menu.
         """
-        try:
-            command_index = int(command) - 1
-            menu_names = list(self.menu_modules.keys())
-            if 0 <= command_index < len(menu_names):
-                selected_menu = menu_names[command_index]
-                self.users[user_id]["menu"].append(selected_menu)  # Add to the menu stack
-                if "submodules" in self.menu_modules[selected_menu]:
-                    return self.display_submenu(selected_menu)
-                else:
-                    module = self.menu_modules[selected_menu]
-                    return module.display_menu() if hasattr(module, "display_menu") else "No menu available."
-            else:
-                return "Invalid option."
-        except ValueError:
-            return "Invalid input. Please enter a number."
+        session.menu = ["main"]
+        return self.display_menu(user_id)
 
-    def handle_submenu(self, user_id, command, submodules):
+    def go_back(self, user_id, session):
         """
-        Handle user input in a submenu.
+        Go back one menu level.
         """
-        try:
-            command_index = int(command) - 1
-            submenu_names = list(submodules.keys())
-            if 0 <= command_index < len(submenu_names):
-                selected_submodule = submodules[submenu_names[command_index]]
-                self.users[user_id]["module_control"] = selected_submodule  # Assign control to the submodule
-                return selected_submodule.display_menu() if hasattr(selected_submodule, "display_menu") else "No menu available."
-            else:
-                return "Invalid option."
-        except ValueError:
+        if len(session.menu) > 1:
+            session.menu.pop()  # Remove the last menu
+            return self.display_menu(user_id)
+        return "You are already at the main menu."
+
+    def select_menu_item(self, user_id, session, menu, command):
+        """
+        Handle a numbered choice in the main menu or a submenu.
+        """
+        if command.number is None:
             return "Invalid input. Please enter a number."
+        command_index = command.number - 1
+        targets = menu["targets"]
+        if not 0 <= command_index < len(targets):
+            return "Invalid option."
+
+        target = targets[command_index]
+        if isinstance(target, tuple):  # A main menu entry: open the submenu or module
+            menu_name, module = target
+            session.menu.append(menu_name)  # Add to the menu stack
+            if isinstance(module, dict):
+                return module["text"]
+        else:  # A submenu entry: hand control to the module
+            module = target
+            session.module_control = module
+        return module.display_menu() if hasattr(module, "display_menu") else "No menu available."
+
+    def compile_menus(self, menu_modules):
+        """
+        Render every menu of a module tree once and build index-to-target tables for them.
+        Main menu targets are (menu name, submenu or module) pairs, so a choice never looks
+        anything up in menu_modules and stays valid while a reload swaps the tree.
+        """
+        menus = {}
+        for menu_name, entry in menu_modules.items():
+            if isinstance(entry, dict):
+                submodules = entry["submodules"]
+                lines = [f"{menu_name.capitalize()} Menu:"]
+                lines += [f"{index}. {sub_name}" for index, sub_name in enumerate(submodules, start=1)]
+                lines += ["Choose an option (e.g., '1').", "'cd ..' to go back."]
+                menus[menu_name] = {"text": "\n".join(lines), "targets": list(submodules.values())}
+
+        lines = ["Main Menu:"]
+        lines += [f"{index}. {menu_name}" for index, menu_name in enumerate(menu_modules, start=1)]
+        lines += ["Choose an option (e.g., '1').", "'top' to go to Main Menu, 'cd ..' to go back one menu."]
+        targets = [(menu_name, menus.get(menu_name, entry)) for menu_name, entry in menu_modules.items()]
+        menus["main"] = {"text": "\n".join(lines), "targets": targets}
+        return menus
 
     def display_menu(self, user_id):
         """
         Display the current menu to the user.
         """
-        current_menu = self.users[user_id]["menu"][-1]  # Get the current menu from the stack
-
-        if current_menu == "main":
-            menu_text = "Main Menu:\n"
-            for index, menu_name in enumerate(self.menu_modules.keys(), start=1):
-                menu_text += f"{index}. {menu_name}\n"
-            menu_text += "Choose an option (e.g., '1').\n"
-            menu_text += "'top' to go to Main Menu, 'cd ..' to go back one menu."
-            return menu_text
-        elif current_menu in self.menu_modules and "submodules" in self.menu_modules[current_menu]:
-            return self.display_submenu(current_menu)
-        else:
-            return "Invalid menu."
+        menu = self.menus.get(self.users[user_id].menu[-1])  # Get the current menu from the stack
+        return menu["text"] if menu is not None else "Invalid menu."
 
     def display_submenu(self, menu_name):
         """
         Display a submenu to the user.
         """
-        submodules = self.menu_modules[menu_name]["submodules"]
-        menu_text = f"{menu_name.capitalize()} Menu:\n"
-        for index, sub_name in enumerate(submodules.keys(), start=1):
-            menu_text += f"{index}. {sub_name}\n"
-        menu_text += "Choose an option (e.g., '1').\n"
-        menu_text += "'cd ..' to go back."
-        return menu_text
+        return self.menus[menu_name]["text"]
 
     def run(self):
         """
         Start the interface and BBS system.
         """
         print("BBS System running...")
-        self.interface.run()
+        self.users.start()
+        self.timers.start()
+        if self.module_watcher:
+            self.module_watcher.start()
+        try:
+            self.interface.run()
+        finally:
+            if self.module_watcher:
+                self.module_watcher.stop()
+            self.timers.stop()
+            self.users.close()  # Write a final snapshot of all sessions
 
 
 # Standalone execution
@@ -0,0 +1,411 @@
+"""
+Benchmarks for the BBS internals. They run without a radio attached.
+
+Usage:
+    python3 benchmarks.py              # Run every benchmark
+    python3 benchmarks.py startup      # Run one benchmark
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+BENCHMARKS = {}
+
+
+def benchmark(func):
+    """Register a benchmark under its function name."""
+    BENCHMARKS[func.__name__] = func
+    return func
+
+
+def report(name, seconds, count=1, unit="op"):
+    """Print the time per operation and the rate."""
+    per_op = seconds / count
+    print(f"  {name:<40} {per_op * 1e6:12.2f} us/{unit} {count / seconds:14.0f} {unit}/s")
+
+
+def forget_modules(prefix):
+    """Remove imported modules so the next import starts from scratch."""
+    for name in [name for name in sys.modules if name == prefix or name.startswith(prefix + ".")]:
+        del sys.modules[name]
+
+
+@contextlib.contextmanager
+def make_bbs():
+    """Build a BBSSystem through its constructor, without a radio, writing its files to a scratch folder."""
+    from bbs_system import BBSSystem
+    from interface import Interface
+    from simulator import simulator_config
+
+    with tempfile.TemporaryDirectory() as folder:
+        with contextlib.redirect_stdout(io.StringIO()):
+            bbs = BBSSystem(Interface(config=simulator_config(folder)))
+        try:
+            yield bbs
+        finally:
+            bbs.users.close()
+
+
+@contextlib.contextmanager
+def copy_of_modules():
+    """Copy the modules folder to a scratch folder and import the modules from there."""
+    from module_loader import MANIFEST_FILE
+
+    source = os.path.join(os.path.dirname(os.path.abspath(__file__)), "modules")
+    with tempfile.TemporaryDirectory() as folder:
+        shutil.copytree(source, os.path.join(folder, "modules"),
+                        ignore=shutil.ignore_patterns("__pycache__", "*.cache", MANIFEST_FILE))
+        sys.path.insert(0, folder)
+        forget_modules("modules")
+        try:
+            yield os.path.join(folder, "modules")
+        finally:
+            sys.path.remove(folder)
+            forget_modules("modules")
+
+
+@benchmark
+def startup(runs=20):
+    """Module discovery at startup: eager imports versus lazy discovery with a manifest."""
+    from module_loader import MANIFEST_FILE
+
+    with make_bbs() as bbs, copy_of_modules() as modules_folder:
+        bbs.modules_folder = lambda: modules_folder  # The real folder and its manifest are left alone
+        manifest = os.path.join(modules_folder, MANIFEST_FILE)
+
+        def measure(lazy, cold_manifest):
+            total = 0.0
+            for _ in range(runs):
+                forget_modules("modules")
+                if cold_manifest and os.path.exists(manifest):
+                    os.remove(manifest)
+                start = time.perf_counter()
+                with contextlib.redirect_stdout(io.StringIO()):
+                    bbs.load_menu_modules(lazy=lazy)
+                total += time.perf_counter() - start
+            return total
+
+        report("eager import", measure(False, False), runs, "startup")
+        report("lazy, manifest rebuilt", measure(True, True), runs, "startup")
+        report("lazy, manifest cached", measure(True, False), runs, "startup")
+
+
+@benchmark
+def routing(rounds=20000):
+    """Per-command cost of menu navigation through BBSSystem.process_command."""
+    with make_bbs() as bbs:
+        bbs.start_session("!bench")
+        commands = ["1", "cd ..", "top", " 1 ", "CD ..", "9", "x"]  # Submenu, back, top, invalid index and input
+
+        start = time.perf_counter()
+        for _ in range(rounds):
+            for command in commands:
+                bbs.process_command("!bench", command)
+        report("menu routing", time.perf_counter() - start, rounds * len(commands), "command")
+
+        start = time.perf_counter()
+        for _ in range(rounds):
+            bbs.display_menu("!bench")
+        report("main menu render", time.perf_counter() - start, rounds, "render")
+
+
+@benchmark
+def address_book(entries=10000):
+    """Address list operations with 10k entries: cached write-behind book versus load/save per command."""
+    from modules.Mail import address_list
+
+    with tempfile.TemporaryDirectory() as folder:
+        path = os.path.join(folder, "address_list.json")
+        address_list.save_address_list({f"!{index:08x}": {"online": True} for index in range(entries)}, path)
+        book = address_list.AddressBook(path, flush_interval=3600)  # Flushes are timed separately below
+
+        start = time.perf_counter()
+        for index in range(entries):
+            user_id = f"!{index:08x}"
+            book.get(user_id)
+            book.update(user_id, online=False)
+            book.remove(user_id)
+            book.add(user_id, {"online": True})
+        report("cached get/update/remove/add", time.perf_counter() - start, entries * 4)
+
+        start = time.perf_counter()
+        book.flush()
+        report("atomic flush of 10k entries", time.perf_counter() - start, 1, "flush")
+
+        address_list.address_book, saved_book = book, address_list.address_book
+        rounds = 2000
+        view = {"query": None, "starts": [f"!{entries // 2:08x}"], "next": None}
+        start = time.perf_counter()
+        for _ in range(rounds):
+            address_list.render_page(view, None)
+        report("render one page from the middle", time.perf_counter() - start, rounds, "page")
+
+        view = {"query": "00001", "starts": [None], "next": None}
+        start = time.perf_counter()
+        for _ in range(rounds):
+            address_list.render_page(view, None)
+        report("prefix search, first page", time.perf_counter() - start, rounds, "page")
+        address_list.address_book = saved_book
+        book.close()
+
+        rounds = 20
+        start = time.perf_counter()
+        for index in range(rounds):
+            entries_on_disk = address_list.load_address_list(path)
+            entries_on_disk[f"!{index:08x}"]["online"] = False
+            address_list.save_address_list(entries_on_disk, path)
+        report("load + save per command (old way)", time.perf_counter() - start, rounds)
+
+
+@benchmark
+def positions(nodes=5000, rounds=2000):
+    """Nearby-node queries over 5k nodes spread across a 60 km square: grid index versus a full scan."""
+    import random
+    from positions import PositionIndex, distance_m
+
+    index = PositionIndex()
+    rng = random.Random(1)
+    node_ids = [f"!{number:08x}" for number in range(nodes)]
+    start = time.perf_counter()
+    for node_id in node_ids:
+        index.update(node_id, 35.6 + rng.uniform(-0.3, 0.3), -97.5 + rng.uniform(-0.3, 0.3))
+    report("position update", time.perf_counter() - start, nodes, "update")
+
+    points = [(35.6 + rng.uniform(-0.3, 0.3), -97.5 + rng.uniform(-0.3, 0.3)) for _ in range(rounds)]
+    for name, query in (("within 500 m", lambda lat, lon: index.within(lat, lon, 500)),
+                        ("within 5 km", lambda lat, lon: index.within(lat, lon, 5000)),
+                        ("5 nearest", lambda lat, lon: index.nearest(lat, lon, 5))):
+        start = time.perf_counter()
+        for latitude, longitude in points:
+            query(latitude, longitude)
+        report(name, time.perf_counter() - start, rounds, "query")
+
+    latest = index.snapshot()
+    start = time.perf_counter()
+    for latitude, longitude in points[:20]:
+        [node_id for node_id, position in latest.items() if distance_m(latitude, longitude, position[0], position[1]) <= 500]
+    report("within 500 m, full scan (old way)", time.perf_counter() - start, 20, "query")
+
+
+@benchmark
+def hot_cold(players=1000, rounds=200):
+    """End of a Hot Cold round with 1k players: batched distances versus one haversine call per player."""
+    import random
+    from modules.Games import hot_cold
+    from timers import TimerWheel
+
+    rng = random.Random(1)
+    target = hot_cold.DEFAULT_TARGET
+    points = [(target[0] + rng.uniform(-0.01, 0.01), target[1] + rng.uniform(-0.01, 0.01)) for _ in range(players)]
+
+    start = time.perf_counter()
+    for _ in range(rounds):
+        hot_cold.distances_to(target, points)
+    report("batched distances" + ("" if hot_cold.np else " (no NumPy)"), time.perf_counter() - start, rounds, "round")
+
+    start = time.perf_counter()
+    for _ in range(rounds):
+        [hot_cold.haversine(target[0], target[1], lat, lon) for lat, lon in points]
+    report("scalar haversine per player", time.perf_counter() - start, rounds, "round")
+
+    positions = {f"!{number:08x}": point for number, point in enumerate(points)}
+    sent = []
+    game = hot_cold.HotColdGame(target, 3600, positions.get, lambda player_id, message: sent.append(message),
+                                TimerWheel())  # Never started; rounds are ended by hand
+    for player_id in positions:
+        game.join(player_id)
+    start = time.perf_counter()
+    for _ in range(rounds):
+        game.round = 0  # Stay below MAX_ROUNDS so every round is scored
+        game.end_round()
+    report("full round: locate, score, push", time.perf_counter() - start, rounds, "round")
+    game.stop()
+
+
+@benchmark
+def timers(count=100000):
+    """Scheduling and cancelling 100k timers on the shared timer wheel."""
+    from timers import TimerWheel
+
+    wheel = TimerWheel()  # Not started, so nothing fires while we measure
+    delays = [(index % 3600) + 0.5 for index in range(count)]  # Spread over an hour, several turns of the wheel
+
+    start = time.perf_counter()
+    handles = [wheel.schedule(delay, print) for delay in delays]
+    report("schedule", time.perf_counter() - start, count, "timer")
+
+    start = time.perf_counter()
+    for handle in handles:
+        handle.cancel()
+    report("cancel", time.perf_counter() - start, count, "timer")
+
+
+@benchmark
+def tic_tac_toe(games=20000):
+    """Tic Tac Toe engine: perfect-play table lookups and complete computer-versus-computer games."""
+    import random
+    from modules.Games import tic_tac_toe
+
+    positions = list(tic_tac_toe.BEST_MOVES)
+    rng = random.Random(1)
+    boards = [(key & tic_tac_toe.FULL_BOARD, key >> 9) for key in (rng.choice(positions) for _ in range(games))]
+    start = time.perf_counter()
+    for x, o in boards:
+        tic_tac_toe.computer_move(x, o)
+    report("perfect move lookup", time.perf_counter() - start, games, "move")
+
+    start = time.perf_counter()
+    for x, o in boards:
+        tic_tac_toe.check_winner(x, o)
+    report("win check", time.perf_counter() - start, games, "check")
+
+    moves = 0
+    start = time.perf_counter()
+    for _ in range(games // 10):
+        x = o = 0
+        for turn in range(9):
+            if turn % 2:
+                o |= 1 << tic_tac_toe.computer_move(x, o)
+            else:
+                x |= 1 << tic_tac_toe.computer_move(x, o, 0.7)
+            moves += 1
+            if tic_tac_toe.check_winner(x, o):
+                break
+    report("moves in full games", time.perf_counter() - start, moves, "move")
+
+
+@benchmark
+def escape_room(players=1000):
+    """Per-player Escape Room footprint: shared world plus a delta versus a full copy of the rooms per player."""
+    import json
+    import tracemalloc
+    from modules.Games import escape_room
+
+    def legacy_game():
+        # What init_game used to build for every player
+        rooms = {name: {"description": room["description"], "objects": dict(room["objects"]),
+                        "items": {}, "exits": dict(room["exits"])} for name, room in escape_room.WORLD.items()}
+        return {"current_room": "start", "inventory": [], "rooms": rooms,
+                "door_unlocked": False, "chest_unlocked": False}
+
+    for name, build in (("full copy per player (old way)", legacy_game), ("shared world + delta", escape_room.init_game)):
+        tracemalloc.start()
+        games = [build() for _ in range(players)]
+        current, _ = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        record = len(json.dumps(games[0]))
+        print(f"  {name:<40} {current / players:12.0f} bytes/player {record:10d} bytes/snapshot")
+        del games
+
+
+@benchmark
+def adventure(rounds=20000):
+    """Text adventure engine: compiling the Zork world, loading it from the cache and resolving commands."""
+    import adventure
+    from modules.Games import zork
+
+    with open(zork.WORLD_FILE, "r", encoding="utf-8") as world_file:
+        data = json.load(world_file)
+    start = time.perf_counter()
+    for _ in range(100):
+        adventure.compile_world(data)
+    report("compile world from JSON", time.perf_counter() - start, 100, "compile")
+
+    stat = os.stat(zork.WORLD_FILE)
+    start = time.perf_counter()
+    for _ in range(100):
+        adventure._read_cache(zork.WORLD_FILE, (stat.st_mtime, stat.st_size))
+    report("load compiled world from cache", time.perf_counter() - start, 100, "load")
+
+    world = adventure.load_world(zork.WORLD_FILE)
+    game = world.new_game()
+    commands = ["look", "Open the Mailbox", "examine house", "xyzzy"]
+    start = time.perf_counter()
+    for _ in range(rounds):
+        for command in commands:
+            world.play(game, command)
+    report("resolve and run a command", time.perf_counter() - start, rounds * len(commands), "command")
+
+
+@benchmark
+def commands(rounds=100000):
+    """Parsing inbound messages: the shared parse cache versus parsing every message again."""
+    import commands as command_parser
+
+    messages = ["1", "cd ..", " 2 ", "go north", "find Bob", "Examine Chest", "top", "9"]
+    start = time.perf_counter()
+    for _ in range(rounds):
+        for message in messages:
+            command_parser.parse_command(message)
+    report("cached parse", time.perf_counter() - start, rounds * len(messages), "message")
+
+    start = time.perf_counter()
+    for _ in range(rounds):
+        for message in messages:
+            command_parser._parse.__wrapped__(message)
+    report("uncached parse", time.perf_counter() - start, rounds * len(messages), "message")
+
+
+@benchmark
+def metrics(samples=1000000):
+    """Cost of recording one metric sample, and of rendering the Prometheus text for 10 modules."""
+    from metrics import MetricsRegistry
+
+    registry = MetricsRegistry()
+    counter = registry.counter("bench_total", "Benchmark counter")
+    latency = registry.histogram("bench_seconds", "Benchmark latency", labels=("module",))
+    modules = [f"module {index}" for index in range(10)]
+
+    start = time.perf_counter()
+    for _ in range(samples):
+        counter.inc()
+    report("counter increment", time.perf_counter() - start, samples, "sample")
+
+    child = latency.labels(modules[0])
+    start = time.perf_counter()
+    for index in range(samples):
+        child.observe(index * 1e-7)
+    report("histogram sample", time.perf_counter() - start, samples, "sample")
+
+    start = time.perf_counter()
+    for index in range(samples):
+        latency.labels(modules[index % 10]).observe(index * 1e-7)
+    report("histogram sample with label lookup", time.perf_counter() - start, samples, "sample")
+
+    # As BBSSystem.handle_message records: the histogram of each module is cached by name
+    by_module = {}
+    start = time.perf_counter()
+    for index in range(samples):
+        module = modules[index % 10]
+        child = by_module.get(module)
+        if child is None:
+            child = by_module[module] = latency.labels(module)
+        child.observe(index * 1e-7)
+    report("histogram sample with cached child", time.perf_counter() - start, samples, "sample")
+
+    start = time.perf_counter()
+    for _ in range(100):
+        registry.render()
+    report("render Prometheus text", time.perf_counter() - start, 100, "render")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run BBS benchmarks.")
+    parser.add_argument("names", nargs="*", help=f"Benchmarks to run (default: all): {', '.join(sorted(BENCHMARKS))}")
+    args = parser.parse_args()
+    unknown = [name for name in args.names if name not in BENCHMARKS]
+    if unknown:
+        parser.error(f"Unknown benchmark(s): {', '.join(unknown)}")
+    for name in args.names or sorted(BENCHMARKS):
+        print(f"{name}: {BENCHMARKS[name].__doc__}")
+        BENCHMARKS[name]()
+
+
+if __name__ == "__main__":
+    main()
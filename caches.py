@@ -0,0 +1,125 @@
+import threading
+import time
+from collections import OrderedDict
+from commands import parse_command
+
+DUPLICATE_WINDOW = 600  # Seconds a packet id is remembered
+DUPLICATE_CAPACITY = 4096  # Maximum packet ids remembered at once
+REPLY_TTL = 20  # Seconds a repeated command is treated as a retry
+REPLY_CAPACITY = 1024  # Maximum users with a cached reply
+
+
+class DuplicateFilter:
+    """
+    Fixed-size, time-windowed set of recently seen packets.
+
+    Keys are kept in arrival order, so expired and overflowing entries are
+    always at the front and each check costs O(1) amortized.
+    """
+
+    def __init__(self, capacity=DUPLICATE_CAPACITY, window=DUPLICATE_WINDOW):
+        self.capacity = max(1, int(capacity))
+        self.window = window
+        self._seen = OrderedDict()  # key -> time first seen
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def seen(self, key, now=None):
+        """Record the key and return True if it was already seen inside the window."""
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            self._expire(now)
+            if key in self._seen:
+                self.hits += 1
+                return True
+
+            self.misses += 1
+            self._seen[key] = now
+            if len(self._seen) > self.capacity:
+                self._seen.popitem(last=False)
+                self.evictions += 1
+            return False
+
+    def _expire(self, now):
+        """Forget keys older than the window."""
+        cutoff = now - self.window
+        while self._seen:
+            key, first_seen = next(iter(self._seen.items()))
+            if first_seen > cutoff:
+                break
+            del self._seen[key]
+
+    def __len__(self):
+        return len(self._seen)
+
+    def stats(self):
+        """Return a snapshot of the filter counters."""
+        with self._lock:
+            return {
+                "size": len(self._seen),
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+
+class ReplyCache:
+    """
+    Last command and reply per user.
+
+    A user who did not see a reply over a lossy link sends the same command
+    again; inside the TTL the cached reply is resent instead of running the
+    command a second time. Each reply is stored with the place the command left
+    the user in (such as the menu path, the module in control and its state),
+    and is only resent while the user is still there: once anything else has
+    moved them on, the same command means something new and runs again.
+    """
+
+    def __init__(self, ttl=REPLY_TTL, capacity=REPLY_CAPACITY):
+        self.ttl = ttl
+        self.capacity = max(1, int(capacity))
+        self._replies = OrderedDict()  # user_id -> (command, place, response, time stored)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def lookup(self, user_id, command, place=None):
+        """Return the cached reply if the user repeats their last command from where it left them, inside the TTL."""
+        if self.ttl <= 0:
+            return None
+        normalized = parse_command(command).normalized
+        with self._lock:
+            entry = self._replies.get(user_id)
+            if (entry and entry[0] == normalized and entry[1] == place
+                    and time.monotonic() - entry[3] <= self.ttl):
+                self.hits += 1
+                return entry[2]
+            self.misses += 1
+            return None
+
+    def store(self, user_id, command, response, place=None):
+        """Remember the reply to the user's latest command and the place it left them in."""
+        if self.ttl <= 0:
+            return
+        normalized = parse_command(command).normalized
+        with self._lock:
+            self._replies[user_id] = (normalized, place, response, time.monotonic())
+            self._replies.move_to_end(user_id)
+            if len(self._replies) > self.capacity:
+                self._replies.popitem(last=False)
+
+    def forget(self, user_id):
+        """Drop the user's cached reply, so a later repeat of that command runs again."""
+        with self._lock:
+            self._replies.pop(user_id, None)
+
+    def stats(self):
+        """Return a snapshot of the cache counters."""
+        with self._lock:
+            return {
+                "size": len(self._replies),
+                "hits": self.hits,
+                "misses": self.misses,
+            }
@@ -0,0 +1,417 @@
+"""
+Packet capture and deterministic replay.
+
+With "capture_file" set in the configuration, the interface records every
+packet it receives, with the time it arrived, into a gzip-compressed JSON
+lines file that is rotated by size. A capture can then be replayed against
+BBSSystem.handle_message of any build, and two replays compared.
+
+Usage:
+    python3 capture.py replay capture.jsonl.gz                       # As fast as possible, print latency per module
+    python3 capture.py replay capture.jsonl.gz --speed 1 --out new.json    # At the captured pace, save the results
+    python3 capture.py compare old.json new.json                     # Latency changes and response diffs
+"""
+import argparse
+import contextlib
+import difflib
+import gzip
+import io
+import itertools
+import json
+import logging
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+
+from caches import DuplicateFilter, DUPLICATE_CAPACITY, DUPLICATE_WINDOW
+
+logger = logging.getLogger(__name__)
+
+CAPTURE_FILE = "capture.jsonl.gz"
+CAPTURE_MAX_BYTES = 4 * 1024 * 1024  # Rotate the capture when it grows past this size
+CAPTURE_BACKUPS = 5  # Rotated captures kept, as capture.jsonl.gz.1 (newest) to .5 (oldest)
+FLUSH_RECORDS = 100  # Write once this many packets are waiting
+FLUSH_INTERVAL = 10  # ... or after this many seconds
+MAX_PENDING_PACKETS = 10000  # Packets kept in memory while writes fail; the oldest are dropped beyond this
+DROPPED_FIELDS = ("raw", "payload")  # Protobuf objects and encoded bytes; everything else is decoded alongside
+
+REPLAY_SEED = 1  # Seed for module randomness (computer moves, hidden targets) during a replay
+SLOWDOWN_THRESHOLD = 0.25  # A module whose median latency grew by more than this is reported as slower
+MAX_DIFFS = 10  # Changed responses shown by compare
+
+
+def compact_packet(value):
+    """Copy a packet keeping only what JSON can hold, without the raw protobuf and payload bytes."""
+    if isinstance(value, dict):
+        compact = {}
+        for key, item in value.items():
+            if key in DROPPED_FIELDS:
+                continue
+            item = compact_packet(item)
+            if item is not None or value[key] is None:
+                compact[key] = item
+        return compact
+    if isinstance(value, (list, tuple)):
+        return [item for item in map(compact_packet, value) if item is not None]
+    if value is None or isinstance(value, (str, int, float, bool)):
+        return value
+    return None  # Anything else (bytes, protobuf messages) is left out
+
+
+class PacketCapture:
+    """
+    Buffered packet capture.
+
+    Packets are appended to an in-memory buffer on the radio thread and
+    compacted, encoded and written in batches by a background thread. Each
+    batch is appended as its own gzip member, and the file is rotated once
+    it passes max_bytes, keeping a fixed number of older captures. A batch
+    that fails to write is kept for the next attempt, up to max_pending packets.
+    """
+
+    def __init__(self, path=CAPTURE_FILE, max_bytes=CAPTURE_MAX_BYTES, backups=CAPTURE_BACKUPS,
+                 flush_records=FLUSH_RECORDS, flush_interval=FLUSH_INTERVAL, max_pending=MAX_PENDING_PACKETS):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backups = max(0, int(backups))
+        self.flush_records = max(1, int(flush_records))
+        self.flush_interval = flush_interval
+        self.max_pending = max(1, int(max_pending))
+
+        self._buffer = []
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()  # One batch written at a time
+        self._wakeup = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+
+        self.packets = 0
+        self.batches = 0
+        self.rotations = 0
+        self.errors = 0
+        self.dropped = 0  # Packets given up on because writes kept failing
+
+    def record(self, packet, when=None):
+        """Buffer one received packet with its arrival time. Never touches the disk."""
+        with self._lock:
+            self._buffer.append((when if when is not None else time.time(), packet))
+            full = len(self._buffer) >= self.flush_records
+        if full:
+            self._wakeup.set()
+
+    def start(self):
+        """Start the background writer."""
+        if not self._thread:
+            self._thread = threading.Thread(target=self._run, name="capture-writer", daemon=True)
+            self._thread.start()
+
+    def close(self):
+        """Stop the background writer and write every buffered packet."""
+        self._stop.set()
+        self._wakeup.set()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+        self.flush()
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            self.flush()
+
+    def flush(self):
+        """Write all buffered packets in one batch. Returns the number written."""
+        with self._write_lock:
+            with self._lock:
+                batch, self._buffer = self._buffer, []
+            if not batch:
+                return 0
+            try:
+                data = "".join(json.dumps([round(when, 3), compact_packet(packet)], separators=(",", ":")) + "\n"
+                               for when, packet in batch)
+                self._rotate_if_needed()
+                with gzip.open(self.path, "ab") as capture_file:
+                    capture_file.write(data.encode("utf-8"))
+            except Exception as e:
+                self.errors += 1
+                logger.error(f"Error writing packet capture: {e}")
+                with self._lock:
+                    self._buffer[:0] = batch  # Keep the packets for the next attempt
+                    excess = len(self._buffer) - self.max_pending
+                    if excess > 0:
+                        del self._buffer[:excess]  # ... but only the newest, so a dead disk cannot fill memory
+                        self.dropped += excess
+                if excess > 0:
+                    logger.warning(f"Dropped {excess} captured packets that could not be written")
+                return 0
+            self.packets += len(batch)
+            self.batches += 1
+            return len(batch)
+
+    def _rotate_if_needed(self):
+        """Shift the current capture to .1, .1 to .2 and so on, dropping the oldest, once it is too big."""
+        try:
+            if os.path.getsize(self.path) < self.max_bytes:
+                return
+        except OSError:
+            return  # Nothing to rotate yet
+        if not self.backups:
+            os.remove(self.path)
+        else:
+            for index in range(self.backups - 1, 0, -1):
+                older = f"{self.path}.{index}"
+                if os.path.exists(older):
+                    os.replace(older, f"{self.path}.{index + 1}")
+            os.replace(self.path, f"{self.path}.1")
+        self.rotations += 1
+        logger.info(f"Rotated packet capture {self.path}")
+
+    def stats(self):
+        """Return the writer counters."""
+        with self._lock:
+            pending = len(self._buffer)
+        return {
+            "pending": pending,
+            "packets": self.packets,
+            "batches": self.batches,
+            "rotations": self.rotations,
+            "errors": self.errors,
+            "dropped": self.dropped,
+        }
+
+
+def capture_files(path):
+    """Return the files of a capture, oldest first: the rotated ones, then the current one."""
+    rotated = []
+    index = 1
+    while os.path.exists(f"{path}.{index}"):
+        rotated.append(f"{path}.{index}")
+        index += 1
+    files = rotated[::-1]
+    if os.path.exists(path):
+        files.append(path)
+    return files
+
+
+def read_capture(path):
+    """Yield (arrival time, packet) from a capture and its rotated files, oldest first."""
+    for file_path in capture_files(path):
+        try:
+            with gzip.open(file_path, "rt", encoding="utf-8") as capture_file:
+                for line in capture_file:
+                    when, packet = json.loads(line)
+                    yield when, packet
+        except (EOFError, gzip.BadGzipFile, ValueError) as e:
+            # A capture cut off by a crash ends with a partial batch; the packets before it are still good
+            logger.warning(f"Stopped reading '{file_path}' at a damaged record: {e}")
+
+
+class ReplayClock:
+    """Clock that reads the arrival time of the packet being replayed."""
+
+    def __init__(self, now):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+def is_menu_module(name):
+    """Whether a module name belongs to the menu modules a replay imports afresh."""
+    return name in ("modules", "adventure") or name.startswith("modules.")
+
+
+@contextlib.contextmanager
+def fresh_modules():
+    """
+    Import the menu modules, and the adventure engine they share, afresh for
+    the length of a replay, so games and matches left by an earlier replay in
+    this process cannot change its responses. The previous modules are put back afterwards.
+    """
+    saved = {name: module for name, module in sys.modules.items() if is_menu_module(name)}
+    for name in saved:
+        del sys.modules[name]
+    try:
+        yield
+    finally:
+        for name in [name for name in sys.modules if is_menu_module(name)]:
+            del sys.modules[name]
+        sys.modules.update(saved)
+
+
+def replay(records, speed=0, seed=REPLAY_SEED):
+    """
+    Feed captured packets to a fresh BBS, one at a time and in capture order,
+    the way Interface.on_receive would: duplicates are dropped, presence and
+    positions are updated, and text goes to BBSSystem.handle_message. The
+    reply cache is bypassed so every command runs.
+
+    The BBS runs on a clock set to each packet's arrival time, and the menu
+    modules start from scratch, so replaying a capture twice gives the same
+    responses. speed 0 replays as fast as possible, 1 at the captured pace,
+    2 twice as fast and so on. Timers are not run, so sessions do not expire
+    and timed messages (such as the end of a game round) are not part of a replay.
+
+    Returns one dict per handled message with the sender, text, the module
+    or menu that handled it, the latency in seconds and the response.
+    """
+    from bbs_system import BBSSystem
+    from interface import Interface
+    from simulator import scratch_address_book
+
+    records = iter(records)
+    head = next(records, None)
+    if head is None:
+        return []
+    first = head[0]
+    clock = ReplayClock(first)
+
+    random.seed(seed)
+    results = []
+    with tempfile.TemporaryDirectory() as workdir, contextlib.redirect_stdout(io.StringIO()), fresh_modules():
+        config = {"session_file": None, "presence_file": None, "module_reload_interval": 0}
+        interface = Interface(config=config, radio=None, clock=clock)
+        bbs = BBSSystem(interface=interface)
+        duplicates = DuplicateFilter(capacity=DUPLICATE_CAPACITY, window=DUPLICATE_WINDOW)
+        with scratch_address_book(workdir):
+            started = time.monotonic()
+            for when, packet in itertools.chain([head], records):
+                clock.now = when
+                if speed:
+                    delay = (when - first) / speed - (time.monotonic() - started)
+                    if delay > 0:
+                        time.sleep(delay)
+
+                sender = packet.get("fromId")
+                packet_id = packet.get("id")
+                if packet_id is not None and duplicates.seen((sender, packet_id), when):
+                    continue
+                if sender:
+                    interface.presence.heard(sender, when)
+                position = packet.get("position") or {}
+                if sender and position.get("latitude") and position.get("longitude"):
+                    interface.positions.update(sender, position["latitude"], position["longitude"],
+                                               position.get("altitude"), position.get("time"))
+
+                text = packet.get("decoded", {}).get("text")
+                if text and sender:
+                    label = bbs.handler_name(sender)
+                    start = time.perf_counter()
+                    response = bbs.handle_message(sender, text)
+                    latency = time.perf_counter() - start
+                    results.append({"sender": sender, "text": text, "module": label, "latency": latency,
+                                    "response": response})
+    return results
+
+
+def latency_by_module(results):
+    """Return module -> sorted latencies of the messages it handled."""
+    by_module = {}
+    for result in results:
+        by_module.setdefault(result["module"], []).append(result["latency"])
+    for latencies in by_module.values():
+        latencies.sort()
+    return by_module
+
+
+def median(ordered):
+    return ordered[len(ordered) // 2]
+
+
+def report(results):
+    """Print message counts and latency percentiles per module."""
+    from simulator import percentiles
+
+    print(f"  {'module':<24} {'messages':>8}   latency")
+    for module, latencies in sorted(latency_by_module(results).items()):
+        summary = "  ".join(f"{key} {value * 1e6:.0f} us" for key, value in percentiles(latencies).items())
+        print(f"  {module:<24} {len(latencies):>8}   {summary}")
+
+
+def compare(old, new, threshold=SLOWDOWN_THRESHOLD, max_diffs=MAX_DIFFS):
+    """
+    Print median latency per module and the responses that changed between two replays.
+    Returns True if nothing regressed: no response changed and no module got slower than the threshold.
+    """
+    ok = True
+    if [(r["sender"], r["text"]) for r in old] != [(r["sender"], r["text"]) for r in new]:
+        print("The replays did not handle the same messages; were they made from the same capture?")
+        return False
+
+    old_latency = latency_by_module(old)
+    new_latency = latency_by_module(new)
+    print(f"  {'module':<24} {'messages':>8} {'old p50':>10} {'new p50':>10}   change")
+    for module in sorted(set(old_latency) | set(new_latency)):
+        before = old_latency.get(module)
+        after = new_latency.get(module)
+        if not before or not after:
+            print(f"  {module:<24} {len(before or after):>8}   only in the {'old' if before else 'new'} replay")
+            continue
+        change = median(after) / median(before) - 1 if median(before) else 0.0
+        flag = "  SLOWER" if change > threshold else ""
+        ok = ok and not flag
+        print(f"  {module:<24} {len(after):>8} {median(before) * 1e6:>7.0f} us {median(after) * 1e6:>7.0f} us"
+              f"   {change:+.0%}{flag}")
+
+    changed = [(index, before, after) for index, (before, after) in enumerate(zip(old, new))
+               if before["response"] != after["response"]]
+    print(f"  {len(changed)} of {len(new)} responses changed")
+    for index, before, after in changed[:max_diffs]:
+        print(f"\n  #{index} {after['sender']} in {before['module']}: {after['text']!r}")
+        diff = difflib.unified_diff((before["response"] or "").splitlines(), (after["response"] or "").splitlines(),
+                                    "old", "new", lineterm="")
+        for line in diff:
+            print(f"    {line}")
+    return ok and not changed
+
+
+def save_results(path, results, capture, speed, seed):
+    temp_path = path + ".tmp"
+    with open(temp_path, "w") as results_file:
+        json.dump({"capture": capture, "speed": speed, "seed": seed, "messages": results}, results_file)
+    os.replace(temp_path, path)
+
+
+def load_results(path):
+    with open(path, "r") as results_file:
+        return json.load(results_file)["messages"]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay captured packets and compare replays.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    replay_parser = commands.add_parser("replay", help="Replay a capture against this build")
+    replay_parser.add_argument("capture", help="Capture file; its rotated files are read first")
+    replay_parser.add_argument("--speed", type=float, default=0,
+                               help="0 for as fast as possible (default), 1 for the captured pace, 2 for twice as fast")
+    replay_parser.add_argument("--seed", type=int, default=REPLAY_SEED, help="Seed for module randomness")
+    replay_parser.add_argument("--out", help="Save the responses and latencies here for compare")
+    compare_parser = commands.add_parser("compare", help="Compare two saved replays")
+    compare_parser.add_argument("old")
+    compare_parser.add_argument("new")
+    compare_parser.add_argument("--threshold", type=float, default=SLOWDOWN_THRESHOLD,
+                                help="Median latency growth reported as a slowdown (default 0.25 for 25%%)")
+    compare_parser.add_argument("--max-diffs", type=int, default=MAX_DIFFS, help="Changed responses to show")
+    args = parser.parse_args()
+
+    if args.command == "replay":
+        if not capture_files(args.capture):
+            parser.error(f"No capture found at '{args.capture}'")
+        logging.disable(logging.INFO)  # The interface logs every packet at INFO
+        start = time.monotonic()
+        results = replay(read_capture(args.capture), speed=args.speed, seed=args.seed)
+        print(f"Replayed {len(results)} messages in {time.monotonic() - start:.1f} s")
+        report(results)
+        if args.out:
+            save_results(args.out, results, args.capture, args.speed, args.seed)
+    else:
+        ok = compare(load_results(args.old), load_results(args.new), args.threshold, args.max_diffs)
+        sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
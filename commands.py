@@ -0,0 +1,60 @@
+import functools
+
+COMMAND_CACHE_SIZE = 4096  # Distinct messages kept parsed; most traffic is menu numbers and a few verbs
+
+# Spellings that mean the same command everywhere
+ALIASES = {
+    "cd..": "cd ..",
+    "..": "cd ..",
+}
+
+
+class Command(str):
+    """
+    An inbound message, parsed once by the BBS and handed to every module.
+
+    It is still the original text, so it compares and prints like a plain
+    string, and it also carries:
+        normalized  lowercase, whitespace collapsed, aliases resolved
+        tokens      the words of the normalized text
+        verb        the first word, or "" for an empty message
+        args        the remaining words
+        rest        the original text after the first word, case preserved
+        number      the value if the message is a whole number, otherwise None
+
+    Commands are cached and shared between users, so treat them as read-only.
+    """
+
+    def __repr__(self):
+        return f"Command({str.__repr__(self)})"
+
+
+@functools.lru_cache(maxsize=COMMAND_CACHE_SIZE)
+def _parse(text):
+    command = Command(text)
+    normalized = " ".join(text.lower().split())
+    normalized = ALIASES.get(normalized, normalized)
+    command.normalized = normalized
+    command.tokens = tuple(normalized.split())
+    command.verb = command.tokens[0] if command.tokens else ""
+    command.args = command.tokens[1:]
+    parts = text.strip().split(None, 1)
+    command.rest = parts[1] if len(parts) > 1 else ""
+    try:
+        command.number = int(normalized)
+    except ValueError:
+        command.number = None
+    return command
+
+
+def parse_command(text):
+    """Return the parsed Command for a message. The same text always gives the same object."""
+    if isinstance(text, Command):
+        return text
+    return _parse(text)
+
+
+def cache_stats():
+    """Return how often messages were found already parsed."""
+    info = _parse.cache_info()
+    return {"hits": info.hits, "misses": info.misses, "cached": info.currsize}
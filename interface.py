@@ -1,14 +1,34 @@
 import json
 import os
 import logging
+import random
+import threading
 from meshtastic.serial_interface import SerialInterface
 from pubsub import pub
 import time
 import requests
+from work_queue import WorkQueue, POLICY_REJECT
+from send_scheduler import SendScheduler, CHANNEL_BITRATE, DUTY_CYCLE, MAX_PAYLOAD_BYTES
+from caches import DuplicateFilter, DUPLICATE_CAPACITY, DUPLICATE_WINDOW, ReplyCache, REPLY_TTL
+from presence import PresenceTable, PRESENCE_FILE, ONLINE_WINDOW, PRESENCE_FLUSH_INTERVAL, PRESENCE_RETENTION
+from telemetry import (TelemetrySink, TELEMETRY_FILE, TELEMETRY_FORMAT, FLUSH_INTERVAL, MAX_FILE_BYTES,
+                       MAX_PENDING_RECORDS)
+from positions import PositionIndex, CELL_DEGREES
+from capture import PacketCapture, CAPTURE_MAX_BYTES, CAPTURE_BACKUPS, MAX_PENDING_PACKETS
+from metrics import MetricsRegistry, MetricsExporter, METRICS_INTERVAL, METRICS_HOST
 
 CONFIG_FILE = "meshtastic_config.json"
 LOG_FILE = "listener.log"
 
+# Defaults for the inbound work queue, overridable in the configuration file
+WORKER_THREADS = 4
+QUEUE_SIZE = 256
+QUEUE_POLICY = POLICY_REJECT
+
+# Reconnection backoff after the radio link is lost, in seconds
+RECONNECT_DELAY = 1
+RECONNECT_MAX_DELAY = 300
+
 # Configure logging
 logging.basicConfig(
     level=logging.INFO,
@@ -22,28 +42,132 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 class Interface:
-    def __init__(self):
+    def __init__(self, config=None, radio=SerialInterface, clock=None):
         self.interface = None
+        self.clock = clock  # Replaces the wall and timer clocks when replaying a capture; None for real time
         self.handle_message = None  # Callback for message handling
+        self.reply_place = None  # Callback naming where a command would run, for the reply cache
+        self.config = self.load_config() if config is None else config
+        self.radio = radio  # Called as radio(devPath=...) to open the link; the simulator passes a fake
 
-    def load_device_path(self):
-        """Load the device path from the configuration file."""
+        # The main loop sleeps on this event until the link drops or stop() is called
+        self.wakeup = threading.Event()
+        self.stopping = threading.Event()
+        self.wakeups = 0  # Times the main loop woke up
+        self.reconnects = 0
+
+        # Counters and latency histograms, exported for Prometheus
+        self.metrics = MetricsRegistry()
+        self.packets_received = self.metrics.counter(
+            "packets_received_total", "Packets received from the radio, by kind", labels=("kind",))
+        self.transmit_failures = self.metrics.counter(
+            "transmit_failures_total", "Packets the radio failed to send")
+
+        # Messages are handled on worker threads so the radio thread never waits on a module
+        self.work_queue = WorkQueue(
+            self.process_message,
+            workers=self.config.get("worker_threads", WORKER_THREADS),
+            max_pending=self.config.get("queue_size", QUEUE_SIZE),
+            policy=self.config.get("queue_policy", QUEUE_POLICY),
+            name="message-worker",
+        )
+
+        # Replies are fragmented and paced to the channel's airtime budget
+        self.send_scheduler = SendScheduler(
+            self.transmit,
+            bitrate=self.config.get("channel_bitrate", CHANNEL_BITRATE),
+            duty_cycle=self.config.get("duty_cycle", DUTY_CYCLE),
+            max_payload=self.config.get("max_payload_bytes", MAX_PAYLOAD_BYTES),
+        )
+
+        # Rebroadcast and retried packets are dropped before any handling
+        self.duplicates = DuplicateFilter(
+            capacity=self.config.get("duplicate_capacity", DUPLICATE_CAPACITY),
+            window=self.config.get("duplicate_window", DUPLICATE_WINDOW),
+        )
+
+        # A command repeated right away is answered from here without running it again
+        self.replies = ReplyCache(ttl=self.config.get("reply_cache_ttl", REPLY_TTL))
+
+        # Last time each node was heard, used to show who is online
+        self.presence = PresenceTable(
+            path=self.config.get("presence_file", PRESENCE_FILE),
+            window=self.config.get("online_window", ONLINE_WINDOW),
+            flush_interval=self.config.get("presence_flush_interval", PRESENCE_FLUSH_INTERVAL),
+            retention=self.config.get("presence_retention", PRESENCE_RETENTION),
+            clock=clock or time.time,
+        )
+
+        # Position reports are buffered and written to disk in batches
+        self.telemetry = TelemetrySink(
+            path=self.config.get("telemetry_file", TELEMETRY_FILE),
+            file_format=self.config.get("telemetry_format", TELEMETRY_FORMAT),
+            flush_interval=self.config.get("telemetry_flush_interval", FLUSH_INTERVAL),
+            max_bytes=self.config.get("telemetry_max_bytes", MAX_FILE_BYTES),
+            max_pending=self.config.get("telemetry_max_pending", MAX_PENDING_RECORDS),
+            write_latency=self.metrics.histogram(
+                "telemetry_write_seconds", "Time to write one batch of position reports"),
+        )
+
+        # Latest position of every node, indexed for nearby-node queries
+        self.positions = PositionIndex(cell_degrees=self.config.get("position_cell_degrees", CELL_DEGREES),
+                                       clock=clock or time.time)
+
+        # Received packets are optionally recorded for replay against other builds
+        capture_file = self.config.get("capture_file")
+        self.capture = PacketCapture(
+            path=capture_file,
+            max_bytes=self.config.get("capture_max_bytes", CAPTURE_MAX_BYTES),
+            backups=self.config.get("capture_backups", CAPTURE_BACKUPS),
+            max_pending=self.config.get("capture_max_pending", MAX_PENDING_PACKETS),
+        ) if capture_file else None
+
+        # Components that keep their own counters are read only when the metrics are exported
+        self.metrics.register_stats("work_queue", self.work_queue.stats,
+                                    counters=("submitted", "processed", "rejected", "dropped", "errors"))
+        self.metrics.register_stats("send", self.send_scheduler.stats,
+                                    counters=("sent_fragments", "sent_bytes", "throttled", "airtime_seconds"))
+        self.metrics.register_stats("duplicates", self.duplicates.stats, counters=("hits", "misses", "evictions"))
+        self.metrics.register_stats("reply_cache", self.replies.stats, counters=("hits", "misses"))
+        self.metrics.register_stats("telemetry", self.telemetry.stats,
+                                    counters=("records", "batches", "rotations", "errors", "dropped"))
+        if self.capture:
+            self.metrics.register_stats("capture", self.capture.stats,
+                                        counters=("packets", "batches", "rotations", "errors", "dropped"))
+        self.metrics.register_stats("loop", self.loop_stats, counters=("wakeups", "reconnects", "cpu_seconds"))
+        self.metrics.gauge("nodes_heard", "Nodes in the presence table", function=lambda: len(self.presence))
+        self.metrics.register_stats("presence", self.presence.stats, counters=("pruned",))
+        self.metrics_exporter = MetricsExporter(
+            self.metrics,
+            path=self.config.get("metrics_file"),
+            interval=self.config.get("metrics_interval", METRICS_INTERVAL),
+            port=self.config.get("metrics_port"),
+            host=self.config.get("metrics_host", METRICS_HOST),
+        )
+
+    def load_config(self):
+        """Load the configuration file, returning an empty config if it is missing or invalid."""
         if not os.path.exists(CONFIG_FILE):
-            logger.error(f"Configuration file '{CONFIG_FILE}' not found. Please run setup.py to create it.")
-            return None
+            return {}
 
         try:
             with open(CONFIG_FILE, "r") as config_file:
-                config = json.load(config_file)
-                device_path = config.get("device_path")
-                if not device_path:
-                    logger.error(f"'device_path' not found in '{CONFIG_FILE}'.")
-                    return None
-                logger.info(f"Loaded device path from config: {device_path}")
-                return device_path
+                return json.load(config_file)
         except Exception as e:
             logger.error(f"Error reading configuration file '{CONFIG_FILE}': {e}")
+            return {}
+
+    def load_device_path(self):
+        """Load the device path from the configuration file."""
+        device_path = self.config.get("device_path")
+        if not device_path:
+            if not os.path.exists(CONFIG_FILE):
+                logger.error(f"Configuration file '{CONFIG_FILE}' not found. Please run setup.py to create it.")
+            else:
+                logger.error(f"'device_path' not found in '{CONFIG_FILE}'.")
             return None
+        logger.info(f"Loaded device path from config: {device_path}")
+        return device_path
 
     def connect(self):
         """Attempt to connect to the Meshtastic device."""
@@ -55,42 +179,89 @@ class Interface:
         logger.info(f"Attempting to connect to the Meshtastic device at {device_path}...")
         try:
             # Initialize the SerialInterface object with the specified device path
-            self.interface = SerialInterface(devPath=device_path)
+            self.interface = self.radio(devPath=device_path)
             logger.info(f"Successfully connected to Meshtastic device on {device_path}")
             pub.subscribe(self.on_receive, "meshtastic.receive")
+            pub.subscribe(self.on_connection_lost, "meshtastic.connection.lost")
         except Exception as e:
             logger.error(f"Failed to connect to Meshtastic device: {e}")
             self.interface = None
 
     def disconnect(self):
         """Safely disconnect the Meshtastic device."""
-        if self.interface:
+        interface, self.interface = self.interface, None  # Later events from it are ignored
+        if interface:
             try:
                 logger.info("Disconnecting Meshtastic device...")
-                self.interface.close()
+                interface.close()
                 logger.info("Disconnected successfully.")
             except Exception as e:
                 logger.error(f"Error during disconnection: {e}")
-            finally:
-                self.interface = None
+
+    def reconnect(self):
+        """Reconnect to the device with exponential backoff and jitter until it succeeds or we stop."""
+        self.disconnect()
+        delay = self.config.get("reconnect_delay", RECONNECT_DELAY)
+        max_delay = self.config.get("reconnect_max_delay", RECONNECT_MAX_DELAY)
+        attempt = 0
+        while not self.stopping.is_set():
+            # Jitter keeps several nodes restarted by the same outage from retrying in lockstep
+            wait = min(max_delay, delay * 2 ** attempt) * random.uniform(0.5, 1.0)
+            logger.info(f"Reconnecting in {wait:.1f} seconds (attempt {attempt + 1})...")
+            if self.stopping.wait(wait):
+                return
+            self.connect()
+            if self.interface:
+                self.reconnects += 1
+                logger.info("Reconnected to the Meshtastic device.")
+                return
+            attempt += 1
+
+    def on_connection_lost(self, interface):
+        """Wake the main loop when the current radio link drops."""
+        if interface is self.interface:
+            logger.warning("Connection to the Meshtastic device lost.")
+            self.wakeup.set()
+
+    def stop(self):
+        """Ask the main loop to shut down."""
+        self.stopping.set()
+        self.wakeup.set()
+
+    def loop_stats(self):
+        """Return main loop counters, used to check that the loop stays idle."""
+        return {
+            "wakeups": self.wakeups,
+            "reconnects": self.reconnects,
+            "cpu_seconds": round(time.process_time(), 3),
+        }
 
     def on_receive(self, packet, interface):
         """Handle incoming messages and telemetry data."""
         try:
+            if self.capture:
+                self.capture.record(packet)  # Before any filtering, so a replay sees what the radio delivered
+            sender = packet.get("fromId", None)
+            packet_id = packet.get("id", None)
+            if packet_id is not None and self.duplicates.seen((sender, packet_id)):
+                self.packets_received.labels("duplicate").inc()
+                logger.debug(f"Dropped duplicate packet {packet_id} from {sender}")
+                return
+            if sender:
+                self.presence.heard(sender)  # Any packet shows the node is on the air
+
             decoded = packet.get("decoded", {})
             text = decoded.get("text", None)
-            sender = packet.get("fromId", None)
+            position = packet.get("position", None)
+            self.packets_received.labels("text" if text else "position" if position else "other").inc()
 
             # Handle standard text messages
             if text and sender:
                 logger.info(f"Message received from {sender}: {text}")
-                if self.handle_message:
-                    response = self.handle_message(sender, text)
-                    if response:
-                        self.send_message(sender, response)
+                if not self.work_queue.submit(sender, text):
+                    logger.warning(f"Message queue full, dropped message from {sender}")
 
             # Handle telemetry data
-            position = packet.get("position", None)
             if position:
                 latitude = position.get("latitude", None)
                 longitude = position.get("longitude", None)
@@ -99,6 +270,8 @@ class Interface:
 
                 if latitude and longitude:
                     logger.info(f"Telemetry received from {sender}: Latitude: {latitude}, Longitude: {longitude}")
+                    if sender:
+                        self.positions.update(sender, latitude, longitude, altitude, time)
                     self.log_telemetry(sender, latitude, longitude, altitude, time)
 
                 if altitude:
@@ -110,23 +283,55 @@ class Interface:
         except Exception as e:
             logger.error(f"Error processing received message: {e}")
 
+    def process_message(self, sender, text):
+        """
+        Run a queued message through the message handler and send the reply.
+        A command repeated from where it left the user is a retry: its cached
+        reply is resent without running it again. Runs on a worker thread, so
+        the cache check never holds up the radio.
+        """
+        if self.handle_message:
+            place = self.cache_place(sender, text)
+            cached = self.replies.lookup(sender, text, place) if place is not None else None
+            if cached:
+                logger.info(f"Repeated command from {sender}, resending cached reply")
+                self.send_message(sender, cached)
+                return
+            response = self.handle_message(sender, text)
+            if place is not None:
+                place = self.cache_place(sender, text)  # Where the command left the user
+            if response and place is not None:
+                self.replies.store(sender, text, response, place)
+            else:
+                self.replies.forget(sender)  # A repeat must not get the reply to an earlier command
+            if response:
+                self.send_message(sender, response)
+
+    def cache_place(self, sender, text):
+        """Return where the sender is for their command, or None if its reply must not be cached."""
+        return self.reply_place(sender, text) if self.reply_place else ()
+
     def send_message(self, user_id, message):
-        """Send a message back to the user."""
+        """Queue a message to be sent back to the user."""
+        fragments = self.send_scheduler.enqueue(user_id, message)
+        logger.info(f"Queued message to {user_id} in {fragments} fragment(s)")
+
+    def transmit(self, user_id, message):
+        """Send a single packet-sized message to the user."""
+        if not self.interface:
+            logger.warning(f"Not connected, dropped message to {user_id}")
+            return
         try:
             destination = int(user_id.lstrip("!"), 16)  # Remove `!` and convert to int
             self.interface.sendText(message, destinationId=destination)
             logger.info(f"Sent message to {user_id}: {message}")
         except Exception as e:
+            self.transmit_failures.inc()
             logger.error(f"Failed to send message to {user_id}: {e}")
 
     def log_telemetry(self, sender, latitude, longitude, altitude, timestamp):
-        """Log telemetry data to a CSV file."""
-        try:
-            with open("telemetry_log.csv", "a") as log_file:
-                log_file.write(f"{sender},{latitude},{longitude},{altitude},{timestamp}\n")
-            logger.info("Telemetry data logged successfully.")
-        except Exception as e:
-            logger.error(f"Error logging telemetry data: {e}")
+        """Buffer telemetry data for the background telemetry writer."""
+        self.telemetry.record(sender, latitude, longitude, altitude, timestamp)
 
     def run(self):
         """Run the interface."""
@@ -136,16 +341,38 @@ class Interface:
                 logger.error("Could not connect to the Meshtastic device. Exiting...")
                 return
 
+            self.send_scheduler.start()
+            self.work_queue.start()
+            self.presence.start()
+            self.telemetry.start()
+            if self.capture:
+                self.capture.start()
+            self.metrics_exporter.start()
             logger.info("Listening for messages... Press Ctrl+C to exit.")
-            while self.interface:  # Continue listening while connected
-                time.sleep(0.01)  # Prevent high CPU usage
+            while not self.stopping.is_set():
+                self.wakeup.wait()  # Sleep until the link drops or stop() is called
+                self.wakeup.clear()
+                self.wakeups += 1
+                if not self.stopping.is_set():
+                    self.reconnect()
         except Exception as e:
             logger.warning(f"Connection lost: {e}")
         except KeyboardInterrupt:
             logger.info("Shutting down on Ctrl+C...")
         finally:
+            self.work_queue.stop()
+            self.send_scheduler.stop()
+            self.presence.close()
+            self.telemetry.close()  # Write out buffered records
+            if self.capture:
+                self.capture.close()
+            self.metrics_exporter.close()  # Writes the final values
             self.disconnect()
-            logger.info("Interface stopped.")
+            logger.info(f"Interface stopped. Queue stats: {self.work_queue.stats()}, "
+                        f"send stats: {self.send_scheduler.stats()}, "
+                        f"duplicate stats: {self.duplicates.stats()}, "
+                        f"reply cache stats: {self.replies.stats()}, "
+                        f"loop stats: {self.loop_stats()}")
 
 if __name__ == "__main__":
     interface = Interface()
@@ -0,0 +1,405 @@
+import logging
+import math
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+logger = logging.getLogger(__name__)
+
+frexp = math.frexp  # Looked up once; used on every histogram sample
+ceil = math.ceil
+
+METRICS_INTERVAL = 15  # Seconds between writes of the metrics file
+METRICS_HOST = "127.0.0.1"  # The HTTP endpoint only listens locally unless configured otherwise
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"  # Prometheus text exposition format
+
+# Histogram buckets: SUB_BUCKETS linear steps per power of two between LOWEST and HIGHEST,
+# so every bucket is at most 1/SUB_BUCKETS of its value wide (HDR-style log-linear buckets)
+SUB_BUCKETS = 4
+LOWEST = 1e-6  # 1 microsecond
+HIGHEST = 60.0  # Larger values are only counted in the +Inf bucket
+
+
+class Shard(threading.local):
+    """The calling thread's shard of a metric, created the first time the thread touches it."""
+
+    def __init__(self, metric):
+        self.values = metric._new_shard()
+
+
+class Sharded:
+    """
+    Per-thread storage for a metric. Each thread updates its own shard (a
+    list of numbers) without taking a lock; readers add up all the shards.
+    """
+
+    __slots__ = ("_local", "_shards", "_shards_lock", "_size")
+
+    def __init__(self, size):
+        self._shards = []
+        self._shards_lock = threading.Lock()
+        self._size = size
+        self._local = Shard(self)
+
+    def _new_shard(self):
+        shard = [0] * self._size
+        with self._shards_lock:
+            self._shards.append(shard)
+        return shard
+
+    def _totals(self):
+        with self._shards_lock:
+            shards = list(self._shards)
+        return [sum(values) for values in zip(*shards)] if shards else [0] * self._size
+
+
+class Counter(Sharded):
+    """A value that only goes up."""
+
+    __slots__ = ()
+
+    def __init__(self):
+        super().__init__(1)
+
+    def inc(self, amount=1):
+        self._local.values[0] += amount
+
+    def get(self):
+        return self._totals()[0]
+
+
+class Gauge:
+    """A value that goes up and down, or is read from a function when exported."""
+
+    __slots__ = ("value", "function", "_lock")
+
+    def __init__(self, function=None):
+        self.value = 0
+        self.function = function
+        self._lock = threading.Lock()
+
+    def set(self, value):
+        self.value = value
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+    def dec(self, amount=1):
+        with self._lock:
+            self.value -= amount
+
+    def get(self):
+        return self.function() if self.function else self.value
+
+
+class Histogram(Sharded):
+    """
+    Distribution of observed values in log-linear buckets.
+
+    The bucket of a value comes straight from its floating point exponent and
+    mantissa, so recording costs the same whatever the value, and relative
+    precision is the same from microseconds to minutes. A shard holds one
+    count per bucket, the count above the highest bound, then the sum.
+    """
+
+    __slots__ = ("_min_exponent", "_sub_buckets", "_scale", "_offset", "_last")
+
+    def __init__(self, lowest=LOWEST, highest=HIGHEST, sub_buckets=SUB_BUCKETS):
+        self._min_exponent = math.frexp(lowest)[1]
+        self._sub_buckets = sub_buckets
+        self._scale = 2 * sub_buckets  # Mantissas run from 0.5 to 1
+        self._offset = -(self._min_exponent + 1) * sub_buckets - 1  # So the lowest bucket is 0
+        octaves = math.frexp(highest)[1] - self._min_exponent + 1
+        self._last = octaves * sub_buckets - 1
+        super().__init__(self._last + 3)
+
+    def observe(self, value):
+        shard = self._local.values
+        if value > 0:
+            mantissa, exponent = frexp(value)
+            # Rounding up keeps a value that is exactly on a bound in the bucket it bounds, as "le" means
+            index = exponent * self._sub_buckets + ceil(mantissa * self._scale) + self._offset
+            if index < 0:
+                index = 0
+            elif index > self._last:
+                index = self._last + 1
+        else:
+            index = 0
+        shard[index] += 1
+        shard[-1] += value
+
+    def upper_bound(self, index):
+        """Return the largest value counted in a bucket."""
+        octave, step = divmod(index, self._sub_buckets)
+        return math.ldexp(0.5 + (step + 1) / self._scale, self._min_exponent + octave)
+
+    def snapshot(self):
+        """Return (bucket counts, count, sum); the last bucket count is for values above the highest bound."""
+        totals = self._totals()
+        counts = totals[:-1]
+        return counts, sum(counts), totals[-1]
+
+    def buckets(self, counts=None):
+        """Return (upper bound, cumulative count) for every bucket, ending with +Inf."""
+        if counts is None:
+            counts = self.snapshot()[0]
+        cumulative = 0
+        result = []
+        for index, count in enumerate(counts[:-1]):
+            cumulative += count
+            result.append((self.upper_bound(index), cumulative))
+        result.append((math.inf, cumulative + counts[-1]))
+        return result
+
+    def quantile(self, q, counts=None):
+        """Return the upper bound of the bucket holding the q-th quantile, or None without samples."""
+        if counts is None:
+            counts = self.snapshot()[0]
+        rank = q * sum(counts)
+        if not rank:
+            return None
+        seen = 0
+        for index, count in enumerate(counts):
+            seen += count
+            if seen >= rank and count:
+                return self.upper_bound(index) if index <= self._last else math.inf
+        return math.inf
+
+    def get(self):
+        counts, count, total = self.snapshot()
+        return {"count": count, "sum": total, "p50": self.quantile(0.5, counts), "p99": self.quantile(0.99, counts)}
+
+
+class Metric:
+    """A named metric: one child per combination of label values, or a single child without labels."""
+
+    def __init__(self, kind, name, help_text, labels, factory):
+        self.kind = kind
+        self.name = name
+        self.help = help_text
+        self.label_names = tuple(labels)
+        self._factory = factory
+        self._children = {}  # label values -> Counter, Gauge or Histogram
+        self._lock = threading.Lock()
+        self._default = None if self.label_names else self.labels()
+
+    def labels(self, *values):
+        """Return the child for these label values, creating it on first use."""
+        child = self._children.get(values)
+        if child is None:
+            with self._lock:
+                child = self._children.get(values)
+                if child is None:
+                    child = self._children[values] = self._factory()
+        return child
+
+    def children(self):
+        with self._lock:
+            return list(self._children.items())
+
+    # Shortcuts for metrics without labels
+    def inc(self, amount=1):
+        self._default.inc(amount)
+
+    def dec(self, amount=1):
+        self._default.dec(amount)
+
+    def set(self, value):
+        self._default.set(value)
+
+    def observe(self, value):
+        self._default.observe(value)
+
+    def get(self):
+        return self._default.get()
+
+
+class MetricsRegistry:
+    """
+    The metrics of one BBS.
+
+    Hot paths record into counters and histograms; everything that already
+    keeps its own counters (queues, caches, sessions) is registered as a stats
+    function and only read when the metrics are exported.
+    """
+
+    def __init__(self, prefix="meshboard"):
+        self.prefix = prefix
+        self._metrics = {}  # name -> Metric, in registration order
+        self._stats = []  # (name prefix, stats function, keys exported as counters)
+        self._lock = threading.Lock()
+
+    def _register(self, kind, name, help_text, labels, factory):
+        name = f"{self.prefix}_{name}"
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = Metric(kind, name, help_text, labels, factory)
+            elif metric.kind != kind or metric.label_names != tuple(labels):
+                raise ValueError(f"Metric '{name}' is already registered as a different {metric.kind}")
+        return metric
+
+    def counter(self, name, help_text, labels=()):
+        """Return the counter with this name, registering it the first time. Name counters '..._total'."""
+        return self._register("counter", name, help_text, labels, Counter)
+
+    def gauge(self, name, help_text, labels=(), function=None):
+        """Return the gauge with this name. With a function, its value is read only when exported."""
+        return self._register("gauge", name, help_text, labels, lambda: Gauge(function))
+
+    def histogram(self, name, help_text, labels=(), lowest=LOWEST, highest=HIGHEST, sub_buckets=SUB_BUCKETS):
+        """Return the histogram with this name, registering it the first time."""
+        return self._register("histogram", name, help_text, labels, lambda: Histogram(lowest, highest, sub_buckets))
+
+    def register_stats(self, name, stats, counters=()):
+        """
+        Export the dict returned by a stats() method as <prefix>_<name>_<key>.
+        Keys listed in counters only ever go up and are exported as counters; the rest are gauges.
+        """
+        with self._lock:
+            self._stats.append((f"{self.prefix}_{name}", stats, frozenset(counters)))
+
+    def render(self):
+        """Return every metric in the Prometheus text exposition format."""
+        lines = []
+        with self._lock:
+            metrics = list(self._metrics.values())
+            stats = list(self._stats)
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for values, child in metric.children():
+                labels = dict(zip(metric.label_names, values))
+                if metric.kind == "histogram":
+                    counts, count, total = child.snapshot()
+                    for bound, cumulative in child.buckets(counts):
+                        lines.append(f"{metric.name}_bucket{format_labels(labels, le=bound)} {cumulative}")
+                    lines.append(f"{metric.name}_sum{format_labels(labels)} {format_value(total)}")
+                    lines.append(f"{metric.name}_count{format_labels(labels)} {count}")
+                else:
+                    try:
+                        value = child.get()
+                    except Exception as e:
+                        logger.error(f"Error reading metric '{metric.name}': {e}")
+                        continue
+                    lines.append(f"{metric.name}{format_labels(labels)} {format_value(value)}")
+        for name, function, counters in stats:
+            try:
+                values = function()
+            except Exception as e:
+                logger.error(f"Error reading stats for '{name}': {e}")
+                continue
+            for key, value in values.items():
+                if not isinstance(value, (int, float)) or isinstance(value, bool):
+                    continue
+                kind = "counter" if key in counters else "gauge"
+                metric_name = f"{name}_{key}_total" if kind == "counter" else f"{name}_{key}"
+                lines.append(f"# TYPE {metric_name} {kind}")
+                lines.append(f"{metric_name} {format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+def format_value(value):
+    if isinstance(value, int):
+        return str(value)
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value))
+
+
+def escape_label(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def format_labels(labels, le=None):
+    """Format label values as {name="value",...}, escaped for the text format."""
+    pairs = [f'{name}="{escape_label(value)}"' for name, value in labels.items()]
+    if le is not None:
+        pairs.append(f'le="{format_value(le)}"')
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class MetricsExporter:
+    """
+    Publishes a registry for Prometheus: written to a text file every interval
+    (for node_exporter's textfile collector), served over HTTP, or both.
+    """
+
+    def __init__(self, registry, path=None, interval=METRICS_INTERVAL, port=None, host=METRICS_HOST):
+        self.registry = registry
+        self.path = path
+        self.interval = interval
+        self.port = port
+        self.host = host
+        self._stop = threading.Event()
+        self._thread = None
+        self._server = None
+        self._server_thread = None
+        self.writes = 0
+        self.requests = 0
+
+    def start(self):
+        """Start the file writer and the HTTP endpoint, whichever are configured."""
+        if self.path and not self._thread:
+            self._thread = threading.Thread(target=self._run, name="metrics-writer", daemon=True)
+            self._thread.start()
+        if self.port and not self._server:
+            try:
+                self._server = ThreadingHTTPServer((self.host, self.port), self._handler())
+            except OSError as e:
+                logger.error(f"Could not serve metrics on {self.host}:{self.port}: {e}")
+                return
+            self._server_thread = threading.Thread(target=self._server.serve_forever, name="metrics-http", daemon=True)
+            self._server_thread.start()
+            logger.info(f"Serving metrics on http://{self.host}:{self._server.server_address[1]}/metrics")
+
+    def close(self):
+        """Stop the writer and the HTTP endpoint, writing the file one last time."""
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server_thread.join()
+            self._server = None
+        if self.path:
+            self.write()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.write()
+
+    def write(self):
+        """Write the metrics file, replacing the previous one at once so readers never see half of it."""
+        temp_path = self.path + ".tmp"
+        try:
+            with open(temp_path, "w") as metrics_file:
+                metrics_file.write(self.registry.render())
+            os.replace(temp_path, self.path)
+            self.writes += 1
+        except OSError as e:
+            logger.error(f"Error writing metrics file '{self.path}': {e}")
+
+    def _handler(self):
+        exporter = self
+
+        class MetricsHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] not in ("/", "/metrics"):
+                    self.send_error(404)
+                    return
+                body = exporter.registry.render().encode("utf-8")
+                exporter.requests += 1
+                self.send_response(200)
+                self.send_header("Content-Type", CONTENT_TYPE)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                logger.debug(f"Metrics request from {self.client_address[0]}: {format % args}")
+
+        return MetricsHandler
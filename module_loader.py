@@ -0,0 +1,194 @@
+import ast
+import importlib
+import importlib.util
+import json
+import os
+import sys
+import threading
+
+MANIFEST_FILE = ".manifest.json"  # Cached scan results, stored in the modules folder
+RELOAD_INTERVAL = 2  # Seconds between checks for changed module files
+
+
+def scan_module(path):
+    """
+    Read a module's menu_name and entry points from its source without importing it.
+    Returns a dict describing the module, with "menu_name" set to None if it is not a menu module.
+    """
+    info = {"menu_name": None, "process_command": False, "display_menu": False}
+    try:
+        with open(path, "r", encoding="utf-8") as source:
+            tree = ast.parse(source.read(), filename=path)
+    except (OSError, SyntaxError, ValueError) as e:
+        info["error"] = str(e)
+        return info
+
+    for node in tree.body:
+        if isinstance(node, ast.Assign) and isinstance(node.value, ast.Constant) and isinstance(node.value.value, str):
+            if any(isinstance(target, ast.Name) and target.id == "menu_name" for target in node.targets):
+                info["menu_name"] = node.value.value.strip()
+        elif isinstance(node, ast.FunctionDef) and node.name in ("process_command", "display_menu"):
+            info[node.name] = True
+    return info
+
+
+class ModuleManifest:
+    """Scan results for every module file, reused while the file's mtime and size are unchanged."""
+
+    def __init__(self, modules_folder):
+        self.path = os.path.join(modules_folder, MANIFEST_FILE)
+        self.entries = {}
+        self.changed = False
+        self.scanned = 0  # Files parsed during this run
+        try:
+            with open(self.path, "r") as manifest:
+                self.entries = json.load(manifest)
+        except (OSError, ValueError):
+            self.entries = {}
+
+    def lookup(self, path, key):
+        """Return the scan result for a file, scanning it only if it changed."""
+        stat = os.stat(path)
+        entry = self.entries.get(key)
+        if entry and entry["mtime"] == stat.st_mtime and entry["size"] == stat.st_size:
+            return entry["info"]
+
+        info = scan_module(path)
+        self.entries[key] = {"mtime": stat.st_mtime, "size": stat.st_size, "info": info}
+        self.changed = True
+        self.scanned += 1
+        return info
+
+    def save(self, keep):
+        """Write the manifest back if anything changed, dropping files that no longer exist."""
+        stale = set(self.entries) - set(keep)
+        for key in stale:
+            del self.entries[key]
+        if not self.changed and not stale:
+            return
+        try:
+            temp_path = self.path + ".tmp"
+            with open(temp_path, "w") as manifest:
+                json.dump(self.entries, manifest)
+            os.replace(temp_path, self.path)
+        except OSError as e:
+            print(f"Could not save module manifest: {e}")
+
+
+class LazyModule:
+    """
+    Stand-in for a menu module that imports it on first use.
+    Attribute access is forwarded to the real module once it is loaded.
+    """
+
+    def __init__(self, import_name, menu_name, path):
+        self.__name__ = import_name
+        self.menu_name = menu_name
+        self.path = path
+        self.mtime = os.stat(path).st_mtime
+        self.retired = False  # Set when the file is removed or no longer a menu module
+        self._module = None
+        self._error = None
+        self._lock = threading.Lock()
+
+    def load(self):
+        """Import the module if needed. Returns None if the import failed."""
+        if self._module is None and self._error is None:
+            with self._lock:
+                if self._module is None and self._error is None:
+                    try:
+                        self._module = importlib.import_module(self.__name__)
+                        print(f"Imported module: {self.menu_name}")
+                    except Exception as e:
+                        self._error = e
+                        print(f"Error loading module '{self.__name__}': {e}")
+        return self._module
+
+    @property
+    def loaded(self):
+        return self._module is not None
+
+    def reload(self, menu_name, mtime):
+        """
+        Load the changed file as a fresh module object and swap it in.
+        The old module keeps serving until the new one has executed without
+        errors, so a broken file never replaces working code. The new module
+        may define on_reload(old_module) to carry over module-level state.
+        """
+        with self._lock:
+            old_module = self._module
+            self.menu_name = menu_name
+            self.mtime = mtime
+            self._error = None
+            if old_module is None:
+                return  # Never imported; the next use picks up the new code
+
+            spec = importlib.util.spec_from_file_location(self.__name__, self.path)
+            module = importlib.util.module_from_spec(spec)
+            spec.loader.exec_module(module)  # Raises on errors, leaving the old module in place
+            if hasattr(module, "on_reload"):
+                module.on_reload(old_module)
+            sys.modules[self.__name__] = module
+            self._module = module
+
+    def __getattr__(self, name):
+        if name.startswith("__") or name in ("_module", "_error", "_lock"):
+            raise AttributeError(name)  # Not forwarded, so copying or pickling cannot recurse
+        module = self.load()
+        if module is None:
+            raise AttributeError(f"module '{self.__name__}' could not be imported: {self._error}")
+        return getattr(module, name)
+
+    def __repr__(self):
+        state = "loaded" if self._module is not None else "not loaded"
+        return f"<LazyModule {self.__name__} ({state})>"
+
+
+class ModuleWatcher:
+    """Background thread that polls module files and reports when any of them change."""
+
+    def __init__(self, modules_folder, on_change, interval=RELOAD_INTERVAL):
+        self.modules_folder = modules_folder
+        self.on_change = on_change  # Called with no arguments after files change
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = None
+        self._mtimes = self.scan()
+
+    def scan(self):
+        """Return the mtime of every module file, one folder level deep like the loader."""
+        mtimes = {}
+        for root, dirs, files in os.walk(self.modules_folder):
+            if root == self.modules_folder:
+                dirs[:] = [name for name in dirs if not name.startswith("__")]
+            else:
+                dirs[:] = []  # Submenu folders are not searched any deeper
+            for name in files:
+                if name.endswith(".py") and not name.startswith("__"):
+                    path = os.path.join(root, name)
+                    try:
+                        mtimes[path] = os.stat(path).st_mtime
+                    except OSError:
+                        pass  # Removed while we were scanning
+        return mtimes
+
+    def start(self):
+        if not self._thread:
+            self._thread = threading.Thread(target=self._run, name="module-watcher", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            mtimes = self.scan()
+            if mtimes != self._mtimes:
+                self._mtimes = mtimes
+                try:
+                    self.on_change()
+                except Exception as e:
+                    print(f"Error reloading modules: {e}")
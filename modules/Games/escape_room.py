@@ -1,4 +1,7 @@
+from types import MappingProxyType
+
 menu_name = "Escape Room"  # Required for module loading
+uncached_commands = ("north", "south", "east", "west", "go", "move")  # Moves are never answered from the reply cache
 
 def display_menu():
     # Display the introduction and instructions for the Escape Room game
@@ -9,41 +12,66 @@ def display_menu():
         "'cd ..' to return to the main menu."
     )
 
+def freeze(value):
+    """Turn nested dicts and lists into read-only mappings and tuples."""
+    if isinstance(value, dict):
+        return MappingProxyType({key: freeze(item) for key, item in value.items()})
+    if isinstance(value, list):
+        return tuple(freeze(item) for item in value)
+    return value
+
+# The world is shared by every player and never changes; each player only keeps what they changed
+WORLD = freeze({
+    "start": {
+        "description": "You are in a locked room. There is a door to the north, a table in the corner, and a painting on the wall.",
+        "objects": {
+            "table": "An old wooden table with a drawer.",
+            "painting": "A painting of a landscape; it seems slightly askew."
+        },
+        "items": [],
+        "exits": {"north": "locked_door", "east": "hidden_room"}
+    },
+    "locked_door": {
+        "description": "A locked door blocks your way. You see a keyhole.",
+        "objects": {"door": "The door is locked. There’s a keyhole."},
+        "items": [],
+        "exits": {"south": "start"}
+    },
+    "hidden_room": {
+        "description": "You have entered a hidden room. There is a chest in the center and a bookshelf against the wall.",
+        "objects": {
+            "chest": "An old chest with a combination lock.",
+            "bookshelf": "A dusty bookshelf filled with various books."
+        },
+        "items": [],
+        "exits": {"west": "start"}
+    }
+})
+
 def init_game():
-    """Initialize the game state."""
+    """
+    Initialize the game state: only the player's changes to the shared world.
+    "inventory" (items collected), "moved" (item -> room it was put in, or None
+    once picked up) and "flags" (such as "door_unlocked") are added when first needed.
+    """
+    return {"current_room": "start"}  # Start room
+
+def upgrade_game(game):
+    """Convert a game saved with a full copy of the rooms to the delta format."""
     return {
-        "current_room": "start",  # Start room
-        "inventory": [],  # Items collected by the player
-        "rooms": {
-            "start": {
-                "description": "You are in a locked room. There is a door to the north, a table in the corner, and a painting on the wall.",
-                "objects": {
-                    "table": "An old wooden table with a drawer.",
-                    "painting": "A painting of a landscape; it seems slightly askew."
-                },
-                "items": {},
-                "exits": {"north": "locked_door", "east": "hidden_room"}
-            },
-            "locked_door": {
-                "description": "A locked door blocks your way. You see a keyhole.",
-                "objects": {"door": "The door is locked. There’s a keyhole."},
-                "items": {},
-                "exits": {"south": "start"}
-            },
-            "hidden_room": {
-                "description": "You have entered a hidden room. There is a chest in the center and a bookshelf against the wall.",
-                "objects": {
-                    "chest": "An old chest with a combination lock.",
-                    "bookshelf": "A dusty bookshelf filled with various books."
-                },
-                "items": {},
-                "exits": {"west": "start"}
-            }
-        },
-        "door_unlocked": False,  # Track if the door is unlocked
-        "chest_unlocked": False  # Track if the chest is unlocked
+        "current_room": game["current_room"],
+        "inventory": list(game["inventory"]),
+        "moved": {item: room for room, data in game["rooms"].items() for item in data.get("items", {})},
+        "flags": [flag for flag in ("door_unlocked", "chest_unlocked") if game.get(flag)],
     }
 
+def room_items(room, game):
+    """Items in a room: those the world puts there and that were not moved, plus any moved in."""
+    moved = game.get("moved", {})
+    items = [item for item in WORLD[room]["items"] if item not in moved]
+    items.extend(item for item, place in moved.items() if place == room)
+    return items
+
 def process_command(user_id, command, bbs_system):
     """Handle commands for the Escape Room game."""
     # Check if the user exists in the system, and initialize user state if not
@@ -55,21 +83,18 @@ def process_command(user_id, command, bbs_system):
     # Initialize the game if not already done
     if "escape_room" not in user_state:
         user_state["escape_room"] = init_game()
+    elif "rooms" in user_state["escape_room"]:
+        user_state["escape_room"] = upgrade_game(user_state["escape_room"])
 
     game = user_state["escape_room"]
 
-    # Return to the main menu if the user types 'cd ..'
-    if command.strip().lower() == "cd ..":
-        bbs_system.users[user_id]["menu"].pop()
-        return bbs_system.display_menu(user_id)
-
-    # Normalize command input and parse the action and target
-    parts = command.strip().lower().replace("go ", "").replace("move ", "").split(" ", 1)
-    action = parts[0]
-    target = parts[1] if len(parts) > 1 else None
+    # The BBS has already split the command into words; 'go' and 'move' before a direction are optional
+    words = command.tokens[1:] if command.verb in ("go", "move") else command.tokens
+    action = words[0] if words else ""
+    target = " ".join(words[1:]) or None
 
     current_room = game["current_room"]
-    room_data = game["rooms"][current_room]
+    room_data = WORLD[current_room]
 
     # Handle directional movement
     if action in ["north", "south", "east", "west"]:
@@ -88,7 +113,7 @@ def process_command(user_id, command, bbs_system):
     # Handle picking up items
     if action == "pick" and target and target.startswith("up"):
         item = target[3:].strip()
-        return pick_up_item(item, room_data, game)
+        return pick_up_item(item, current_room, game)
 
     # Handle using items
     if action == "use" and target:
@@ -96,7 +121,7 @@ def process_command(user_id, command, bbs_system):
 
     # Handle displaying the inventory
     if action == "inventory":
-        return f"Inventory: {', '.join(game['inventory']) if game['inventory'] else 'Empty'}"
+        return f"Inventory: {', '.join(game['inventory']) if game.get('inventory') else 'Empty'}"
 
     # Display help or handle unrecognized commands
     if action == "help" or action not in ["north", "south", "east", "west", "examine", "pick", "use", "inventory"]:
@@ -118,13 +143,13 @@ def move_player(direction, game):
     """Handle player movement."""
     # Determine if the player can move in the given direction
     current_room = game["current_room"]
-    exits = game["rooms"][current_room].get("exits", {})
+    exits = WORLD[current_room].get("exits", {})
     if direction in exits:
         # Check if the door is locked before moving
-        if exits[direction] == "locked_door" and not game["door_unlocked"]:
+        if exits[direction] == "locked_door" and "door_unlocked" not in game.get("flags", ()):
             return "The door is locked. You need to unlock it first."
         game["current_room"] = exits[direction]
-        return f"You moved {direction}.\n\n{game['rooms'][game['current_room']]['description']}"
+        return f"You moved {direction}.\n\n{WORLD[game['current_room']]['description']}"
     else:
         return "You can't go that way."
 
@@ -135,15 +160,15 @@ def examine_object(target, room_data, game):
         if target == "table":
             return "An old wooden table with a drawer. Maybe you should open the drawer."
         elif target == "drawer":
-            if "key" not in game["inventory"]:
-                room_data["items"]["key"] = "A rusty key inside the drawer."
+            if "key" not in game.get("inventory", ()):
+                game.setdefault("moved", {})["key"] = game["current_room"]
                 return "You opened the drawer and found a rusty key."
             else:
                 return "The drawer is empty."
         elif target == "painting":
             return "A painting of a landscape; it seems slightly askew. Perhaps you should adjust it."
         elif target == "chest":
-            if not game["chest_unlocked"]:
+            if "chest_unlocked" not in game.get("flags", ()):
                 return "An old chest with a combination lock. Maybe there's a clue nearby."
             else:
                 return "The chest is open. Inside, you see a shiny gem."
@@ -154,13 +179,12 @@ def examine_object(target, room_data, game):
     else:
         return "You don't see that here."
 
-def pick_up_item(item, room_data, game):
+def pick_up_item(item, room, game):
     """Handle picking up items."""
     # Check if the item is available in the room
-    items = room_data.get("items", {})
-    if item in items:
-        game["inventory"].append(item)
-        del items[item]
+    if item in room_items(room, game):
+        game.setdefault("inventory", []).append(item)
+        game.setdefault("moved", {})[item] = None
         return f"You picked up {item}."
     else:
         return "You can't pick that up."
@@ -168,8 +192,10 @@ def pick_up_item(item, room_data, game):
 def use_item(target, game):
     """Handle using items."""
     # Check if the user can use the item in the current context
-    if "key" in target and "key" in game["inventory"] and game["current_room"] == "locked_door":
-        game["door_unlocked"] = True
+    if "key" in target and "key" in game.get("inventory", ()) and game["current_room"] == "locked_door":
+        flags = game.setdefault("flags", [])
+        if "door_unlocked" not in flags:
+            flags.append("door_unlocked")
         return "You used the key to unlock the door! You can now go north."
     else:
         return "You can't use that here."
@@ -1,21 +1,40 @@
-import time
 import math
+import random
+import threading
+
+try:
+    import numpy as np
+except ImportError:  # Distances fall back to one haversine call per player
+    np = None
 
 menu_name = "Hot Cold"  # Required for module loading
+cache_replies = False  # Replies show the running round, so a repeat asks for the latest state
 
 #The goal of "Hot Cold" is to locate a hidden target location on the map using distance-based feedback such as "warmer," "colder," or "HOT!" The first player to get within 10 feet (~3 meters) of the target wins the game.
 
+EARTH_RADIUS = 6371e3  # Meters
+ROUND_DURATIONS = {"1": 30, "2": 60}  # Seconds per round for each start option
+DEFAULT_TARGET = (35.652832, -97.478095)  # Used when the starting player's position is unknown
+HIDE_RADIUS = 200  # The target is hidden up to this many meters from the starting player
+WIN_DISTANCE = 3  # Meters from the target that count as found
+MAX_ROUNDS = 40  # A game nobody wins ends after this many rounds
+
+current_game = None  # The game everyone joins; one runs at a time
+game_lock = threading.Lock()
+
 def display_menu():
     return "Welcome to Hot Cold!\n" \
-           "Set the game duration (in seconds) and find the hidden location!\n" \
+           "Set the round duration (in seconds) and find the hidden location!\n" \
+           "Everyone playing gets warmer/colder updates from their node's position after each round.\n" \
            "Use commands:\n" \
-           "1. Start 30 seconds\n" \
-           "2. Start 60 seconds\n" \
+           "1. Start or join with 30 second rounds\n" \
+           "2. Start or join with 60 second rounds\n" \
+           "'leave' to stop playing.\n" \
            "'cd ..' to return to the main menu."
 
 def haversine(lat1, lon1, lat2, lon2):
     """Calculate the distance in meters between two latitude/longitude points."""
-    R = 6371e3  # Radius of the Earth in meters
+    R = EARTH_RADIUS
     phi1 = math.radians(lat1)
     phi2 = math.radians(lat2)
     delta_phi = math.radians(lat2 - lat1)
@@ -24,77 +43,174 @@ def haversine(lat1, lon1, lat2, lon2):
     c = 2 * math.atan2(math.sqrt(a), math.sqrt(1 - a))
     return R * c
 
-def process_command(user_id, command, bbs_system):
-    """Handle commands for the Hot Cold game."""
-    if user_id not in bbs_system.users:
-        bbs_system.users[user_id] = {}
-
-    user_state = bbs_system.users[user_id]
-    
-    # Initialize or reset the game state
-    if "hot_cold" not in user_state:
-        user_state["hot_cold"] = {
-            "target_location": (35.652832, -97.478095),  # Example target (lat, lon)
-            "durations": {"1": 30, "2": 60},
-            "player_distances": {},
-            "timer": None
-        }
-
-    game = user_state["hot_cold"]
-
-    if command.strip().lower() == "cd ..":
-        bbs_system.users[user_id]["menu"].pop()
-        return bbs_system.display_menu(user_id)
-
-    if command in game["durations"]:
-        duration = game["durations"][command]
-        game["timer"] = time.time() + duration  # Set the timer
-        return f"Hot Cold game started! You have {duration} seconds per round."
-
-    if not game["timer"]:
-        return "No game in progress. Start a game first!"
-
-    # Check remaining time
-    remaining_time = game["timer"] - time.time()
-    if remaining_time <= 0:
-        return handle_game_update(user_id, bbs_system)
-
-    return f"Time remaining: {int(remaining_time)} seconds."
-
-def handle_game_update(user_id, bbs_system):
-    """Process the game update at the end of each round."""
-    user_state = bbs_system.users[user_id]
-    game = user_state["hot_cold"]
-
-    # Example positions: these should come from the interface
-    player_positions = {
-        "!user1": (35.652000, -97.478000),  # Example lat/lon
-        "!user2": (35.651500, -97.477500),
-    }
-
-    target_lat, target_lon = game["target_location"]
-
-    # Calculate distances and determine "warmer" or "colder"
-    messages = []
-    for player_id, (player_lat, player_lon) in player_positions.items():
-        distance = haversine(target_lat, target_lon, player_lat, player_lon)
-        prev_distance = game["player_distances"].get(player_id, float("inf"))
-
-        if player_id not in game["player_distances"]:
-            messages.append(f"Player {player_id}: {int(distance)} meters from the target.")
-        else:
-            if distance < prev_distance:
-                messages.append(f"Player {player_id}: Warmer! {int(distance)} meters away.")
+def distances_to(target, points):
+    """Distances in meters from the target to every (lat, lon) point, computed in one batched pass."""
+    if not points:
+        return []
+    target_lat, target_lon = target
+    if np is None:
+        return [haversine(target_lat, target_lon, lat, lon) for lat, lon in points]
+    coords = np.radians(np.asarray(points, dtype=float))
+    phi1 = math.radians(target_lat)
+    phi2 = coords[:, 0]
+    delta_phi = phi2 - phi1
+    delta_lambda = coords[:, 1] - math.radians(target_lon)
+    a = np.sin(delta_phi / 2) ** 2 + math.cos(phi1) * np.cos(phi2) * np.sin(delta_lambda / 2) ** 2
+    return (EARTH_RADIUS * 2 * np.arctan2(np.sqrt(a), np.sqrt(1 - a))).tolist()
+
+def hide_target(near):
+    """Pick a target within HIDE_RADIUS meters of a (lat, lon) point."""
+    if not near:
+        return DEFAULT_TARGET
+    lat, lon = near
+    distance = HIDE_RADIUS * math.sqrt(random.random())  # Uniform over the disc
+    bearing = random.uniform(0, 2 * math.pi)
+    delta_lat = distance * math.cos(bearing) / EARTH_RADIUS
+    delta_lon = distance * math.sin(bearing) / (EARTH_RADIUS * max(math.cos(math.radians(lat)), 1e-6))
+    return lat + math.degrees(delta_lat), lon + math.degrees(delta_lon)
+
+class HotColdGame:
+    """
+    One shared game. At the end of every round each player's live position is
+    looked up, all distances to the target are computed together, and every
+    player is sent their own warmer/colder update.
+    """
+
+    def __init__(self, target, duration, locate, send, timers):
+        self.target = target
+        self.duration = duration
+        self.timers = timers  # The BBS's shared timer wheel ends each round
+        self.locate = locate  # player_id -> (lat, lon) or None
+        self.send = send  # Called with (player_id, message) to push an update
+        self.players = {}  # player_id -> distance at the end of the last round, or None
+        self.round = 0
+        self.round_ends = None
+        self.finished = False
+        self._timer = None
+        self._lock = threading.Lock()
+
+    def join(self, player_id):
+        with self._lock:
+            self.players.setdefault(player_id, None)
+
+    def leave(self, player_id):
+        """Remove a player, ending the game when nobody is left."""
+        with self._lock:
+            self.players.pop(player_id, None)
+            if not self.players:
+                self._finish()
+
+    def start(self):
+        with self._lock:
+            self._schedule()
+
+    def remaining(self):
+        return max(0, int(self.round_ends - self.timers.clock())) if self.round_ends else 0
+
+    def _schedule(self):
+        if self._timer:
+            self._timer.cancel()  # The round was ended early
+        self.round_ends = self.timers.clock() + self.duration
+        self._timer = self.timers.schedule(self.duration, self.end_round)
+
+    def _finish(self):
+        self.finished = True
+        if self._timer:
+            self._timer.cancel()
+            self._timer = None
+
+    def stop(self):
+        with self._lock:
+            self._finish()
+
+    def end_round(self):
+        """Score the round, push an update to every player and start the next round. Returns the updates."""
+        with self._lock:
+            if self.finished:
+                return {}
+            self.round += 1
+            located = []
+            updates = {}
+            for player_id in self.players:
+                position = self.locate(player_id)
+                if position:
+                    located.append((player_id, position))
+                else:
+                    updates[player_id] = f"Round {self.round}: no position from your node yet. Share your position to play."
+
+            winner = None
+            for (player_id, _), distance in zip(located, distances_to(self.target, [position for _, position in located])):
+                previous = self.players[player_id]
+                if previous is None:
+                    updates[player_id] = f"Round {self.round}: {int(distance)} meters from the target."
+                elif distance < previous:
+                    updates[player_id] = f"Round {self.round}: Warmer! {int(distance)} meters away."
+                else:
+                    updates[player_id] = f"Round {self.round}: Colder! {int(distance)} meters away."
+                self.players[player_id] = distance
+                if distance <= WIN_DISTANCE and (winner is None or distance < winner[1]):
+                    winner = (player_id, distance)
+
+            if winner:
+                announcement = f"HOT! Player {winner[0]} found the target in round {self.round}!"
+                updates = {player_id: announcement for player_id in self.players}
+                self._finish()
+            elif self.round >= MAX_ROUNDS:
+                for player_id in self.players:
+                    updates[player_id] += "\nGame over, nobody found the target."
+                self._finish()
             else:
-                messages.append(f"Player {player_id}: Colder! {int(distance)} meters away.")
+                self._schedule()
 
-        game["player_distances"][player_id] = distance
+        for player_id, message in updates.items():
+            self.send(player_id, message)
+        return updates
 
-        # Check if a player is within 10 feet (3 meters)
-        if distance <= 3:
-            return f"HOT! Player {player_id} found the target!"
+def on_reload(old_module):
+    """Keep the running game when this module is hot reloaded."""
+    global current_game
+    current_game = old_module.current_game
 
-    # Reset the timer for the next round
-    game["timer"] = time.time() + game["durations"]["1"]  # Default to 30 seconds
+def live_position(bbs_system):
+    """Return a function looking up a player's (lat, lon) from the interface's position feed."""
+    positions = getattr(getattr(bbs_system, "interface", None), "positions", None)
 
-    return "\n".join(messages)
+    def locate(player_id):
+        position = positions.get(player_id) if positions is not None else None
+        return (position[0], position[1]) if position else None
+    return locate
+
+def push(bbs_system):
+    def send(player_id, message):
+        bbs_system.interface.send_message(player_id, message)
+    return send
+
+def process_command(user_id, command, bbs_system):
+    """Handle commands for the Hot Cold game."""
+    global current_game
+    with game_lock:
+        game = current_game if current_game and not current_game.finished else None
+
+        if command.normalized in ROUND_DURATIONS:
+            if game:
+                game.join(user_id)
+                return f"Joined the game with {len(game.players)} player(s). " \
+                       f"Round {game.round + 1} ends in {game.remaining()} seconds."
+            locate = live_position(bbs_system)
+            duration = ROUND_DURATIONS[command.normalized]
+            current_game = HotColdGame(hide_target(locate(user_id)), duration, locate, push(bbs_system),
+                                       bbs_system.timers)
+            current_game.join(user_id)
+            current_game.start()
+            return f"Hot Cold game started! You have {duration} seconds per round."
+
+        if command.normalized == "leave":
+            if not game or user_id not in game.players:
+                return "You are not in a game."
+            game.leave(user_id)
+            return "You left the game."
+
+    if not game or user_id not in game.players:
+        return "No game in progress. Start a game first!" if not game else "A game is running. Enter 1 or 2 to join it."
+
+    return f"Round {game.round + 1}: {game.remaining()} seconds remaining."
@@ -1,48 +1,273 @@
 import random
+import threading
+from collections import OrderedDict
 
 menu_name = "Tic Tac Toe"  # Required for module loading
 
+# The board is two 9-bit masks, one per player; bit i is cell i + 1
+FULL_BOARD = 0b111111111
+WINNING_MASKS = (
+    0b000000111, 0b000111000, 0b111000000,  # Rows
+    0b001001001, 0b010010010, 0b100100100,  # Columns
+    0b100010001, 0b001010100,  # Diagonals
+)
+# Indexed by a player's mask: True if it contains a winning line
+IS_WIN = tuple(any(mask & line == line for line in WINNING_MASKS) for mask in range(FULL_BOARD + 1))
+# Indexed by the occupied mask: the cells still free
+FREE_CELLS = tuple(tuple(cell for cell in range(9) if not mask >> cell & 1) for mask in range(FULL_BOARD + 1))
+
+# Chance that the computer plays a perfect move rather than a random one
+DIFFICULTIES = {"1": ("Easy", 0.3), "2": ("Medium", 0.7), "3": ("Perfect", 1.0)}
+
+LOBBY_TIMEOUT = 300  # Seconds a node waits in the lobby for an opponent
+MATCH_IDLE_TIMEOUT = 600  # Seconds without a move before a match between nodes is abandoned
+
 def display_menu():
     return "Welcome to Tic Tac Toe!\n" \
-           "1. Player vs Player\n" \
+           "1. Player vs Player (another node)\n" \
            "2. Player vs Computer\n" \
            "'cd ..' to return to the main menu."
 
 def init_game(mode):
     """Initialize a new game state."""
     return {
-        "board": [" "] * 9,  # 3x3 board as a list
-        "current_player": "X",  # X always starts
-        "winner": None,
+        "x": 0,  # Cells taken by X, as a bitmask
+        "o": 0,  # Cells taken by O
         "turns": 0,
-        "mode": mode  # "pvp" or "pvc"
+        "mode": mode,  # "pvc"; games between nodes live in the match table
+        "difficulty": None,  # Chosen after "pvc" is selected
     }
 
-def render_board(board):
+def render_board(x, o):
     """Render the game board as ASCII art with double underscores for empty cells."""
-    formatted_board = [cell if cell != " " else "__" for cell in board]
-    return f" {formatted_board[0]} | {formatted_board[1]} | {formatted_board[2]} \n" \
+    cells = ["X" if x >> cell & 1 else "O" if o >> cell & 1 else "__" for cell in range(9)]
+    return f" {cells[0]} | {cells[1]} | {cells[2]} \n" \
            "---+---+---\n" \
-           f" {formatted_board[3]} | {formatted_board[4]} | {formatted_board[5]} \n" \
+           f" {cells[3]} | {cells[4]} | {cells[5]} \n" \
            "---+---+---\n" \
-           f" {formatted_board[6]} | {formatted_board[7]} | {formatted_board[8]} "
+           f" {cells[6]} | {cells[7]} | {cells[8]} "
 
-def check_winner(board):
+def check_winner(x, o):
     """Check if there's a winner on the board."""
-    winning_combinations = [
-        (0, 1, 2), (3, 4, 5), (6, 7, 8),  # Rows
-        (0, 3, 6), (1, 4, 7), (2, 5, 8),  # Columns
-        (0, 4, 8), (2, 4, 6)  # Diagonals
-    ]
-    for combo in winning_combinations:
-        if board[combo[0]] == board[combo[1]] == board[combo[2]] and board[combo[0]] != " ":
-            return board[combo[0]]  # Return the winner ("X" or "O")
+    if IS_WIN[x]:
+        return "X"
+    if IS_WIN[o]:
+        return "O"
     return None
 
-def computer_move(board):
-    """Choose a move for the computer."""
-    available_positions = [i for i, cell in enumerate(board) if cell == " "]
-    return random.choice(available_positions)
+def solve(x, o, table):
+    """
+    Score every position reachable from (x, o) with minimax, from the view of
+    the player to move: 1 for a win, 0 for a draw, -1 for a loss. Stores the
+    score and the best moves of each unfinished position in the table.
+    """
+    key = x | o << 9
+    if key in table:
+        return table[key][0]
+    x_to_move = bin(x).count("1") == bin(o).count("1")
+    mover = x if x_to_move else o
+    best_score, best_moves = -2, []
+    for cell in FREE_CELLS[x | o]:
+        after = mover | 1 << cell
+        if IS_WIN[after]:
+            score = 1
+        elif bin(x | o).count("1") == 8:
+            score = 0  # That move filled the board
+        else:
+            score = -solve(after, o, table) if x_to_move else -solve(x, after, table)
+        if score > best_score:
+            best_score, best_moves = score, [cell]
+        elif score == best_score:
+            best_moves.append(cell)
+    table[key] = (best_score, tuple(best_moves))
+    return best_score
+
+# Perfect play for every reachable position: (x | o << 9) -> (score, best cells)
+BEST_MOVES = {}
+solve(0, 0, BEST_MOVES)
+
+def computer_move(x, o, skill=1.0):
+    """Choose a move for the computer: a perfect move with probability skill, otherwise any free cell."""
+    if random.random() < skill:
+        return random.choice(BEST_MOVES[x | o << 9][1])
+    return random.choice(FREE_CELLS[x | o])
+
+class MatchTable:
+    """
+    Games between two mesh nodes, shared by all sessions.
+
+    Matches are keyed by match id, with an index from each player to their
+    match, so a move finds its game and its opponent without looking at any
+    other session. Moves are pushed to the opponent through the outbound
+    queue, and a timer on the BBS's timer wheel removes idle matches and
+    lobby entries.
+    """
+
+    def __init__(self, send, timers):
+        self.send = send  # Called with (user_id, message) to push to a node
+        self.timers = timers
+        self.matches = {}  # match_id -> match state
+        self.by_player = {}  # user_id -> match_id
+        self.waiting = OrderedDict()  # user_id -> lobby timeout, longest waiting first
+        self._next_id = 1
+        self._lock = threading.RLock()
+
+    def match_for(self, user_id):
+        match_id = self.by_player.get(user_id)
+        return self.matches.get(match_id) if match_id is not None else None
+
+    def join_lobby(self, user_id):
+        """Pair the user with a waiting node, or add them to the lobby. Returns the new match or None."""
+        pushes = []
+        with self._lock:
+            if user_id in self.waiting:
+                return None
+            opponent = next(iter(self.waiting), None)
+            if opponent is None:
+                self.waiting[user_id] = self.timers.schedule(LOBBY_TIMEOUT, self._lobby_timeout, user_id)
+                return None
+            self.waiting.pop(opponent).cancel()
+            match = {"id": str(self._next_id), "X": opponent, "O": user_id, "x": 0, "o": 0,
+                     "current_player": "X", "turns": 0, "timer": None}
+            self._next_id += 1
+            self.matches[match["id"]] = match
+            self.by_player[opponent] = self.by_player[user_id] = match["id"]
+            self._touch(match)
+            pushes.append((opponent, f"Matched with {user_id} in Tic Tac Toe!\n\n{render_board(0, 0)}\n\n"
+                                     "You are X and move first. Enter 1-9 in the Tic Tac Toe menu."))
+        self._push(pushes)
+        return match
+
+    def leave_lobby(self, user_id):
+        with self._lock:
+            timer = self.waiting.pop(user_id, None)
+        if timer:
+            timer.cancel()
+        return timer is not None
+
+    def move(self, user_id, position):
+        """Play a cell for the user. Returns the reply for the mover; the opponent is sent their update."""
+        pushes = []
+        with self._lock:
+            match = self.match_for(user_id)
+            if match is None:
+                return "You are not in a match."
+            mark = "X" if match["X"] == user_id else "O"
+            opponent = match["O" if mark == "X" else "X"]
+            if match["current_player"] != mark:
+                return f"It's {opponent}'s turn. You'll get a message when they move."
+            if (match["x"] | match["o"]) >> position & 1:
+                return "That spot is already taken. Choose another."
+
+            match[mark.lower()] |= 1 << position
+            match["turns"] += 1
+            board = render_board(match["x"], match["o"])
+            if check_winner(match["x"], match["o"]):
+                self._end(match)
+                pushes.append((opponent, f"{board}\n\n{user_id} wins as {mark}. Better luck next time!"))
+                reply = f"{board}\n\nCongratulations! You win!"
+            elif match["turns"] == 9:
+                self._end(match)
+                pushes.append((opponent, f"{board}\n\nIt's a draw!"))
+                reply = f"{board}\n\nIt's a draw!"
+            else:
+                match["current_player"] = "O" if mark == "X" else "X"
+                self._touch(match)
+                pushes.append((opponent, f"{user_id} played {position + 1}.\n\n{board}\n\n"
+                                         f"Your move as {match['current_player']}: enter 1-9."))
+                reply = f"{board}\n\nWaiting for {opponent} to move."
+        self._push(pushes)
+        return reply
+
+    def resign(self, user_id):
+        with self._lock:
+            match = self.match_for(user_id)
+            if match is None:
+                return False
+            opponent = match["O"] if match["X"] == user_id else match["X"]
+            self._end(match)
+        self._push([(opponent, f"{user_id} left the Tic Tac Toe match. You win!")])
+        return True
+
+    def _touch(self, match):
+        """Restart the idle timeout after a move."""
+        if match["timer"]:
+            match["timer"].cancel()
+        match["timer"] = self.timers.schedule(MATCH_IDLE_TIMEOUT, self._idle_timeout, match["id"])
+
+    def _end(self, match):
+        if match["timer"]:
+            match["timer"].cancel()
+        del self.matches[match["id"]]
+        for player in (match["X"], match["O"]):
+            self.by_player.pop(player, None)
+
+    def _idle_timeout(self, match_id):
+        with self._lock:
+            match = self.matches.get(match_id)
+            if match is None:
+                return
+            self._end(match)
+        message = f"Tic Tac Toe match abandoned after {MATCH_IDLE_TIMEOUT // 60} minutes without a move."
+        self._push([(match["X"], message), (match["O"], message)])
+
+    def _lobby_timeout(self, user_id):
+        with self._lock:
+            if self.waiting.pop(user_id, None) is None:
+                return
+        self._push([(user_id, "No opponent joined Tic Tac Toe. Enter 1 to wait again.")])
+
+    def _push(self, pushes):
+        for user_id, message in pushes:
+            self.send(user_id, message)
+
+    def stats(self):
+        return {"matches": len(self.matches), "waiting": len(self.waiting)}
+
+match_table = None
+match_table_lock = threading.Lock()
+
+def get_match_table(bbs_system):
+    """The shared match table, created on first use with the BBS's outbound queue and timers."""
+    global match_table
+    with match_table_lock:
+        if match_table is None:
+            match_table = MatchTable(bbs_system.interface.send_message, bbs_system.timers)
+        return match_table
+
+def on_reload(old_module):
+    """Keep running matches and the lobby when this module is hot reloaded."""
+    global match_table
+    match_table = old_module.match_table
+
+def reply_state(user_id, session):
+    """
+    The stage of the user's game for the reply cache, so a retried move gets its reply again.
+    None while choosing a mode or a skill: there the same digit can rightly come twice in a
+    row (pvc "2", then Medium "2").
+    """
+    table = match_table
+    match = table.match_for(user_id) if table else None
+    if match is not None:
+        return "match", match["id"], match["turns"]
+    if table and user_id in table.waiting:
+        return "lobby"
+    game = session.get("tic_tac_toe")
+    if game is None or game.get("difficulty") is None:
+        return None
+    return "pvc", game["turns"]
+
+def play_match(user_id, command, table):
+    """Handle input from a user who is in a match with another node."""
+    if command.normalized in ("quit", "resign"):
+        table.resign(user_id)
+        return "You left the match."
+    if command.number is None:
+        return "Invalid input! Enter a number between 1 and 9, or 'quit' to leave the match."
+    position = command.number - 1  # Convert input to board index
+    if position < 0 or position > 8:
+        return "Invalid move! Choose a number between 1 and 9."
+    return table.move(user_id, position)
 
 def process_command(user_id, command, bbs_system):
     """Handle commands for the Tic Tac Toe game."""
@@ -51,67 +276,74 @@ def process_command(user_id, command, bbs_system):
 
     user_state = bbs_system.users[user_id]
 
+    # Matches against other nodes are kept in the shared table, not in the session
+    table = get_match_table(bbs_system)
+    if table.match_for(user_id):
+        return play_match(user_id, command, table)
+    if user_id in table.waiting:
+        if command.normalized == "cancel":
+            table.leave_lobby(user_id)
+            return "You left the lobby."
+        return "Still waiting for an opponent. You'll get a message when one joins. 'cancel' to leave the lobby."
+
+    if "tic_tac_toe" in user_state and user_state["tic_tac_toe"].get("mode") != "pvc":
+        del user_state["tic_tac_toe"]  # Saved by an older version with a list board or a same-node game
+
     # Initialize or reset the game based on mode selection
     if "tic_tac_toe" not in user_state:
-        if command == "1":
-            user_state["tic_tac_toe"] = init_game("pvp")
-            return f"Player vs Player mode selected.\n\n{render_board(user_state['tic_tac_toe']['board'])}\n\nX starts. Enter 1-9 to make your move."
-        elif command == "2":
+        if command.number == 1:
+            match = table.join_lobby(user_id)
+            if match is None:
+                return "Waiting for another node to join. You'll get a message when the match starts. " \
+                       "'cancel' to leave the lobby."
+            return f"Matched with {match['X']}!\n\n{render_board(0, 0)}\n\nYou are O. {match['X']} moves first."
+        elif command.number == 2:
             user_state["tic_tac_toe"] = init_game("pvc")
-            return f"Player vs Computer mode selected.\n\n{render_board(user_state['tic_tac_toe']['board'])}\n\nX starts. Enter 1-9 to make your move."
-        elif command.strip().lower() == "cd ..":
-            bbs_system.users[user_id]["menu"].pop()
-            return bbs_system.display_menu(user_id)
+            return "Player vs Computer mode selected.\n" \
+                   "Choose the computer's skill:\n" + \
+                   "\n".join(f"{key}. {name}" for key, (name, _) in DIFFICULTIES.items())
         else:
             return "Invalid choice. Enter '1' for Player vs Player, '2' for Player vs Computer, or 'cd ..' to exit."
 
     game = user_state["tic_tac_toe"]
 
-    if command.strip().lower() == "cd ..":
-        bbs_system.users[user_id]["menu"].pop()
-        return bbs_system.display_menu(user_id)
-
-    if game["winner"]:
-        return f"The game is over! Winner: {game['winner']}\n\n{render_board(game['board'])}\n\nType 'cd ..' to return to the main menu."
-
-    try:
-        position = int(command) - 1  # Convert input to board index
-        if position < 0 or position > 8:
-            return "Invalid move! Choose a number between 1 and 9."
-        if game["board"][position] != " ":
-            return "That spot is already taken. Choose another."
-
-        # Player move
-        game["board"][position] = game["current_player"]
-        game["turns"] += 1
-
-        # Check for a winner
-        winner = check_winner(game["board"])
-        if winner:
-            game["winner"] = winner
-            return f"{render_board(game['board'])}\n\nCongratulations! {winner} wins!\n\nType 'cd ..' to return to the main menu."
-        elif game["turns"] == 9:  # Check for a draw
-            return f"{render_board(game['board'])}\n\nIt's a draw!\n\nType 'cd ..' to return to the main menu."
-
-        # Switch players or let the computer move
-        if game["mode"] == "pvp":
-            game["current_player"] = "O" if game["current_player"] == "X" else "X"
-            return f"{render_board(game['board'])}\n\nNext turn: {game['current_player']}"
-        elif game["mode"] == "pvc":
-            game["current_player"] = "O"
-            computer_pos = computer_move(game["board"])
-            game["board"][computer_pos] = "O"
-            game["turns"] += 1
-
-            # Check for a winner after the computer's move
-            winner = check_winner(game["board"])
-            if winner:
-                game["winner"] = winner
-                return f"{render_board(game['board'])}\n\nComputer wins!\n\nType 'cd ..' to return to the main menu."
-            elif game["turns"] == 9:
-                return f"{render_board(game['board'])}\n\nIt's a draw!\n\nType 'cd ..' to return to the main menu."
-
-            game["current_player"] = "X"
-            return f"{render_board(game['board'])}\n\nYour turn: X"
-    except ValueError:
+    if game["difficulty"] is None:
+        if command.normalized not in DIFFICULTIES:
+            return f"Choose the computer's skill: {', '.join(f'{key} for {name}' for key, (name, _) in DIFFICULTIES.items())}."
+        game["difficulty"] = command.normalized
+        return f"{DIFFICULTIES[command.normalized][0]} computer selected.\n\n{render_board(0, 0)}\n\nX starts. Enter 1-9 to make your move."
+
+    if command.number is None:
         return "Invalid input! Enter a number between 1 and 9."
+    position = command.number - 1  # Convert input to board index
+    if position < 0 or position > 8:
+        return "Invalid move! Choose a number between 1 and 9."
+    if (game["x"] | game["o"]) >> position & 1:
+        return "That spot is already taken. Choose another."
+
+    # Player move
+    game["x"] |= 1 << position
+    game["turns"] += 1
+
+    # Check for a winner; a finished game is cleared so the next choice starts a new one
+    if check_winner(game["x"], game["o"]):
+        del user_state["tic_tac_toe"]
+        return f"{render_board(game['x'], game['o'])}\n\nCongratulations! X wins!\n\nEnter 1 or 2 to play again."
+    elif game["turns"] == 9:  # Check for a draw
+        del user_state["tic_tac_toe"]
+        return f"{render_board(game['x'], game['o'])}\n\nIt's a draw!\n\nEnter 1 or 2 to play again."
+
+    # Let the computer move
+    computer_pos = computer_move(game["x"], game["o"], DIFFICULTIES[game["difficulty"]][1])
+    game["o"] |= 1 << computer_pos
+    game["turns"] += 1
+
+    # Check for a winner after the computer's move
+    if check_winner(game["x"], game["o"]):
+        del user_state["tic_tac_toe"]
+        return f"{render_board(game['x'], game['o'])}\n\nComputer wins!\n\nEnter 1 or 2 to play again."
+    elif game["turns"] == 9:
+        del user_state["tic_tac_toe"]
+        return f"{render_board(game['x'], game['o'])}\n\nIt's a draw!\n\nEnter 1 or 2 to play again."
+
+    return f"{render_board(game['x'], game['o'])}\n\nYour turn: X"
@@ -1,33 +1,267 @@
 import os
 import json
+import atexit
+import bisect
+import heapq
+import threading
+from send_scheduler import MAX_PAYLOAD_BYTES
 
 menu_name = "Address List"  # Required for module loading
+uncached_commands = ("next", "prev")  # Paging twice means two pages, not a retry
 
 # Path to the JSON file, stored in the same directory as this script
 FILE_PATH = os.path.dirname(os.path.abspath(__file__))
 ADDRESS_LIST_FILE = os.path.join(FILE_PATH, "address_list.json")
+FLUSH_INTERVAL = 5  # Seconds between writes of a changed address list
+PAGE_BYTES = MAX_PAYLOAD_BYTES - 60  # Entries per page fit in one packet with the header and hints
 
-def load_address_list():
+def load_address_list(path=ADDRESS_LIST_FILE):
     """Load the address list from storage."""
-    if os.path.exists(ADDRESS_LIST_FILE):
-        with open(ADDRESS_LIST_FILE, "r") as file:
+    if os.path.exists(path):
+        with open(path, "r") as file:
             return json.load(file)
     return {}
 
-def save_address_list(address_list):
-    """Save the address list to storage."""
-    with open(ADDRESS_LIST_FILE, "w") as file:
+def save_address_list(address_list, path=ADDRESS_LIST_FILE):
+    """Save the address list to storage atomically, so a crash never leaves a partial file."""
+    temp_path = path + ".tmp"
+    with open(temp_path, "w") as file:
         json.dump(address_list, file)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(temp_path, path)
+
+class AddressBook:
+    """
+    In-memory address list that is written back to storage in the background.
+    Changes mark the book dirty and a writer thread saves it at most once per
+    flush interval. All methods are safe to call from several worker threads.
+
+    Entries are also kept in two sorted indexes, by node id and by lowercased
+    short name, so pages and prefix searches never walk the whole list.
+    """
+
+    def __init__(self, path=ADDRESS_LIST_FILE, flush_interval=FLUSH_INTERVAL):
+        self.path = path
+        self.flush_interval = flush_interval
+        self._entries = load_address_list(path)
+        self._by_id = sorted(self._entries)
+        self._by_name = sorted((details.get("short_name", "").lower(), user_id)
+                               for user_id, details in self._entries.items() if details.get("short_name"))
+        self._lock = threading.RLock()
+        self._flush_lock = threading.Lock()  # Only one write to storage at a time
+        self._dirty = False
+        self._writer = None
+        self._stopped = threading.Event()
+        self.flushes = 0
+
+    def __contains__(self, user_id):
+        return user_id in self._entries
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, user_id):
+        """Return a copy of a user's entry, or None."""
+        with self._lock:
+            details = self._entries.get(user_id)
+            return dict(details) if details is not None else None
+
+    def items(self):
+        """Return a snapshot of (user_id, details) pairs."""
+        with self._lock:
+            return [(user_id, dict(details)) for user_id, details in self._entries.items()]
+
+    def add(self, user_id, details):
+        """Add a user. Returns False if they are already listed."""
+        with self._lock:
+            if user_id in self._entries:
+                return False
+            self._entries[user_id] = dict(details)
+            bisect.insort(self._by_id, user_id)
+            self._index_name(user_id, details.get("short_name"))
+            self._mark_dirty()
+            return True
+
+    def remove(self, user_id):
+        """Remove a user. Returns False if they were not listed."""
+        with self._lock:
+            details = self._entries.pop(user_id, None)
+            if details is None:
+                return False
+            del self._by_id[bisect.bisect_left(self._by_id, user_id)]
+            self._unindex_name(user_id, details.get("short_name"))
+            self._mark_dirty()
+            return True
+
+    def update(self, user_id, **fields):
+        """Change fields of a listed user. Returns False if they are not listed."""
+        with self._lock:
+            details = self._entries.get(user_id)
+            if details is None:
+                return False
+            if "short_name" in fields:
+                self._unindex_name(user_id, details.get("short_name"))
+                self._index_name(user_id, fields["short_name"])
+            details.update(fields)
+            self._mark_dirty()
+            return True
+
+    def _index_name(self, user_id, short_name):
+        if short_name:
+            bisect.insort(self._by_name, (short_name.lower(), user_id))
+
+    def _unindex_name(self, user_id, short_name):
+        if short_name:
+            key = (short_name.lower(), user_id)
+            index = bisect.bisect_left(self._by_name, key)
+            if index < len(self._by_name) and self._by_name[index] == key:
+                del self._by_name[index]
+
+    def iter_from(self, start=None, query=None):
+        """
+        Yield (user_id, details) in node id order, starting at the first id >= start.
+        With a query, only users whose node id or short name starts with it are
+        included. Callers stop iterating once a page is full, so the cost of a
+        page depends on its size rather than on the size of the list.
+        The lock is only held between entries, never while the caller renders one.
+        """
+        if query is None:
+            with self._lock:
+                index = bisect.bisect_left(self._by_id, start) if start else 0
+            while True:
+                with self._lock:
+                    if index >= len(self._by_id):
+                        return
+                    user_id = self._by_id[index]
+                    details = dict(self._entries[user_id])
+                yield user_id, details
+                index += 1
+
+        query = query.lower()
+        id_prefix = query if query.startswith("!") else "!" + query
+        with self._lock:
+            low = bisect.bisect_left(self._by_id, max(id_prefix, start or ""))
+            high = bisect.bisect_left(self._by_id, id_prefix + "\uffff")
+            first = bisect.bisect_left(self._by_name, (query,))
+            last = bisect.bisect_left(self._by_name, (query + "\uffff",))
+            # Name matches outside the id range, in id order, merged with the id range below
+            by_name = sorted(user_id for _, user_id in self._by_name[first:last]
+                             if not user_id.startswith(id_prefix) and (not start or user_id >= start))
+
+        def id_range(index):
+            while True:
+                with self._lock:
+                    if index >= min(high, len(self._by_id)):
+                        return
+                    user_id = self._by_id[index]
+                yield user_id
+                index += 1
+
+        for user_id in heapq.merge(id_range(low), by_name):
+            details = self.get(user_id)
+            if details is not None:
+                yield user_id, details
+
+    def _mark_dirty(self):
+        """Schedule a background write, starting the writer thread on first use."""
+        self._dirty = True
+        if self._writer is None:
+            self._writer = threading.Thread(target=self._write_behind, name="address-book-writer", daemon=True)
+            self._writer.start()
+
+    def _write_behind(self):
+        while not self._stopped.wait(self.flush_interval):
+            self.flush()
+
+    def flush(self):
+        """Write the address list to storage if it changed since the last write."""
+        with self._flush_lock:
+            with self._lock:
+                if not self._dirty:
+                    return False
+                data = {user_id: dict(details) for user_id, details in self._entries.items()}  # Consistent copy
+                self._dirty = False
+            try:
+                save_address_list(data, self.path)
+            except OSError as e:
+                print(f"Error saving address list: {e}")
+                self._dirty = True  # Try again on the next flush
+                return False
+            self.flushes += 1
+            return True
+
+    def close(self):
+        """Stop the writer thread and write any pending changes."""
+        self._stopped.set()
+        if self._writer is not None:
+            self._writer.join()
+            self._writer = None
+        self.flush()
+
+address_book = AddressBook()
+atexit.register(address_book.close)  # Pending changes survive a clean shutdown
+
+def on_reload(old_module):
+    """Keep using the existing address book when this module is hot reloaded."""
+    global address_book
+    atexit.unregister(address_book.close)
+    address_book = old_module.address_book
 
 def display_menu():
     """Display the Address List menu."""
     return "Address List Module:\n" \
-           "1. View Address List\n" \
+           "1. View Address List ('find <text>' to search)\n" \
            "2. Add Yourself to Address List\n" \
            "3. Remove Yourself from Address List\n" \
-           "4. Toggle Online Status\n" \
+           "4. Show/Hide Your Online Status\n" \
            "'cd ..' to return to the main menu."
 
+def is_online(user_id, details, bbs_system):
+    """A user shows as online if they share their status and their node was heard recently."""
+    presence = getattr(getattr(bbs_system, "interface", None), "presence", None)
+    return details.get("online", True) and presence is not None and presence.is_online(user_id)
+
+def short_name(user_id, bbs_system):
+    """Look up a node's short name in the radio's node database, if connected."""
+    radio = getattr(getattr(bbs_system, "interface", None), "interface", None)
+    nodes = getattr(radio, "nodes", None) or {}
+    return nodes.get(user_id, {}).get("user", {}).get("shortName")
+
+def render_page(view, bbs_system):
+    """
+    Render one packet-sized page of the address list starting at the view's cursor.
+    Remembers where the next page starts so 'next' can continue from there.
+    """
+    lines = []
+    size = 0
+    view["next"] = None
+    for user, details in address_book.iter_from(view["starts"][-1], view["query"]):
+        line = user
+        if details.get("short_name"):
+            line += f" {details['short_name']}"
+        if is_online(user, details, bbs_system):
+            line += " (Online)"
+        line_size = len(line.encode("utf-8")) + 1
+        if lines and size + line_size > PAGE_BYTES:
+            view["next"] = user
+            break
+        lines.append(line)
+        size += line_size
+
+    if not lines:
+        return f"No entries match '{view['query']}'." if view["query"] else "The address list is empty."
+
+    title = f"Matches for '{view['query']}'" if view["query"] else "Address List"
+    page = len(view["starts"])
+    hints = []
+    if view["next"]:
+        hints.append("'next'")
+    if page > 1:
+        hints.append("'prev'")
+    hints.append("'cd ..' to return")
+    return f"{title} (page {page}):\n" + "\n".join(lines) + "\n\n" + ", ".join(hints) + "."
+
 def process_command(user_id, command, bbs_system):
     """Handle commands for the Address List Module."""
     if user_id not in bbs_system.users:
@@ -41,44 +275,46 @@ def process_command(user_id, command, bbs_system):
 
     state = user_state["address_list"]["state"]
 
-    # Load the address list from storage
-    address_list = load_address_list()
-
-    if command.strip().lower() == "cd ..":
-        bbs_system.users[user_id]["menu"].pop()
-        return bbs_system.display_menu(user_id)
-
     if state == "menu":
-        if command == "1":
-            # View Address List
-            if not address_list:
-                return "The address list is empty."
-            contact_list = "\n".join([f"{user} (Online)" if details.get("online", False) else f"{user}"
-                                      for user, details in address_list.items()])
-            return f"Address List:\n{contact_list}\n\nType 'cd ..' to return to the menu."
-        elif command == "2":
+        view = user_state["address_list"].get("view")
+        if command.number == 1 or (command.verb == "find" and command.args):
+            # View the first page of the address list, or of the search results
+            query = command.rest if command.verb == "find" else None
+            view = user_state["address_list"]["view"] = {"query": query, "starts": [None], "next": None}
+            return render_page(view, bbs_system)
+        elif command.normalized == "next":
+            if not view or not view["next"]:
+                return "No more entries. Enter '1' to view the list from the start."
+            view["starts"].append(view["next"])
+            return render_page(view, bbs_system)
+        elif command.normalized == "prev":
+            if not view or len(view["starts"]) < 2:
+                return "You are on the first page."
+            view["starts"].pop()
+            return render_page(view, bbs_system)
+        elif command.number == 2:
             # Add Yourself
-            if user_id in address_list:
+            details = {"online": user_state["address_list"]["online"]}
+            name = short_name(user_id, bbs_system)
+            if name:
+                details["short_name"] = name
+            if not address_book.add(user_id, details):
                 return "You are already in the address list."
-            address_list[user_id] = {"online": user_state["address_list"]["online"]}
-            save_address_list(address_list)
             return "You have been added to the address list."
-        elif command == "3":
+        elif command.number == 3:
             # Remove Yourself
-            if user_id not in address_list:
+            if not address_book.remove(user_id):
                 return "You are not in the address list."
-            del address_list[user_id]
-            save_address_list(address_list)
             return "You have been removed from the address list."
-        elif command == "4":
-            # Toggle Online Status
-            user_state["address_list"]["online"] = not user_state["address_list"]["online"]
-            if user_id in address_list:
-                address_list[user_id]["online"] = user_state["address_list"]["online"]
-            save_address_list(address_list)
-            status = "Online" if user_state["address_list"]["online"] else "Offline"
+        elif command.number == 4:
+            # Toggle whether others can see when you are online; presence itself comes from the mesh
+            details = address_book.get(user_id)
+            visible = details.get("online", True) if details else user_state["address_list"]["online"]
+            user_state["address_list"]["online"] = not visible
+            address_book.update(user_id, online=not visible)
+            status = "Visible" if user_state["address_list"]["online"] else "Hidden"
             return f"Your online status is now: {status}."
         else:
-            return "Invalid choice. Please choose 1, 2, 3, or 4, or type 'cd ..' to return."
+            return "Invalid choice. Please choose 1, 2, 3, or 4, 'find <text>', or type 'cd ..' to return."
 
     return "Unexpected error. Returning to menu."
@@ -0,0 +1,103 @@
+menu_name = "Nearby Nodes"  # Required for module loading
+cache_replies = False  # Positions change between requests, so a repeat is a refresh
+
+DEFAULT_RADIUS = 500  # Meters searched by option 1
+NEAREST_COUNT = 5  # Nodes listed by option 2
+MAX_RADIUS = 100000  # Largest radius accepted by 'near <meters>'
+MAX_LISTED = 10  # Nodes listed per reply
+
+def display_menu():
+    """Display the Nearby Nodes menu."""
+    return "Nearby Nodes:\n" \
+           f"1. Nodes within {DEFAULT_RADIUS} m of you\n" \
+           f"2. The {NEAREST_COUNT} nearest nodes\n" \
+           "'near <meters>' to pick a radius\n" \
+           "'where <node>' for a node's last position\n" \
+           "'cd ..' to return to the main menu."
+
+def position_index(bbs_system):
+    """The interface's position index, or None when running without one."""
+    return getattr(getattr(bbs_system, "interface", None), "positions", None)
+
+def node_name(node_id, bbs_system):
+    """Show a node by its short name from the radio's node database when there is one."""
+    radio = getattr(getattr(bbs_system, "interface", None), "interface", None)
+    nodes = getattr(radio, "nodes", None) or {}
+    name = nodes.get(node_id, {}).get("user", {}).get("shortName")
+    return f"{name} ({node_id})" if name else node_id
+
+def format_distance(meters):
+    return f"{meters:.0f} m" if meters < 1000 else f"{meters / 1000:.1f} km"
+
+def format_age(timestamp, now):
+    minutes = int(max(0, now - timestamp) // 60)
+    if minutes < 60:
+        return f"{minutes} min ago"
+    if minutes < 48 * 60:
+        return f"{minutes // 60} h ago"
+    return f"{minutes // (24 * 60)} days ago"
+
+def format_nodes(title, results, bbs_system):
+    if not results:
+        return f"{title}: no nodes found."
+    lines = [f"{node_name(node_id, bbs_system)} {format_distance(distance)}" for distance, node_id in results[:MAX_LISTED]]
+    if len(results) > MAX_LISTED:
+        lines.append(f"... and {len(results) - MAX_LISTED} more")
+    return f"{title}:\n" + "\n".join(lines)
+
+def find_node(query, bbs_system):
+    """Match a node id, with or without the '!', or a short name."""
+    positions = position_index(bbs_system)
+    candidate = query if query.startswith("!") else f"!{query}"
+    if positions.get(candidate.lower()):
+        return candidate.lower()
+    radio = getattr(getattr(bbs_system, "interface", None), "interface", None)
+    for node_id, node in (getattr(radio, "nodes", None) or {}).items():
+        if node.get("user", {}).get("shortName", "").lower() == query.lower():
+            return node_id
+    return None
+
+def process_command(user_id, command, bbs_system):
+    """Handle commands for the Nearby Nodes module."""
+    positions = position_index(bbs_system)
+    if positions is None:
+        return "Node positions are not available right now."
+
+    if command.verb == "where" and command.args:
+        query = command.rest
+        node_id = find_node(query, bbs_system)
+        position = positions.get(node_id) if node_id else None
+        if not position:
+            return f"No position known for '{query}'."
+        latitude, longitude, altitude, timestamp = position
+        reply = f"{node_name(node_id, bbs_system)}: {latitude:.5f}, {longitude:.5f}"
+        if altitude:
+            reply += f", {altitude} m"
+        reply += f"\nReported {format_age(timestamp, positions.clock())}"
+        distance = positions.distance(user_id, node_id) if node_id != user_id else None
+        if distance is not None:
+            reply += f", {format_distance(distance)} from you"
+        return reply + "."
+
+    if command.number in (1, 2) or command.verb == "near":
+        own = positions.get(user_id)
+        if not own:
+            return "Your node has not reported a position yet. Share your position and try again."
+        latitude, longitude = own[0], own[1]
+
+        if command.number == 2:
+            results = positions.nearest(latitude, longitude, NEAREST_COUNT, exclude=user_id)
+            return format_nodes(f"Nearest {NEAREST_COUNT} nodes", results, bbs_system)
+
+        radius = DEFAULT_RADIUS
+        if command.verb == "near":
+            try:
+                radius = float(command.rest)
+            except ValueError:
+                return "Usage: near <meters>, for example 'near 2000'."
+            if not 0 < radius <= MAX_RADIUS:
+                return f"Pick a radius between 1 and {MAX_RADIUS} meters."
+        results = positions.within(latitude, longitude, radius, exclude=user_id)
+        return format_nodes(f"Nodes within {format_distance(radius)}", results, bbs_system)
+
+    return "Invalid choice. Please choose 1 or 2, 'near <meters>', 'where <node>', or type 'cd ..' to return."
@@ -0,0 +1,139 @@
+import heapq
+import math
+import threading
+import time
+
+EARTH_RADIUS = 6371e3  # Meters
+METERS_PER_DEGREE = 111320  # Length of one degree of latitude
+CELL_DEGREES = 0.01  # Grid cell size, about 1.1 km north-south
+
+
+def distance_m(lat1, lon1, lat2, lon2):
+    """Calculate the distance in meters between two latitude/longitude points."""
+    phi1 = math.radians(lat1)
+    phi2 = math.radians(lat2)
+    delta_phi = math.radians(lat2 - lat1)
+    delta_lambda = math.radians(lon2 - lon1)
+    a = math.sin(delta_phi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(delta_lambda / 2) ** 2
+    return EARTH_RADIUS * 2 * math.atan2(math.sqrt(a), math.sqrt(1 - a))
+
+
+class PositionIndex:
+    """
+    Latest known position of every node, with a grid index for spatial queries.
+
+    Nodes are bucketed into fixed-size latitude/longitude cells, so radius and
+    nearest-neighbour queries only look at the cells around the query point
+    instead of every node. Positions reported without a time are stamped with clock().
+    """
+
+    def __init__(self, cell_degrees=CELL_DEGREES, clock=time.time):
+        self.cell_degrees = cell_degrees
+        self.clock = clock
+        self._latest = {}  # node_id -> (latitude, longitude, altitude, timestamp)
+        self._cells = {}  # (row, column) -> set of node ids
+        self._lock = threading.Lock()
+        self.updates = 0
+
+    def _cell(self, latitude, longitude):
+        return int(math.floor(latitude / self.cell_degrees)), int(math.floor(longitude / self.cell_degrees))
+
+    def update(self, node_id, latitude, longitude, altitude=None, timestamp=None):
+        """Record a node's latest position in O(1)."""
+        cell = self._cell(latitude, longitude)
+        with self._lock:
+            previous = self._latest.get(node_id)
+            if previous is not None:
+                old_cell = self._cell(previous[0], previous[1])
+                if old_cell != cell:
+                    members = self._cells[old_cell]
+                    members.discard(node_id)
+                    if not members:
+                        del self._cells[old_cell]
+            self._latest[node_id] = (latitude, longitude, altitude, timestamp or self.clock())
+            self._cells.setdefault(cell, set()).add(node_id)
+            self.updates += 1
+
+    def get(self, node_id):
+        """Return (latitude, longitude, altitude, timestamp) for a node, or None."""
+        return self._latest.get(node_id)
+
+    def distance(self, node_a, node_b):
+        """Return the distance in meters between two nodes' latest positions, or None."""
+        a = self._latest.get(node_a)
+        b = self._latest.get(node_b)
+        if a is None or b is None:
+            return None
+        return distance_m(a[0], a[1], b[0], b[1])
+
+    def __len__(self):
+        return len(self._latest)
+
+    def snapshot(self):
+        """Return a copy of every node's latest position."""
+        with self._lock:
+            return dict(self._latest)
+
+    def _cell_ranges(self, latitude, longitude, radius):
+        """Rows and columns of the cells that cover a circle around a point."""
+        delta_lat = radius / METERS_PER_DEGREE
+        cos_lat = max(math.cos(math.radians(latitude)), 1e-6)
+        delta_lon = min(180.0, radius / (METERS_PER_DEGREE * cos_lat))
+        low_row, low_col = self._cell(latitude - delta_lat, longitude - delta_lon)
+        high_row, high_col = self._cell(latitude + delta_lat, longitude + delta_lon)
+        return range(low_row, high_row + 1), range(low_col, high_col + 1)
+
+    def within(self, latitude, longitude, radius, exclude=None):
+        """Return [(distance, node_id)] for nodes within radius meters, nearest first."""
+        rows, cols = self._cell_ranges(latitude, longitude, radius)
+        results = []
+        with self._lock:
+            if len(rows) * len(cols) > len(self._cells):
+                candidates = self._latest  # Fewer occupied cells than cells to check
+            else:
+                candidates = [node_id for row in rows for col in cols for node_id in self._cells.get((row, col), ())]
+            for node_id in candidates:
+                if node_id == exclude:
+                    continue
+                position = self._latest[node_id]
+                distance = distance_m(latitude, longitude, position[0], position[1])
+                if distance <= radius:
+                    results.append((distance, node_id))
+        results.sort()
+        return results
+
+    def nearest(self, latitude, longitude, count=5, exclude=None):
+        """Return [(distance, node_id)] for the count nearest nodes, nearest first."""
+        cell_row, cell_col = self._cell(latitude, longitude)
+        # Smallest distance across one cell here, used to know when no closer node can remain
+        cos_lat = max(math.cos(math.radians(latitude)), 1e-6)
+        cell_meters = self.cell_degrees * METERS_PER_DEGREE * min(1.0, cos_lat)
+        found = []
+        with self._lock:
+            total = len(self._latest) - (1 if exclude in self._latest else 0)
+            wanted = min(count, total)
+            seen = 0
+            ring = 0
+            while wanted > 0:
+                if ring * ring * 4 > len(self._cells) + 1:
+                    # The rings have grown past the occupied cells; a full scan is cheaper now
+                    found = [(distance_m(latitude, longitude, position[0], position[1]), node_id)
+                             for node_id, position in self._latest.items() if node_id != exclude]
+                    return heapq.nsmallest(count, found)
+                for row in range(cell_row - ring, cell_row + ring + 1):
+                    for col in range(cell_col - ring, cell_col + ring + 1):
+                        if ring and abs(row - cell_row) != ring and abs(col - cell_col) != ring:
+                            continue  # Inner cells were searched in earlier rings
+                        for node_id in self._cells.get((row, col), ()):
+                            if node_id == exclude:
+                                continue
+                            position = self._latest[node_id]
+                            found.append((distance_m(latitude, longitude, position[0], position[1]), node_id))
+                            seen += 1
+                # Nodes outside this ring are at least ring * cell_meters away
+                if seen >= wanted and heapq.nsmallest(wanted, found)[-1][0] <= ring * cell_meters:
+                    break
+                if seen >= total:
+                    break
+                ring += 1
+        return heapq.nsmallest(count, found)
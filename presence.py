@@ -0,0 +1,123 @@
+import json
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+PRESENCE_FILE = "presence.json"  # Last-heard times saved across restarts
+ONLINE_WINDOW = 900  # Seconds since a node was last heard for it to count as online
+PRESENCE_FLUSH_INTERVAL = 60  # Seconds between saves of the presence table
+PRESENCE_RETENTION = 30 * 24 * 3600  # Seconds a node stays in the table after it was last heard
+
+
+class PresenceTable:
+    """
+    Last time each node was heard on the mesh.
+
+    Every received packet updates the table in O(1); whether a node is online
+    is worked out from its last-heard time only when someone asks. The table is
+    saved in the background, never on the packet path, and nodes not heard for
+    longer than the retention window are dropped before each save.
+    clock returns the current wall-clock time; replays and tests pass their own.
+    """
+
+    def __init__(self, path=PRESENCE_FILE, window=ONLINE_WINDOW, flush_interval=PRESENCE_FLUSH_INTERVAL,
+                 retention=PRESENCE_RETENTION, clock=time.time):
+        self.path = path
+        self.window = window
+        self.flush_interval = flush_interval
+        self.retention = retention
+        self.clock = clock
+        self._last_heard = self._load()  # node_id -> wall-clock time last heard
+        self._lock = threading.Lock()  # Keeps a node heard during a prune from being dropped
+        self._dirty = False
+        self.pruned = 0
+        self._flush_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _load(self):
+        if not self.path or not os.path.exists(self.path):
+            return {}
+        try:
+            with open(self.path, "r") as presence_file:
+                return json.load(presence_file)
+        except (OSError, ValueError) as e:
+            logger.error(f"Error reading presence file '{self.path}': {e}")
+            return {}
+
+    def heard(self, node_id, when=None):
+        """Record that a node was just heard."""
+        with self._lock:
+            self._last_heard[node_id] = when if when is not None else self.clock()
+            self._dirty = True
+
+    def last_heard(self, node_id):
+        """Return the wall-clock time a node was last heard, or None."""
+        return self._last_heard.get(node_id)
+
+    def is_online(self, node_id, now=None):
+        """Return True if the node was heard within the online window."""
+        heard = self._last_heard.get(node_id)
+        if heard is None:
+            return False
+        return (now if now is not None else self.clock()) - heard <= self.window
+
+    def prune(self, now=None):
+        """Drop nodes not heard within the retention window. Returns the number dropped."""
+        if not self.retention:
+            return 0
+        cutoff = (now if now is not None else self.clock()) - self.retention
+        with self._lock:
+            stale = [node_id for node_id, heard in self._last_heard.items() if heard < cutoff]
+            for node_id in stale:
+                del self._last_heard[node_id]
+            if stale:
+                self._dirty = True
+        self.pruned += len(stale)
+        return len(stale)
+
+    def __len__(self):
+        return len(self._last_heard)
+
+    def stats(self):
+        """Return the presence counters."""
+        return {"pruned": self.pruned}
+
+    def start(self):
+        """Start pruning and saving the table in the background."""
+        if not self._thread:
+            self._thread = threading.Thread(target=self._run, name="presence-writer", daemon=True)
+            self._thread.start()
+
+    def close(self):
+        """Stop the background writer and save any changes."""
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+        self.flush()
+
+    def _run(self):
+        while not self._stop.wait(self.flush_interval):
+            self.flush()
+
+    def flush(self):
+        """Prune the table, then save it if it changed since the last save."""
+        self.prune()
+        if not self.path or not self._dirty:
+            return
+        with self._flush_lock:
+            with self._lock:
+                self._dirty = False
+                snapshot = dict(self._last_heard)
+            temp_path = self.path + ".tmp"
+            try:
+                with open(temp_path, "w") as presence_file:
+                    json.dump(snapshot, presence_file)
+                os.replace(temp_path, self.path)
+            except OSError as e:
+                logger.error(f"Error saving presence file '{self.path}': {e}")
+                self._dirty = True
@@ -0,0 +1,208 @@
+import logging
+import threading
+import time
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+MAX_PAYLOAD_BYTES = 200  # Meshtastic allows 233 bytes of text; leave room for the packet header
+PACKET_OVERHEAD_BYTES = 16  # Approximate header bytes sent on air with every packet
+FRAGMENT_HEADER_BYTES = 10  # Room kept for a "(12/34) " style fragment number
+CHANNEL_BITRATE = 1070  # Bits per second of the default LongFast channel
+DUTY_CYCLE = 0.5  # Share of the channel airtime the BBS may use
+
+
+def _split_long_line(line, budget):
+    """Split a single line that does not fit into one fragment, preferring word breaks."""
+    pieces = []
+    while len(line.encode("utf-8")) > budget:
+        # Cut at the byte budget, then back off to a whole character
+        cut = line.encode("utf-8")[:budget].decode("utf-8", errors="ignore")
+        space = cut.rfind(" ")
+        if space > 0:
+            cut = cut[:space]
+        elif not cut:
+            cut = line[0]  # The budget is smaller than one character; send it on its own anyway
+        pieces.append(cut)
+        line = line[len(cut):].lstrip(" ")
+    if line or not pieces:
+        pieces.append(line)
+    return pieces
+
+
+def fragment_message(message, max_bytes=MAX_PAYLOAD_BYTES):
+    """
+    Split a message into payload-sized fragments on line boundaries.
+    Messages that fit into one packet are returned unchanged; longer ones are
+    numbered "(1/3) ", "(2/3) ", ... so the reader can put them back in order.
+    """
+    if len(message.encode("utf-8")) <= max_bytes:
+        return [message]
+
+    budget = max_bytes - FRAGMENT_HEADER_BYTES
+    chunks = []
+    current = []
+    size = 0
+    for line in message.split("\n"):
+        for piece in _split_long_line(line, budget):
+            piece_size = len(piece.encode("utf-8"))
+            added = piece_size + 1 if current else piece_size  # Count the joining newline
+            if current and size + added > budget:
+                chunks.append("\n".join(current))
+                current = [piece]
+                size = piece_size
+            else:
+                current.append(piece)
+                size += added
+    if current:
+        chunks.append("\n".join(current))
+
+    total = len(chunks)
+    return [f"({index}/{total}) {chunk}" for index, chunk in enumerate(chunks, start=1)]
+
+
+class SendScheduler:
+    """
+    Outbound message scheduler.
+
+    Replies are split into fragments and queued per destination. A single sender
+    thread takes one fragment from each destination in turn and paces the radio
+    with a token bucket refilled at the channel's airtime budget.
+    """
+
+    def __init__(self, send, bitrate=CHANNEL_BITRATE, duty_cycle=DUTY_CYCLE,
+                 max_payload=MAX_PAYLOAD_BYTES, burst_bytes=None):
+        self.send = send  # Called as send(user_id, text) for every fragment
+        self.max_payload = int(max_payload)
+        self.bitrate = bitrate
+        self.rate = max(1.0, bitrate / 8.0 * duty_cycle)  # Bytes of airtime per second
+        # The bucket must hold at least one full packet or large fragments never go out
+        self.capacity = max(burst_bytes or 0, self.max_payload + PACKET_OVERHEAD_BYTES)
+
+        self._lock = threading.Lock()
+        self._wakeup = threading.Condition(self._lock)
+        self._queues = {}  # destination -> deque of fragments
+        self._turns = deque()  # Destinations with fragments waiting, in round-robin order
+        self._pending_bytes = {}  # destination -> bytes waiting
+        self._depth = 0
+        self._tokens = self.capacity
+        self._refilled = time.monotonic()
+        self._thread = None
+        self._running = False
+
+        self.sent_fragments = 0
+        self.sent_bytes = 0
+        self.throttled = 0  # Fragments that had to wait for airtime
+        self.airtime = 0.0  # Seconds of channel time used by sent packets, headers included
+
+    def start(self):
+        """Start the sender thread."""
+        with self._lock:
+            if self._running:
+                return
+            self._running = True
+        self._thread = threading.Thread(target=self._run, name="send-scheduler", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=5.0):
+        """Stop the sender thread. Fragments still waiting are discarded."""
+        with self._lock:
+            self._running = False
+            self._wakeup.notify_all()
+        if self._thread:
+            self._thread.join(timeout)
+            self._thread = None
+        if self._depth:
+            logger.warning(f"Discarded {self._depth} unsent message fragments")
+
+    def enqueue(self, user_id, message):
+        """Queue a reply for a destination. Returns the number of fragments queued."""
+        fragments = fragment_message(message, self.max_payload)
+        with self._lock:
+            queue = self._queues.get(user_id)
+            if queue is None:
+                queue = self._queues[user_id] = deque()
+                self._turns.append(user_id)
+            queue.extend(fragments)
+            self._depth += len(fragments)
+            self._pending_bytes[user_id] = self._pending_bytes.get(user_id, 0) + sum(
+                len(fragment.encode("utf-8")) for fragment in fragments
+            )
+            self._wakeup.notify()
+        return len(fragments)
+
+    def queue_depth(self):
+        """Return the number of fragments waiting to be sent."""
+        with self._lock:
+            return self._depth
+
+    def pending_bytes(self, user_id=None):
+        """Return the bytes waiting for one destination, or a dict for all of them."""
+        with self._lock:
+            if user_id is not None:
+                return self._pending_bytes.get(user_id, 0)
+            return dict(self._pending_bytes)
+
+    def stats(self):
+        """Return a snapshot of the scheduler counters."""
+        with self._lock:
+            return {
+                "queue_depth": self._depth,
+                "destinations": len(self._queues),
+                "pending_bytes": sum(self._pending_bytes.values()),
+                "sent_fragments": self.sent_fragments,
+                "sent_bytes": self.sent_bytes,
+                "throttled": self.throttled,
+                "airtime_seconds": round(self.airtime, 3),
+            }
+
+    def _refill(self):
+        """Add the airtime earned since the last refill to the token bucket."""
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._refilled) * self.rate)
+        self._refilled = now
+
+    def _run(self):
+        """Send fragments round-robin across destinations as airtime allows."""
+        delayed = False  # Whether the fragment at the head has already been counted as throttled
+        while True:
+            with self._lock:
+                while self._running and not self._turns:
+                    self._wakeup.wait()
+                if not self._running:
+                    return
+
+                user_id = self._turns[0]
+                fragment = self._queues[user_id][0]
+                size = len(fragment.encode("utf-8"))
+                cost = size + PACKET_OVERHEAD_BYTES
+
+                self._refill()
+                if self._tokens < cost:
+                    # Sleep until enough airtime has built up; new messages and stop() wake us early
+                    if not delayed:
+                        self.throttled += 1
+                        delayed = True
+                    self._wakeup.wait((cost - self._tokens) / self.rate)
+                    continue
+
+                self._tokens -= cost
+                delayed = False
+                self._turns.popleft()
+                queue = self._queues[user_id]
+                queue.popleft()
+                self._depth -= 1
+                self._pending_bytes[user_id] -= size
+                if queue:
+                    self._turns.append(user_id)  # Other destinations go first
+                else:
+                    del self._queues[user_id]
+                    del self._pending_bytes[user_id]
+
+            try:
+                self.send(user_id, fragment)
+                self.sent_fragments += 1
+                self.sent_bytes += size
+                self.airtime += cost * 8 / self.bitrate
+            except Exception as e:
+                logger.error(f"Failed to send fragment to {user_id}: {e}")
@@ -0,0 +1,398 @@
+import importlib
+import json
+import logging
+import sqlite3
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+SESSION_TTL = 3600  # Seconds of inactivity before a session is dropped
+MAX_SESSIONS = 500  # Least recently used sessions are evicted beyond this
+SWEEP_INTERVAL = 60  # Minimum seconds between idle session sweeps
+SNAPSHOT_FILE = "sessions.db"  # SQLite file sessions are snapshotted to
+SNAPSHOT_INTERVAL = 30  # Seconds between snapshots of changed sessions
+
+
+class Session:
+    """
+    State of one user's BBS session.
+
+    Navigation lives in slots; anything a module stores (game state and so on)
+    goes into a dict that is only created when a module first needs it. Modules
+    can keep using a session like the dict it used to be.
+    """
+
+    __slots__ = ("menu", "module_control", "last_seen", "data")
+
+    def __init__(self, menu=None):
+        self.menu = menu if menu is not None else ["main"]  # Menu stack to track navigation
+        self.module_control = None  # Module that has taken over the session, if any
+        self.last_seen = time.monotonic()
+        self.data = None  # Module state, keyed by module
+
+    @classmethod
+    def from_dict(cls, values):
+        """Build a session from a plain dict of session state."""
+        session = cls(values.get("menu"))
+        for key, value in values.items():
+            if key != "menu":
+                session[key] = value
+        return session
+
+    def __getitem__(self, key):
+        if key == "menu":
+            return self.menu
+        if key == "module_control":
+            if self.module_control is None:
+                raise KeyError(key)
+            return self.module_control
+        if self.data is None:
+            raise KeyError(key)
+        return self.data[key]
+
+    def __setitem__(self, key, value):
+        if key == "menu":
+            self.menu = value
+        elif key == "module_control":
+            self.module_control = value
+        else:
+            if self.data is None:
+                self.data = {}
+            self.data[key] = value
+
+    def __delitem__(self, key):
+        if key == "module_control":
+            if self.module_control is None:
+                raise KeyError(key)
+            self.module_control = None
+        elif key == "menu" or self.data is None:
+            raise KeyError(key)
+        else:
+            del self.data[key]
+            if not self.data:
+                self.data = None
+
+    def __contains__(self, key):
+        if key == "menu":
+            return True
+        if key == "module_control":
+            return self.module_control is not None
+        return self.data is not None and key in self.data
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def pop(self, key, default=None):
+        value = self.get(key, default)
+        if key in self and key != "menu":
+            del self[key]
+        return value
+
+    def to_record(self):
+        """Serialize the session to compact JSON. Modules are stored by name."""
+        module = self.module_control.__name__ if self.module_control is not None else None
+        return json.dumps({"menu": self.menu, "module": module, "data": self.data}, separators=(",", ":"))
+
+    @classmethod
+    def from_record(cls, record, module_resolver=None):
+        """
+        Rebuild a session from to_record() output.
+        module_resolver maps a module name to the module object to use; by default it is imported.
+        """
+        values = json.loads(record)
+        session = cls(values["menu"])
+        session.data = values["data"]
+        if values["module"]:
+            try:
+                resolve = module_resolver or importlib.import_module
+                session.module_control = resolve(values["module"])
+            except Exception as e:
+                logger.warning(f"Could not restore module '{values['module']}' for a session: {e}")
+            if session.module_control is None:
+                session.menu = ["main"]  # The module is gone or broken; fall back to the menu
+        return session
+
+
+class SessionSnapshots:
+    """SQLite file holding the last snapshot of each session."""
+
+    def __init__(self, path=SNAPSHOT_FILE):
+        self.path = path
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")  # Readers never wait on the snapshot writer
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS sessions (user_id TEXT PRIMARY KEY, record TEXT NOT NULL, updated REAL NOT NULL)"
+        )
+        self._db.commit()
+
+    def load(self, user_id):
+        """Return (record, wall-clock time saved) for a user, or None."""
+        with self._lock:
+            row = self._db.execute("SELECT record, updated FROM sessions WHERE user_id = ?", (user_id,)).fetchone()
+        return row
+
+    def write(self, records, deleted):
+        """Save changed session records and remove deleted ones in one transaction."""
+        now = time.time()
+        with self._lock:
+            with self._db:
+                self._db.executemany(
+                    "INSERT OR REPLACE INTO sessions (user_id, record, updated) VALUES (?, ?, ?)",
+                    [(user_id, record, now) for user_id, record in records.items()],
+                )
+                self._db.executemany("DELETE FROM sessions WHERE user_id = ?", [(user_id,) for user_id in deleted])
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+def _approx_size(value, seen):
+    """Roughly measure the memory held by plain session data."""
+    if id(value) in seen:
+        return 0
+    seen.add(id(value))
+    size = sys.getsizeof(value)
+    if isinstance(value, dict):
+        size += sum(_approx_size(k, seen) + _approx_size(v, seen) for k, v in value.items())
+    elif isinstance(value, (list, tuple, set, frozenset)):
+        size += sum(_approx_size(item, seen) for item in value)
+    return size
+
+
+class SessionStore:
+    """
+    Bounded, thread-safe store of user sessions.
+
+    Sessions are kept in least-recently-used order, so idle sessions past the
+    TTL and overflow beyond the cap are always removed from the front.
+
+    With snapshots enabled, sessions touched since the last snapshot are written
+    to SQLite by a background thread, and a session missing from memory is
+    loaded back the first time its user is looked up.
+    """
+
+    def __init__(self, ttl=SESSION_TTL, max_sessions=MAX_SESSIONS, sweep_interval=SWEEP_INTERVAL,
+                 snapshots=None, snapshot_interval=SNAPSHOT_INTERVAL, module_resolver=None):
+        self.ttl = ttl
+        self.max_sessions = max(1, int(max_sessions))
+        self.sweep_interval = sweep_interval
+        self._sessions = OrderedDict()  # user_id -> Session, least recently used first
+        self._lock = threading.RLock()
+        self._last_sweep = time.monotonic()
+        self.evicted = 0
+        self.expired = 0
+
+        self.snapshots = snapshots
+        self.snapshot_interval = snapshot_interval
+        self.module_resolver = module_resolver  # Maps stored module names back to modules
+        self._dirty = set()  # Users whose session may have changed since the last snapshot
+        self._spilled = {}  # Dirty sessions evicted from memory, still to be written
+        self._deleted = set()  # Users whose snapshot should be removed
+        self._stop = threading.Event()
+        self._thread = None
+        self.restored = 0
+        self.snapshots_written = 0
+
+    def __contains__(self, user_id):
+        with self._lock:
+            return user_id in self._sessions or self._restore(user_id)
+
+    def __getitem__(self, user_id):
+        with self._lock:
+            if user_id not in self._sessions and not self._restore(user_id):
+                raise KeyError(user_id)
+            session = self._sessions[user_id]
+            session.last_seen = time.monotonic()
+            self._sessions.move_to_end(user_id)
+            if self.snapshots:
+                self._dirty.add(user_id)  # Callers may change the session in place
+            return session
+
+    def __setitem__(self, user_id, session):
+        if isinstance(session, dict):
+            session = Session.from_dict(session)
+        with self._lock:
+            session.last_seen = time.monotonic()
+            self._sessions[user_id] = session
+            self._sessions.move_to_end(user_id)
+            if self.snapshots:
+                self._dirty.add(user_id)
+                self._spilled.pop(user_id, None)
+                self._deleted.discard(user_id)
+            while len(self._sessions) > self.max_sessions:
+                evicted_id, evicted = self._sessions.popitem(last=False)
+                if evicted_id in self._dirty:
+                    self._spilled[evicted_id] = evicted  # Keep it until it is written
+                self.evicted += 1
+
+    def __delitem__(self, user_id):
+        with self._lock:
+            del self._sessions[user_id]
+            self._forget(user_id)
+
+    def __len__(self):
+        return len(self._sessions)
+
+    def __iter__(self):
+        with self._lock:
+            return iter(list(self._sessions))
+
+    def get(self, user_id, default=None):
+        with self._lock:
+            if user_id in self:
+                return self[user_id]
+            return default
+
+    def peek(self, user_id):
+        """Return the user's session if it is in memory, without restoring it, refreshing it or marking it changed."""
+        return self._sessions.get(user_id)
+
+    def pop(self, user_id, default=None):
+        with self._lock:
+            self._forget(user_id)
+            return self._sessions.pop(user_id, default)
+
+    def _forget(self, user_id):
+        """Make sure a removed session is not written again and its snapshot is deleted."""
+        self._dirty.discard(user_id)
+        self._spilled.pop(user_id, None)
+        if self.snapshots:
+            self._deleted.add(user_id)
+
+    def _restore(self, user_id):
+        """Load a user's session from the snapshot file into memory. Returns True if found."""
+        if not self.snapshots:
+            return False
+        spilled = self._spilled.pop(user_id, None)
+        if spilled is not None:
+            self[user_id] = spilled
+            return True
+        if user_id in self._deleted:
+            return False
+        try:
+            row = self.snapshots.load(user_id)
+        except Exception as e:
+            logger.error(f"Error loading session snapshot for {user_id}: {e}")
+            return False
+        if row is None:
+            return False
+        record, updated = row
+        if time.time() - updated > self.ttl:
+            self._forget(user_id)  # Expired while we were down
+            return False
+        self[user_id] = Session.from_record(record, self.module_resolver)
+        self._dirty.discard(user_id)  # Unchanged since it was saved
+        self.restored += 1
+        return True
+
+    def start(self):
+        """Start writing snapshots in the background, if snapshots are enabled."""
+        if self.snapshots and not self._thread:
+            self._thread = threading.Thread(target=self._snapshot_loop, name="session-snapshots", daemon=True)
+            self._thread.start()
+
+    def close(self):
+        """Stop the snapshot thread and write a final snapshot."""
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+        if self.snapshots:
+            self.snapshot()
+            self.snapshots.close()
+            self.snapshots = None
+
+    def _snapshot_loop(self):
+        while not self._stop.wait(self.snapshot_interval):
+            self.snapshot()
+
+    def snapshot(self):
+        """Write every session changed since the last snapshot. Returns the number written."""
+        if not self.snapshots:
+            return 0
+        with self._lock:
+            dirty, self._dirty = self._dirty, set()
+            deleted, self._deleted = self._deleted, set()
+            sessions = {user_id: self._sessions.get(user_id) or self._spilled.get(user_id) for user_id in dirty}
+
+        # Serialize outside the lock so workers are not held up
+        records = {}
+        for user_id, session in sessions.items():
+            if session is None:
+                continue
+            try:
+                records[user_id] = session.to_record()
+            except (TypeError, ValueError) as e:
+                logger.error(f"Could not snapshot session for {user_id}: {e}")
+            except RuntimeError:
+                with self._lock:
+                    self._dirty.add(user_id)  # Changed while we were reading it; retry next time
+
+        try:
+            self.snapshots.write(records, deleted)
+        except Exception as e:
+            logger.error(f"Error writing session snapshot: {e}")
+            with self._lock:
+                self._dirty.update(records)
+                self._deleted.update(deleted - self._sessions.keys())
+            return 0
+
+        with self._lock:
+            for user_id in records:
+                # Written sessions that were evicted meanwhile can now be loaded from the file
+                if self._spilled.get(user_id) is sessions[user_id] and user_id not in self._dirty:
+                    del self._spilled[user_id]
+        self.snapshots_written += len(records)
+        return len(records)
+
+    def expire(self, force=False):
+        """Drop sessions idle for longer than the TTL. Returns the number dropped."""
+        now = time.monotonic()
+        if not force and now - self._last_sweep < self.sweep_interval:
+            return 0
+        dropped = 0
+        with self._lock:
+            self._last_sweep = now
+            cutoff = now - self.ttl
+            while self._sessions:
+                user_id, session = next(iter(self._sessions.items()))
+                if session.last_seen > cutoff:
+                    break
+                del self._sessions[user_id]
+                self._forget(user_id)
+                dropped += 1
+            self.expired += dropped
+        return dropped
+
+    def approx_bytes(self):
+        """Approximate memory held by all sessions, not counting shared module objects."""
+        with self._lock:
+            sessions = list(self._sessions.values())
+        seen = set()
+        total = 0
+        for session in sessions:
+            total += sys.getsizeof(session)
+            total += _approx_size(session.menu, seen)
+            if session.data is not None:
+                total += _approx_size(session.data, seen)
+        return total
+
+    def stats(self):
+        """Return the session count, approximate size and eviction counters."""
+        return {
+            "sessions": len(self._sessions),
+            "approx_bytes": self.approx_bytes(),
+            "evicted": self.evicted,
+            "expired": self.expired,
+            "restored": self.restored,
+            "snapshots_written": self.snapshots_written,
+        }
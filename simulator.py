@@ -0,0 +1,472 @@
+"""
+Offline mesh simulator and load test for the BBS.
+
+A stand-in for meshtastic's SerialInterface publishes packets from simulated
+nodes on the same "meshtastic.receive" topic a radio would, and collects the
+replies the BBS sends back. Each node runs a script of commands in a loop,
+waiting for the full reply to one command (every fragment) before it thinks
+for a moment and sends the next, and can also send position beacons.
+
+Usage:
+    python3 simulator.py                           # Run every scenario
+    python3 simulator.py mixed --nodes 200         # Run one scenario with 200 nodes
+    python3 simulator.py games --duration 30 --airtime    # Pace replies to the real channel airtime
+"""
+import argparse
+import contextlib
+import heapq
+import io
+import itertools
+import logging
+import os
+import random
+import re
+import resource
+import tempfile
+import threading
+import time
+
+from pubsub import pub
+
+NODES = 50  # Simulated nodes per scenario
+DURATION = 10  # Seconds of traffic per scenario
+THINK_TIME = 0.1  # Mean seconds a node waits between a reply and its next command
+REPLY_TIMEOUT = 5  # Seconds a node waits for a reply before it gives up and moves on
+SEED = 1  # Same seed, same nodes, scripts and positions
+NODE_BASE = 0x51300000  # Node numbers of the simulated nodes start here
+BASE_POSITION = (47.6062, -122.3321)  # Nodes are spread over about 5 km around this point
+SPREAD_DEGREES = 0.05
+UNLIMITED_BITRATE = 10 ** 9  # Channel bitrate used unless the real airtime budget is asked for
+
+GREETING = "hi"  # First message of every node; it opens the session
+FRAGMENT_NUMBER = re.compile(r"\((\d+)/(\d+)\) ")
+# Starts of the replies the BBS and its modules send when a command was not understood or failed;
+# a script that gets many of them no longer matches the menus and measures the wrong thing
+ERROR_REPLIES = ("Invalid", "Something went wrong", "This module is no longer available", "Unexpected error",
+                 "Unknown game state")
+
+# Commands each kind of user repeats, starting and ending at the main menu
+SCRIPTS = {
+    "menus": ("1", "cd ..", "2", "cd ..", "3", "cd ..", "top"),
+    # Every cell is tried, so each game runs to its end; moves left over then are skipped (see GAME_OVER)
+    "tic_tac_toe": ("1", "3", "2", "3", "5", "1", "9", "3", "7", "4", "6", "8", "2", "cd ..", "top"),
+    "escape_room": ("1", "1", "look", "go east", "examine chest", "west", "examine painting", "north", "inventory",
+                    "cd ..", "top"),
+    "zork": ("look", "inventory", "help", "cd ..", "top", "1", "4"),
+    "address_list": ("2", "1", "2", "1", "find 513", "next", "prev", "4", "3", "cd ..", "top"),
+}
+
+# Commands sent once before a script starts repeating, for games that cannot be started twice
+OPENINGS = {
+    "zork": ("1", "4", "1", "look", "open mailbox", "sw", "e", "d"),
+}
+GAME_OVER = "play again"  # A reply with this ends a game: the node skips to the next "cd .." of its script
+
+# Traffic mixes: script name -> share of the nodes, and seconds between position beacons (None for no beacons)
+SCENARIOS = {
+    "menus": {"scripts": {"menus": 1}, "beacon_interval": None},
+    "games": {"scripts": {"tic_tac_toe": 1, "escape_room": 1, "zork": 1}, "beacon_interval": None},
+    "address_list": {"scripts": {"address_list": 1}, "beacon_interval": None},
+    "beacons": {"scripts": {}, "beacon_interval": 1.0},
+    "mixed": {"scripts": {"menus": 4, "tic_tac_toe": 2, "escape_room": 1, "zork": 1, "address_list": 2},
+              "beacon_interval": 5.0},
+}
+
+# Entries in the simulator's event heap
+SEND, BEACON, TIMEOUT = range(3)
+
+
+def percentiles(samples, points=(50, 90, 99)):
+    """Return the given percentiles of the samples, and the maximum, or an empty dict without samples."""
+    if not samples:
+        return {}
+    ordered = sorted(samples)
+    result = {f"p{point}": ordered[min(len(ordered) - 1, len(ordered) * point // 100)] for point in points}
+    result["max"] = ordered[-1]
+    return result
+
+
+def rss_bytes():
+    """Return the resident memory of this process, or its peak where the current value is not available."""
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class SimulatedNode:
+    """One node on the simulated mesh: its id, the script it repeats and where it is."""
+
+    def __init__(self, index, script, latitude, longitude, script_name=None, opening=()):
+        self.node_num = NODE_BASE + index
+        self.node_id = f"!{self.node_num:08x}"
+        self.script = script  # Commands sent in a loop, or () for a node that only sends beacons
+        self.script_name = script_name
+        self.opening = list(opening)  # Commands sent once, after the greeting
+        self.step = -1  # -1 until the greeting has been sent
+        self.latitude = latitude
+        self.longitude = longitude
+        self.sent_at = None  # When the command waiting for a reply was sent
+        self.seq = 0  # Number of the command waiting for a reply, to match its timeout
+
+    def next_command(self):
+        """Return the next command to send."""
+        if self.step < 0:
+            self.step = 0
+            return GREETING
+        if self.opening:
+            return self.opening.pop(0)
+        command = self.script[self.step % len(self.script)]
+        self.step += 1
+        return command
+
+    def skip_game(self):
+        """Skip the rest of the moves of a game that is over, up to the script's next "cd .."."""
+        rest = self.script[self.step % len(self.script):]
+        if not self.opening and "cd .." in rest:
+            self.step += rest.index("cd ..")
+
+
+def build_nodes(scenario, count, rng):
+    """Create the nodes of a scenario, giving each a script drawn by the scenario's shares."""
+    names = list(scenario["scripts"])
+    weights = [scenario["scripts"][name] for name in names]
+    nodes = []
+    for index in range(count):
+        name = rng.choices(names, weights)[0] if names else None
+        latitude = BASE_POSITION[0] + rng.uniform(-SPREAD_DEGREES, SPREAD_DEGREES)
+        longitude = BASE_POSITION[1] + rng.uniform(-SPREAD_DEGREES, SPREAD_DEGREES)
+        nodes.append(SimulatedNode(index, SCRIPTS[name] if name else (), latitude, longitude, name,
+                                   OPENINGS.get(name, ())))
+    return nodes
+
+
+class SimulatedRadio:
+    """
+    Stand-in for meshtastic's SerialInterface. Text sent to a node is handed to
+    the simulated mesh instead of going out over serial.
+    """
+
+    def __init__(self, mesh, devPath=None):
+        self.mesh = mesh
+        self.devPath = devPath
+        self.sent = 0
+
+    def sendText(self, text, destinationId=None, **kwargs):
+        self.sent += 1
+        self.mesh.delivered(destinationId, text)
+
+    def close(self):
+        pass
+
+
+class SimulatedMesh:
+    """
+    Traffic generator for a set of simulated nodes.
+
+    run() plays the part of the radio's reader thread: it publishes every packet
+    on "meshtastic.receive" from the calling thread. Replies come back through
+    SimulatedRadio.sendText on the BBS's sender thread.
+    """
+
+    def __init__(self, nodes, think_time=THINK_TIME, beacon_interval=None, reply_timeout=REPLY_TIMEOUT, seed=SEED):
+        self.nodes = nodes
+        self.by_num = {node.node_num: node for node in nodes}
+        self.think_time = think_time
+        self.beacon_interval = beacon_interval
+        self.reply_timeout = reply_timeout
+        self.random = random.Random(seed)
+
+        self.radio = None
+        self.connected = threading.Event()
+        self._lock = threading.Lock()
+        self._wakeup = threading.Condition(self._lock)
+        self._heap = []  # (due, order, kind, node, seq)
+        self._order = itertools.count()
+        self._packet_ids = itertools.count(1)
+        self._outstanding = 0
+
+        self.commands = 0
+        self.replies = 0
+        self.timeouts = 0
+        self.beacons = 0
+        self.fragments = 0
+        self.unexpected = 0  # Messages to a node that was not waiting for a reply
+        self.errors = {}  # Script name -> replies that start like an error
+        self.error_samples = {}  # Script name -> the first such reply
+        self.reply_latencies = []  # Seconds from a command to the last fragment of its reply
+        self.receive_latencies = []  # Seconds the subscriber spent on each published packet
+
+    def connect(self, devPath=None):
+        """Open the simulated radio link. Passed to Interface as its radio factory."""
+        self.radio = SimulatedRadio(self, devPath)
+        self.connected.set()
+        return self.radio
+
+    def _push(self, due, kind, node, seq=0):
+        heapq.heappush(self._heap, (due, next(self._order), kind, node, seq))
+
+    def _think(self, node, now):
+        """Schedule the node's next command after a random think time."""
+        delay = self.random.expovariate(1 / self.think_time) if self.think_time else 0
+        self._push(now + delay, SEND, node)
+
+    def delivered(self, destination, text):
+        """Record a fragment sent to a node, completing its command on the last fragment of the reply."""
+        now = time.monotonic()
+        with self._wakeup:
+            self.fragments += 1
+            node = self.by_num.get(destination)
+            if node is None or node.sent_at is None:
+                self.unexpected += 1
+                return
+            number = FRAGMENT_NUMBER.match(text)
+            if not number or number.group(1) == "1":
+                self._check_reply(node, text[number.end():] if number else text)
+            if GAME_OVER in text:
+                node.skip_game()
+            if number and number.group(1) != number.group(2):
+                return  # More fragments of this reply are on their way
+            self.reply_latencies.append(now - node.sent_at)
+            self.replies += 1
+            node.sent_at = None
+            self._outstanding -= 1
+            self._think(node, now)
+            self._wakeup.notify()
+
+    def _check_reply(self, node, text):
+        """Count a reply that starts like an error against the node's script."""
+        if text.startswith(ERROR_REPLIES):
+            self.errors[node.script_name] = self.errors.get(node.script_name, 0) + 1
+            self.error_samples.setdefault(node.script_name, text.split("\n", 1)[0])
+
+    def text_packet(self, node, text):
+        return {
+            "from": node.node_num,
+            "fromId": node.node_id,
+            "id": next(self._packet_ids),
+            "rxTime": int(time.time()),
+            "decoded": {"portnum": "TEXT_MESSAGE_APP", "text": text},
+        }
+
+    def position_packet(self, node):
+        # Drift a little between beacons, like a node carried around
+        node.latitude += self.random.uniform(-0.0002, 0.0002)
+        node.longitude += self.random.uniform(-0.0002, 0.0002)
+        return {
+            "from": node.node_num,
+            "fromId": node.node_id,
+            "id": next(self._packet_ids),
+            "rxTime": int(time.time()),
+            "decoded": {"portnum": "POSITION_APP"},
+            "position": {  # Where Interface.on_receive reads it
+                "latitude": node.latitude,
+                "longitude": node.longitude,
+                "altitude": 50,
+                "time": int(time.time()),
+            },
+        }
+
+    def publish(self, packet):
+        start = time.perf_counter()
+        pub.sendMessage("meshtastic.receive", packet=packet, interface=self.radio)
+        self.receive_latencies.append(time.perf_counter() - start)
+
+    def run(self, duration):
+        """
+        Send traffic for duration seconds, then wait for the replies still
+        outstanding (up to the reply timeout) before returning.
+        """
+        start = time.monotonic()
+        deadline = start + duration
+        with self._lock:
+            for node in self.nodes:
+                if node.script:
+                    self._push(start + self.random.uniform(0, self.think_time), SEND, node)
+                if self.beacon_interval:
+                    self._push(start + self.random.uniform(0, self.beacon_interval), BEACON, node)
+
+        while True:
+            with self._wakeup:
+                now = time.monotonic()
+                if now >= deadline and not self._outstanding:
+                    return
+                if not self._heap or self._heap[0][0] > now:
+                    due = self._heap[0][0] if self._heap else deadline
+                    if now < deadline:
+                        due = min(due, deadline)
+                    self._wakeup.wait(due - now)
+                    continue
+                _, _, kind, node, seq = heapq.heappop(self._heap)
+                if kind == TIMEOUT:
+                    if node.sent_at is not None and node.seq == seq:
+                        self.timeouts += 1
+                        node.sent_at = None
+                        self._outstanding -= 1
+                        self._think(node, now)
+                    continue
+                if now >= deadline:
+                    continue  # No new traffic once the run is over
+                if kind == BEACON:
+                    self.beacons += 1
+                    self._push(now + self.beacon_interval, BEACON, node)
+                    packet = self.position_packet(node)
+                else:
+                    self.commands += 1
+                    node.seq += 1
+                    node.sent_at = time.monotonic()
+                    self._outstanding += 1
+                    self._push(now + self.reply_timeout, TIMEOUT, node, node.seq)
+                    packet = self.text_packet(node, node.next_command())
+            self.publish(packet)  # Outside the lock: the reply may arrive before this returns
+
+
+def simulator_config(workdir, airtime=False, workers=None, capture_file=None):
+    """Interface configuration for a simulated run. Every file the BBS writes goes into workdir, except a capture."""
+    config = {
+        "device_path": "simulated",
+        "session_file": os.path.join(workdir, "sessions.db"),
+        "presence_file": os.path.join(workdir, "presence.json"),
+        "telemetry_file": os.path.join(workdir, "telemetry_log.csv"),
+        "module_reload_interval": 0,
+    }
+    if not airtime:
+        # Replies go out as fast as the BBS produces them, so the run measures the BBS rather than the channel
+        config["channel_bitrate"] = UNLIMITED_BITRATE
+        config["duty_cycle"] = 1.0
+    if workers:
+        config["worker_threads"] = workers
+    if capture_file:
+        config["capture_file"] = capture_file
+    return config
+
+
+@contextlib.contextmanager
+def scratch_address_book(workdir):
+    """Point the address list module at a scratch file for the length of a run."""
+    from modules.Mail import address_list
+
+    original = address_list.address_book
+    address_list.address_book = address_list.AddressBook(path=os.path.join(workdir, "address_list.json"))
+    try:
+        yield
+    finally:
+        address_list.address_book.close()
+        address_list.address_book = original
+
+
+def run_scenario(name, nodes=NODES, duration=DURATION, think_time=THINK_TIME, seed=SEED, airtime=False,
+                 workers=None, reply_timeout=REPLY_TIMEOUT, capture_file=None):
+    """Run one scenario against a fresh BBS and return its measurements."""
+    from bbs_system import BBSSystem
+    from interface import Interface
+
+    scenario = SCENARIOS[name]
+    rng = random.Random(f"{seed}:{name}")
+    mesh = SimulatedMesh(build_nodes(scenario, nodes, rng), think_time=think_time,
+                         beacon_interval=scenario["beacon_interval"], reply_timeout=reply_timeout, seed=rng.random())
+
+    with tempfile.TemporaryDirectory() as workdir, contextlib.redirect_stdout(io.StringIO()):
+        rss_before = rss_bytes()
+        interface = Interface(config=simulator_config(workdir, airtime, workers, capture_file), radio=mesh.connect)
+        bbs = BBSSystem(interface=interface)
+        thread = threading.Thread(target=bbs.run, name="bbs", daemon=True)
+        with scratch_address_book(workdir):
+            thread.start()
+            try:
+                if not mesh.connected.wait(10):
+                    raise RuntimeError("The BBS did not open the simulated radio")
+                start = time.monotonic()
+                mesh.run(duration)
+                elapsed = time.monotonic() - start
+                rss_after = rss_bytes()
+                sessions = bbs.users.stats()
+                queue = interface.work_queue.stats()
+                send = interface.send_scheduler.stats()
+                reply_cache = interface.replies.stats()
+            finally:
+                interface.stop()
+                thread.join()
+                pub.unsubscribe(interface.on_receive, "meshtastic.receive")
+                pub.unsubscribe(interface.on_connection_lost, "meshtastic.connection.lost")
+
+    return {
+        "scenario": name,
+        "nodes": nodes,
+        "seconds": elapsed,
+        "commands": mesh.commands,
+        "replies": mesh.replies,
+        "timeouts": mesh.timeouts,
+        "beacons": mesh.beacons,
+        "unexpected": mesh.unexpected,
+        "errors": dict(mesh.errors),
+        "error_samples": dict(mesh.error_samples),
+        "reply_cache_hits": reply_cache["hits"],
+        "reply_cache_misses": reply_cache["misses"],
+        "throughput": mesh.replies / elapsed,
+        "packets_per_second": (mesh.commands + mesh.beacons) / elapsed,
+        "reply_latency": percentiles(mesh.reply_latencies),
+        "receive_latency": percentiles(mesh.receive_latencies),
+        "rss_growth": rss_after - rss_before,
+        "sessions": sessions["sessions"],
+        "session_bytes": sessions["approx_bytes"],
+        "queue_high_water": queue["high_water"],
+        "queue_rejected": queue["rejected"],
+        "sent_fragments": send["sent_fragments"],
+        "sent_bytes": send["sent_bytes"],
+    }
+
+
+def format_latency(latency, scale, unit):
+    if not latency:
+        return "no samples"
+    return "  ".join(f"{key} {value * scale:.2f} {unit}" for key, value in latency.items())
+
+
+def report(result):
+    """Print the measurements of one scenario."""
+    print(f"  {'replies':<18} {result['replies']} ({result['throughput']:.1f}/s), "
+          f"timeouts {result['timeouts']}, unexpected {result['unexpected']}")
+    for script, count in sorted(result["errors"].items()):
+        print(f"  {'errors':<18} {script}: {count} error replies, first: {result['error_samples'][script]!r}")
+    if not result["errors"]:
+        print(f"  {'errors':<18} none")
+    print(f"  {'reply cache':<18} {result['reply_cache_hits']} hits, {result['reply_cache_misses']} misses")
+    print(f"  {'packets in':<18} {result['commands']} commands, {result['beacons']} beacons "
+          f"({result['packets_per_second']:.1f}/s)")
+    print(f"  {'reply latency':<18} {format_latency(result['reply_latency'], 1e3, 'ms')}")
+    print(f"  {'receive handler':<18} {format_latency(result['receive_latency'], 1e6, 'us')}")
+    print(f"  {'memory':<18} RSS {result['rss_growth'] / 1e6:+.1f} MB, {result['sessions']} sessions "
+          f"(~{result['session_bytes'] / 1e3:.1f} KB)")
+    print(f"  {'queues':<18} work queue high water {result['queue_high_water']}, "
+          f"rejected {result['queue_rejected']}; sent {result['sent_fragments']} fragments, "
+          f"{result['sent_bytes']} bytes")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test the BBS on a simulated mesh.")
+    parser.add_argument("names", nargs="*", help=f"Scenarios to run (default: all): {', '.join(SCENARIOS)}")
+    parser.add_argument("--nodes", type=int, default=NODES, help="Simulated nodes per scenario")
+    parser.add_argument("--duration", type=float, default=DURATION, help="Seconds of traffic per scenario")
+    parser.add_argument("--think", type=float, default=THINK_TIME, help="Mean seconds between a reply and the next command")
+    parser.add_argument("--seed", type=int, default=SEED, help="Seed for nodes, scripts and positions")
+    parser.add_argument("--timeout", type=float, default=REPLY_TIMEOUT, help="Seconds to wait for a reply")
+    parser.add_argument("--workers", type=int, help="Worker threads (default: the interface default)")
+    parser.add_argument("--capture", help="Record the simulated traffic to this capture file for capture.py replay")
+    parser.add_argument("--airtime", action="store_true", help="Pace replies to the real channel airtime budget")
+    args = parser.parse_args()
+    unknown = [name for name in args.names if name not in SCENARIOS]
+    if unknown:
+        parser.error(f"Unknown scenario(s): {', '.join(unknown)}")
+
+    logging.disable(logging.INFO)  # The interface logs every packet at INFO
+    for name in args.names or SCENARIOS:
+        print(f"{name}: {args.nodes} nodes for {args.duration:g} s, think time {args.think:g} s")
+        report(run_scenario(name, nodes=args.nodes, duration=args.duration, think_time=args.think,
+                            seed=args.seed, airtime=args.airtime, workers=args.workers,
+                            reply_timeout=args.timeout, capture_file=args.capture))
+
+
+if __name__ == "__main__":
+    main()
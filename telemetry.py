@@ -0,0 +1,194 @@
+import datetime
+import gzip
+import logging
+import os
+import shutil
+import struct
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+TELEMETRY_FILE = "telemetry_log.csv"
+TELEMETRY_FORMAT = "csv"  # "csv", or "binary" for fixed-size packed records
+FLUSH_RECORDS = 100  # Write once this many records are waiting
+FLUSH_INTERVAL = 10  # ... or after this many seconds
+MAX_PENDING_RECORDS = 10000  # Records kept in memory while writes fail; the oldest are dropped beyond this
+MAX_FILE_BYTES = 1024 * 1024  # Rotate the log when it grows past this size, and at midnight
+
+# Binary record: node number, latitude and longitude in 1e-7 degrees, altitude in meters, unix time
+BINARY_RECORD = struct.Struct("<IiiiI")
+
+
+def node_number(node_id):
+    """Convert a '!1234abcd' node id to its node number, or 0 if it is not one."""
+    try:
+        return int(node_id.lstrip("!"), 16)
+    except (AttributeError, ValueError):
+        return 0
+
+
+def read_binary(path):
+    """Yield (node_id, latitude, longitude, altitude, timestamp) from a binary telemetry file."""
+    opener = gzip.open if path.endswith(".gz") else open
+    with opener(path, "rb") as log_file:
+        while True:
+            chunk = log_file.read(BINARY_RECORD.size)
+            if len(chunk) < BINARY_RECORD.size:
+                return
+            node, latitude, longitude, altitude, timestamp = BINARY_RECORD.unpack(chunk)
+            yield f"!{node:08x}", latitude / 1e7, longitude / 1e7, altitude, timestamp
+
+
+class TelemetrySink:
+    """
+    Buffered telemetry writer.
+
+    Records are appended to an in-memory buffer on the radio thread and
+    written in batches by a background thread. Log files are rotated by size
+    and by day, and rotated files are gzip-compressed. A batch that fails to
+    write is kept for the next attempt, up to max_pending records.
+    """
+
+    def __init__(self, path=TELEMETRY_FILE, file_format=TELEMETRY_FORMAT, flush_records=FLUSH_RECORDS,
+                 flush_interval=FLUSH_INTERVAL, max_bytes=MAX_FILE_BYTES, write_latency=None,
+                 max_pending=MAX_PENDING_RECORDS):
+        if file_format not in ("csv", "binary"):
+            raise ValueError(f"Unknown telemetry format: {file_format}")
+        self.path = path
+        self.format = file_format
+        self.flush_records = max(1, int(flush_records))
+        self.flush_interval = flush_interval
+        self.max_bytes = max_bytes
+        self.max_pending = max(1, int(max_pending))
+        self.write_latency = write_latency  # Optional histogram of the seconds each batch takes to write
+
+        self._buffer = []
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()  # One batch written at a time
+        self._wakeup = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self._day = datetime.date.today()
+
+        self.records = 0
+        self.batches = 0
+        self.rotations = 0
+        self.errors = 0
+        self.dropped = 0  # Records given up on because writes kept failing
+
+    def record(self, sender, latitude, longitude, altitude, timestamp):
+        """Buffer one position record. Never touches the disk."""
+        with self._lock:
+            self._buffer.append((sender, latitude, longitude, altitude, timestamp))
+            full = len(self._buffer) >= self.flush_records
+        if full:
+            self._wakeup.set()
+
+    def start(self):
+        """Start the background writer."""
+        if not self._thread:
+            self._thread = threading.Thread(target=self._run, name="telemetry-writer", daemon=True)
+            self._thread.start()
+
+    def close(self):
+        """Stop the background writer and write every buffered record."""
+        self._stop.set()
+        self._wakeup.set()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+        self.flush()
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            self.flush()
+
+    def flush(self):
+        """Write all buffered records in one batch. Returns the number written."""
+        with self._write_lock:
+            with self._lock:
+                batch, self._buffer = self._buffer, []
+            if not batch:
+                return 0
+            start = time.perf_counter()
+            try:
+                self._rotate_if_needed()
+                if self.format == "binary":
+                    data = b"".join(self._pack(record) for record in batch)
+                    with open(self.path, "ab") as log_file:
+                        log_file.write(data)
+                else:
+                    lines = "".join(f"{sender},{latitude},{longitude},{altitude},{timestamp}\n"
+                                    for sender, latitude, longitude, altitude, timestamp in batch)
+                    with open(self.path, "a") as log_file:
+                        log_file.write(lines)
+            except Exception as e:
+                self.errors += 1
+                logger.error(f"Error logging telemetry data: {e}")
+                with self._lock:
+                    self._buffer[:0] = batch  # Keep the records for the next attempt
+                    excess = len(self._buffer) - self.max_pending
+                    if excess > 0:
+                        del self._buffer[:excess]  # ... but only the newest, so a dead disk cannot fill memory
+                        self.dropped += excess
+                if excess > 0:
+                    logger.warning(f"Dropped {excess} telemetry records that could not be written")
+                return 0
+            if self.write_latency is not None:
+                self.write_latency.observe(time.perf_counter() - start)
+            self.records += len(batch)
+            self.batches += 1
+            logger.debug(f"Logged {len(batch)} telemetry records.")
+            return len(batch)
+
+    def _pack(self, record):
+        sender, latitude, longitude, altitude, timestamp = record
+        return BINARY_RECORD.pack(
+            node_number(sender),
+            int(round(latitude * 1e7)),
+            int(round(longitude * 1e7)),
+            int(altitude or 0),
+            int(timestamp or time.time()),
+        )
+
+    def _rotate_if_needed(self):
+        """Move the current log aside and compress it when it is too big or from an earlier day."""
+        today = datetime.date.today()
+        try:
+            size = os.path.getsize(self.path)
+        except OSError:
+            self._day = today
+            return  # Nothing to rotate yet
+        if size < self.max_bytes and today == self._day:
+            return
+
+        base, extension = os.path.splitext(self.path)
+        stamp = datetime.datetime.now().strftime("%Y%m%d-%H%M%S")
+        rotated = f"{base}-{stamp}{extension}"
+        suffix = 1
+        while os.path.exists(rotated + ".gz"):  # Rotated twice within a second
+            rotated = f"{base}-{stamp}-{suffix}{extension}"
+            suffix += 1
+        os.replace(self.path, rotated)
+        with open(rotated, "rb") as source, gzip.open(rotated + ".gz", "wb") as target:
+            shutil.copyfileobj(source, target)
+        os.remove(rotated)
+        self._day = today
+        self.rotations += 1
+        logger.info(f"Rotated telemetry log to {rotated}.gz")
+
+    def stats(self):
+        """Return the writer counters."""
+        with self._lock:
+            pending = len(self._buffer)
+        return {
+            "pending": pending,
+            "records": self.records,
+            "batches": self.batches,
+            "rotations": self.rotations,
+            "errors": self.errors,
+            "dropped": self.dropped,
+        }
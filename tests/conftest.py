@@ -0,0 +1,50 @@
+import os
+import sys
+import time
+
+import pytest
+
+# The BBS modules live at the top of the repository rather than in a package
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+class Client:
+    """A node talking to an offline BBS. send() returns the replies to one message."""
+
+    def __init__(self, bbs, node_id="!51300001"):
+        self.bbs = bbs
+        self.node_id = node_id
+        self.packet_id = 0
+        self.received = []
+
+    def send(self, text):
+        interface = self.bbs.interface
+        self.packet_id += 1
+        start = len(self.received)
+        interface.on_receive({"fromId": self.node_id, "id": self.packet_id, "decoded": {"text": text}}, None)
+        deadline = time.monotonic() + 5
+        while interface.work_queue.busy(self.node_id) and time.monotonic() < deadline:
+            time.sleep(0.001)
+        return self.received[start:]
+
+
+@pytest.fixture
+def bbs(tmp_path, monkeypatch):
+    """A BBS without a radio; its files go to a temporary directory and replies to the clients."""
+    from bbs_system import BBSSystem
+    from interface import Interface
+    from simulator import simulator_config, scratch_address_book
+
+    monkeypatch.chdir(tmp_path)  # Module state files are written relative to the working directory
+    bbs = BBSSystem(Interface(config=simulator_config(str(tmp_path))))
+    clients = {}
+
+    def deliver(user_id, message):
+        clients[user_id].received.append(message)
+
+    bbs.interface.send_message = deliver
+    bbs.client = lambda node_id="!51300001": clients.setdefault(node_id, Client(bbs, node_id))
+    bbs.interface.work_queue.start()
+    with scratch_address_book(str(tmp_path)):
+        yield bbs
+    bbs.interface.work_queue.stop()
@@ -0,0 +1,13 @@
+def test_paging_twice_moves_two_pages(bbs):
+    from modules.Mail import address_list
+
+    for index in range(40):
+        address_list.address_book.add(f"!{0x51310000 + index:08x}", {"short_name": f"N{index:02d}"})
+    client = bbs.client()
+    for command in ("hi", "2", "1"):
+        client.send(command)
+    assert "(page 1)" in client.send("1")[0]
+    assert "(page 2)" in client.send("next")[0]
+    assert "(page 3)" in client.send("next")[0]
+    assert "(page 2)" in client.send("prev")[0]
+    assert "(page 1)" in client.send("prev")[0]
@@ -0,0 +1,14 @@
+import json
+import pickle
+
+from adventure import load_world, CACHE_SUFFIX
+
+
+def test_unexpected_cache_contents_are_ignored(tmp_path):
+    path = tmp_path / "world.json"
+    path.write_text(json.dumps({"start": "field", "rooms": {"field": {"description": "An open field."}}}))
+    with open(str(path) + CACHE_SUFFIX, "wb") as cache_file:
+        pickle.dump(["not", "a", "compiled", "world"], cache_file)
+
+    world = load_world(str(path))
+    assert world.describe(world.new_game()) == "An open field."
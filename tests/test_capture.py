@@ -0,0 +1,46 @@
+from capture import PacketCapture
+
+
+def test_failed_writes_keep_only_the_newest_packets(tmp_path):
+    capture = PacketCapture(path=str(tmp_path), max_pending=3)  # A directory, so every write fails
+    for index in range(5):
+        capture.record({"id": index}, when=index)
+    assert capture.flush() == 0
+
+    assert [packet["id"] for _, packet in capture._buffer] == [2, 3, 4]
+    stats = capture.stats()
+    assert stats["pending"] == 3
+    assert stats["dropped"] == 2
+
+
+def test_replaying_a_capture_twice_gives_the_same_responses():
+    from capture import replay
+
+    start = 1700000000.0
+    packets = [
+        (0, {"fromId": "!a", "position": {"latitude": 35.65, "longitude": -97.47}}),
+        (1, {"fromId": "!a", "decoded": {"text": "hi"}}),
+        (2, {"fromId": "!a", "decoded": {"text": "1"}}),
+        (3, {"fromId": "!a", "decoded": {"text": "2"}}),
+        (4, {"fromId": "!a", "decoded": {"text": "1"}}),  # Starts a Hot Cold game with 30 second rounds
+        (11, {"fromId": "!b", "decoded": {"text": "hi"}}),
+        (12, {"fromId": "!b", "decoded": {"text": "1"}}),
+        (13, {"fromId": "!b", "decoded": {"text": "2"}}),
+        (14, {"fromId": "!b", "decoded": {"text": "1"}}),  # Joins it 10 seconds in
+        (300, {"fromId": "!c", "decoded": {"text": "hi"}}),
+        (301, {"fromId": "!c", "decoded": {"text": "3"}}),
+        (302, {"fromId": "!c", "decoded": {"text": "1"}}),
+        (303, {"fromId": "!c", "decoded": {"text": "where !a"}}),
+    ]
+    records = [(start + offset, dict(packet, id=index)) for index, (offset, packet) in enumerate(packets)]
+
+    first = replay(records)
+    second = replay(records)
+
+    def output(results):
+        return [(result["sender"], result["text"], result["module"], result["response"]) for result in results]
+    assert output(first) == output(second)
+    responses = [result["response"] for result in first]
+    assert responses[3].startswith("Hot Cold game started!")
+    assert "Round 1 ends in 20 seconds" in responses[7]
+    assert "Reported 5 min ago" in responses[11]
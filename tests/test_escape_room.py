@@ -0,0 +1,64 @@
+from types import MappingProxyType
+
+import pytest
+
+from sessions import _approx_size
+
+PLAYERS = 20
+
+
+@pytest.fixture
+def escape_room():
+    from modules.Games import escape_room
+    return escape_room
+
+
+def play(bbs, node_ids):
+    """Walk each player into the Escape Room and around it; return their game states."""
+    games = []
+    for node_id in node_ids:
+        client = bbs.client(node_id)
+        for command in ("hi", "1", "1", "east", "examine chest", "west", "inventory"):
+            client.send(command)
+        games.append(bbs.users.peek(node_id)["escape_room"])
+    return games
+
+
+def world_objects(world):
+    """Ids of every mapping and tuple in the frozen world."""
+    found = set()
+    pending = [world]
+    while pending:
+        value = pending.pop()
+        if isinstance(value, (MappingProxyType, tuple)):
+            found.add(id(value))
+            pending.extend(value.values() if isinstance(value, MappingProxyType) else value)
+    return found
+
+
+def test_players_share_the_frozen_world(bbs, escape_room):
+    games = play(bbs, [f"!5130{index:04x}" for index in range(PLAYERS)])
+    shared = world_objects(escape_room.WORLD)
+
+    assert len({id(game) for game in games}) == PLAYERS
+    for game in games:
+        assert set(game) <= {"current_room", "inventory", "moved", "flags"}
+        assert not any(id(value) in shared for value in game.values())
+        assert game["current_room"] == "start"
+    with pytest.raises(TypeError):
+        escape_room.WORLD["start"]["exits"]["up"] = "roof"
+
+
+def test_player_state_does_not_grow_with_the_world(bbs, escape_room, monkeypatch):
+    small = play(bbs, ["!51300001"])[0]
+
+    rooms = {name: dict(room) for name, room in escape_room.WORLD.items()}
+    for index in range(200):
+        rooms[f"cell_{index}"] = {"description": "An empty cell." * 10, "objects": {"bed": "A hard bed."},
+                                  "items": [f"stone_{index}", f"bone_{index}"], "exits": {"west": "start"}}
+    monkeypatch.setattr(escape_room, "WORLD", escape_room.freeze(rooms))
+    large = play(bbs, ["!51300002"])[0]
+
+    assert large == small
+    assert _approx_size(large, set()) == _approx_size(small, set())
+    assert _approx_size(large, set()) < _approx_size(rooms, set()) // 100
@@ -0,0 +1,31 @@
+import threading
+
+from metrics import Counter, Histogram, MetricsRegistry
+
+
+def test_value_on_a_bound_is_counted_in_that_bucket():
+    histogram = Histogram()
+    for index in range(40):
+        bound = histogram.upper_bound(index)
+        before = histogram.snapshot()[0]
+        histogram.observe(bound)
+        after = histogram.snapshot()[0]
+        assert after[index] == before[index] + 1
+
+
+def test_bucket_le_is_inclusive():
+    registry = MetricsRegistry()
+    latency = registry.histogram("latency_seconds", "Latency")
+    for value in (0.5, 0.6, 0.625, 0.625):
+        latency.observe(value)
+    assert 'meshboard_latency_seconds_bucket{le="0.625"} 4' in registry.render()
+
+
+def test_counts_from_every_thread_are_added_up():
+    counter = Counter()
+    threads = [threading.Thread(target=lambda: [counter.inc() for _ in range(1000)]) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert counter.get() == 4000
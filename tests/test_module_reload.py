@@ -0,0 +1,26 @@
+from commands import parse_command
+
+
+def test_reload_swaps_in_menus_built_for_the_new_tree(bbs):
+    menus = bbs.menus
+    bbs.reload_modules()
+    assert bbs.menus is not menus
+    assert [name for name, _ in bbs.menus["main"]["targets"]] == list(bbs.menu_modules)
+
+
+def test_choice_made_from_the_old_menus_does_not_need_the_old_tree(bbs):
+    client = bbs.client()
+    client.send("hi")
+    menus = bbs.menus
+    bbs.menu_modules = {}  # A reload swapped the tree after this command picked its menu
+    session = bbs.users[client.node_id]
+    reply = bbs.select_menu_item(client.node_id, session, menus["main"], parse_command("1"))
+    assert reply.startswith("Games Menu:")
+    assert session.menu == ["main", "Games"]
+
+
+def test_reloads_are_exported_as_metrics(bbs):
+    bbs.reload_modules()
+    text = bbs.interface.metrics.render()
+    assert "meshboard_modules_reloads_total 1" in text
+    assert "meshboard_modules_reload_failures_total 0" in text
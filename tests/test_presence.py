@@ -0,0 +1,45 @@
+from presence import PresenceTable
+
+
+class FakeClock:
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+def test_online_window_follows_the_clock():
+    clock = FakeClock()
+    presence = PresenceTable(path=None, window=60, clock=clock)
+    presence.heard("!a")
+    assert presence.last_heard("!a") == 1000.0
+    clock.now += 60
+    assert presence.is_online("!a")
+    clock.now += 1
+    assert not presence.is_online("!a")
+
+
+def test_nodes_past_the_retention_window_are_pruned_on_flush(tmp_path):
+    clock = FakeClock()
+    presence = PresenceTable(path=str(tmp_path / "presence.json"), retention=100, clock=clock)
+    presence.heard("!old")
+    clock.now += 50
+    presence.heard("!new")
+    clock.now += 51
+    presence.flush()
+    assert presence.last_heard("!old") is None
+    assert presence.last_heard("!new") == 1050.0
+    assert presence.stats() == {"pruned": 1}
+
+    reloaded = PresenceTable(path=str(tmp_path / "presence.json"), clock=clock)
+    assert len(reloaded) == 1
+
+
+def test_zero_retention_keeps_every_node():
+    clock = FakeClock()
+    presence = PresenceTable(path=None, retention=0, clock=clock)
+    presence.heard("!a")
+    clock.now += 10 ** 9
+    assert presence.prune() == 0
+    assert len(presence) == 1
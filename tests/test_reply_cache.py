@@ -0,0 +1,69 @@
+from caches import ReplyCache
+
+
+def test_repeat_in_the_same_place_is_answered_from_the_cache():
+    cache = ReplyCache()
+    cache.store("!a", "look", "A room.", place=(("main", "Games"), "Escape Room"))
+    assert cache.lookup("!a", "look", (("main", "Games"), "Escape Room")) == "A room."
+    assert cache.lookup("!a", "look", (("main",), None)) is None
+
+
+def test_repeated_menu_choice_opens_the_next_menu(bbs):
+    client = bbs.client()
+    client.send("hi")
+    games = client.send("1")
+    assert games[0].startswith("Games Menu:")
+    escape_room = client.send("1")
+    assert escape_room[0].startswith("Welcome to the Escape Room!")
+    look = client.send("look")
+    assert look[0].startswith("You are in a locked room.")
+
+
+def test_retry_in_the_same_place_reuses_the_reply(bbs):
+    client = bbs.client()
+    client.send("hi")
+    client.send("1")
+    client.send("1")
+    first = client.send("look")
+    assert client.send("look") == first
+    assert bbs.interface.replies.stats()["hits"] == 1
+
+
+def test_module_commands_can_be_exempt_from_the_cache(bbs):
+    client = bbs.client()
+    for command in ("hi", "1", "3"):
+        client.send(command)
+    assert client.send("2")[0].startswith("Player vs Computer mode selected.")
+    assert client.send("2")[0].startswith("Medium computer selected.")
+
+
+def test_retry_of_a_command_that_moved_the_user_is_answered_from_the_cache(bbs):
+    client = bbs.client()
+    for command in ("hi", "1", "4"):
+        client.send(command)
+    field = client.send("1")  # Starts the game
+    assert field[0].startswith("You are standing in an open field")
+    assert client.send("1") == field
+    assert bbs.interface.replies.stats()["hits"] == 1
+
+
+def test_retried_move_gets_the_same_board(bbs):
+    client = bbs.client()
+    for command in ("hi", "1", "3", "2", "3"):
+        client.send(command)
+    board = client.send("5")
+    assert "Your turn" in board[0]
+    assert client.send("5") == board
+    assert bbs.interface.replies.stats()["hits"] == 1
+
+
+def test_cache_check_does_not_touch_the_session_order():
+    from sessions import Session, SessionStore
+
+    store = SessionStore(max_sessions=2)
+    store["!a"] = Session()
+    store["!b"] = Session()
+    assert store.peek("!a") is not None
+    store["!c"] = Session()  # "!a" is still the least recently used
+    assert store.peek("!a") is None
+    assert store.peek("!missing") is None
@@ -0,0 +1,27 @@
+import time
+
+from send_scheduler import SendScheduler, fragment_message, _split_long_line
+
+
+def test_split_takes_a_character_when_budget_is_smaller():
+    assert _split_long_line("héllo", 1) == ["h", "é", "l", "l", "o"]
+    assert _split_long_line("日本", 2) == ["日", "本"]
+
+
+def test_fragment_with_tiny_payload_terminates():
+    fragments = fragment_message("日本語のテキスト", max_bytes=12)
+    assert "".join(fragment.split(") ", 1)[1] for fragment in fragments) == "日本語のテキスト"
+
+
+def test_throttled_counts_each_delayed_fragment_once():
+    sent = []
+    scheduler = SendScheduler(lambda user_id, text: sent.append(text), bitrate=8, duty_cycle=1.0, max_payload=20)
+    scheduler._tokens = 0  # No airtime left: the first fragment has to wait about 36 seconds
+    scheduler.start()
+    scheduler.enqueue("!a", "first")
+    for index in range(20):  # Each new message wakes the sender early
+        scheduler.enqueue(f"!{index}", "more")
+        time.sleep(0.005)
+    scheduler.stop()
+    assert sent == []
+    assert scheduler.stats()["throttled"] == 1
@@ -0,0 +1,41 @@
+from sessions import Session, SessionSnapshots, SessionStore
+
+
+def test_snapshot_is_restored_by_a_new_store(tmp_path):
+    path = str(tmp_path / "sessions.db")
+    store = SessionStore(snapshots=SessionSnapshots(path))
+    session = Session(["main", "Games"])
+    session["score"] = 3
+    store["!a"] = session
+    store.close()  # Writes the final snapshot
+
+    restored = SessionStore(snapshots=SessionSnapshots(path))
+    assert len(restored) == 0  # Nothing is loaded until the user is looked up
+    assert restored["!a"].menu == ["main", "Games"]
+    assert restored["!a"]["score"] == 3
+    assert restored.stats()["restored"] == 1
+    restored.close()
+
+
+def test_module_in_control_survives_a_restart(bbs, tmp_path):
+    client = bbs.client()
+    for command in ("hi", "1", "4"):
+        client.send(command)
+    bbs.users.snapshot()
+
+    restored = SessionStore(snapshots=SessionSnapshots(str(tmp_path / "sessions.db")),
+                            module_resolver=bbs.find_module)
+    session = restored[client.node_id]
+    assert session.menu == ["main", "Games"]
+    assert session.module_control.menu_name == "ZORK"
+    restored.close()
+
+
+def test_evicted_session_comes_back_on_the_next_message(bbs):
+    bbs.users.max_sessions = 1
+    first, second = bbs.client("!51300001"), bbs.client("!51300002")
+    first.send("hi")
+    first.send("1")
+    second.send("hi")  # Evicts the first session before it was snapshotted
+    assert bbs.users.peek(first.node_id) is None
+    assert first.send("cd ..")[0].startswith("Main Menu:")  # Still knew it was in the Games menu
@@ -0,0 +1,31 @@
+import time
+
+from sessions import Session, SessionStore
+
+
+def test_least_recently_used_session_is_evicted():
+    store = SessionStore(max_sessions=2)
+    store["!a"] = Session()
+    store["!b"] = Session()
+    store["!a"]  # Used again, so "!b" is now the oldest
+    store["!c"] = Session()
+    assert "!a" in store and "!c" in store
+    assert "!b" not in store
+    assert store.stats()["evicted"] == 1
+
+
+def test_idle_sessions_expire_after_the_ttl():
+    store = SessionStore(ttl=0.05)
+    store["!idle"] = Session()
+    time.sleep(0.1)
+    store["!active"] = Session()
+    assert store.expire(force=True) == 1
+    assert "!idle" not in store and "!active" in store
+    assert store.stats()["expired"] == 1
+
+
+def test_expiry_waits_for_the_sweep_interval():
+    store = SessionStore(ttl=0, sweep_interval=60)
+    store["!a"] = Session()
+    assert store.expire() == 0  # Swept when the store was created
+    assert store.expire(force=True) == 1
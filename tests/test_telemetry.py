@@ -0,0 +1,27 @@
+from telemetry import TelemetrySink
+
+
+def test_failed_writes_keep_only_the_newest_records(tmp_path):
+    sink = TelemetrySink(path=str(tmp_path), max_pending=5)  # A directory, so every write fails
+    for index in range(4):
+        sink.record("!a", 1.0, 2.0, 3, index)
+    assert sink.flush() == 0
+    for index in range(4, 8):
+        sink.record("!a", 1.0, 2.0, 3, index)
+    assert sink.flush() == 0
+
+    assert [record[4] for record in sink._buffer] == [3, 4, 5, 6, 7]
+    stats = sink.stats()
+    assert stats["pending"] == 5
+    assert stats["dropped"] == 3
+    assert stats["errors"] == 2
+
+
+def test_kept_records_are_written_once_the_log_works_again(tmp_path):
+    sink = TelemetrySink(path=str(tmp_path), max_pending=5)
+    for index in range(3):
+        sink.record("!a", 1.0, 2.0, 3, index)
+    sink.flush()
+    sink.path = str(tmp_path / "telemetry.csv")
+    assert sink.flush() == 3
+    assert sink.stats()["dropped"] == 0
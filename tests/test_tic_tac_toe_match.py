@@ -0,0 +1,71 @@
+import time
+
+import pytest
+
+
+@pytest.fixture
+def players(bbs, monkeypatch):
+    """Two nodes in the Tic Tac Toe menu of one BBS, with a fresh match table."""
+    from modules.Games import tic_tac_toe
+
+    monkeypatch.setattr(tic_tac_toe, "match_table", None)
+    first, second = bbs.client("!51300001"), bbs.client("!51300002")
+    for client in (first, second):
+        for command in ("hi", "1", "3"):
+            client.send(command)
+    return first, second
+
+
+def test_two_nodes_pair_and_take_turns(players):
+    first, second = players
+    assert first.send("1")[0].startswith("Waiting for another node")
+    matched = second.send("1")
+    assert matched[0].startswith(f"Matched with {first.node_id}!")
+    assert "You are X and move first" in first.received[-1]
+
+    assert "Waiting for" in first.send("5")[0]
+    assert f"{first.node_id} played 5." in second.received[-1]
+    assert "It's" in first.send("1")[0]  # Not the first node's turn
+    assert "Waiting for" in second.send("1")[0]
+    assert f"{second.node_id} played 1." in first.received[-1]
+    assert "already taken" in first.send("1")[0]
+
+
+def test_match_ends_with_a_winner(players):
+    first, second = players
+    first.send("1")
+    second.send("1")
+    for x_move, o_move in (("1", "4"), ("2", "5")):
+        first.send(x_move)
+        second.send(o_move)
+    assert "Congratulations! You win!" in first.send("3")[0]
+    assert f"{first.node_id} wins as X" in second.received[-1]
+
+
+def test_leaving_abandons_the_match(players):
+    from modules.Games import tic_tac_toe
+
+    first, second = players
+    first.send("1")
+    second.send("1")
+    assert second.send("quit") == ["You left the match."]
+    assert "left the Tic Tac Toe match. You win!" in first.received[-1]
+    assert tic_tac_toe.match_table.stats()["matches"] == 0
+
+
+def test_idle_match_is_abandoned(players, bbs, monkeypatch):
+    from modules.Games import tic_tac_toe
+
+    monkeypatch.setattr(tic_tac_toe, "MATCH_IDLE_TIMEOUT", 0.05)
+    first, second = players
+    bbs.timers.start()
+    try:
+        first.send("1")
+        second.send("1")
+        deadline = time.monotonic() + 2
+        while tic_tac_toe.match_table.stats()["matches"] and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert tic_tac_toe.match_table.stats()["matches"] == 0
+        assert "abandoned" in first.received[-1] and "abandoned" in second.received[-1]
+    finally:
+        bbs.timers.stop()
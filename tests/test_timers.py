@@ -0,0 +1,69 @@
+import threading
+import time
+
+from timers import TimerWheel
+
+
+def wait_for(condition, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.005)
+    return condition()
+
+
+def test_timer_fires_once_after_its_delay():
+    wheel = TimerWheel(resolution=0.01)
+    wheel.start()
+    fired = threading.Event()
+    start = time.monotonic()
+    wheel.schedule(0.05, fired.set)
+    try:
+        assert fired.wait(2)
+        assert time.monotonic() - start >= 0.05  # Never early
+        assert wait_for(lambda: wheel.stats()["fired"] == 1)
+        assert len(wheel) == 0
+    finally:
+        wheel.stop()
+
+
+def test_cancelled_timer_never_fires():
+    wheel = TimerWheel(resolution=0.01)
+    wheel.start()
+    calls = []
+    timer = wheel.schedule(0.05, calls.append, "cancelled")
+    wheel.schedule(0.1, calls.append, "kept")
+    try:
+        assert timer.cancel()
+        assert not timer.cancel()  # Only the first cancel counts
+        assert wait_for(lambda: calls == ["kept"])
+        time.sleep(0.05)
+        assert calls == ["kept"]
+        assert wheel.stats()["cancelled"] == 1
+    finally:
+        wheel.stop()
+
+
+def test_repeating_timer_runs_until_cancelled():
+    wheel = TimerWheel(resolution=0.01)
+    wheel.start()
+    calls = []
+    timer = wheel.repeat(0.02, calls.append, "tick")
+    try:
+        assert wait_for(lambda: len(calls) >= 3)
+        timer.cancel()
+        time.sleep(0.02)  # Let a callback that was already running finish
+        count = len(calls)
+        time.sleep(0.1)
+        assert len(calls) == count
+    finally:
+        wheel.stop()
+
+
+def test_delayed_message_reaches_the_user(bbs):
+    client = bbs.client()
+    bbs.timers.start()
+    try:
+        bbs.send_later(0.05, client.node_id, "Round over.")
+        assert wait_for(lambda: client.received == ["Round over."])
+    finally:
+        bbs.timers.stop()
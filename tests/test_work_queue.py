@@ -0,0 +1,23 @@
+import threading
+
+from work_queue import WorkQueue, POLICY_DROP_OLDEST
+
+
+def test_drop_oldest_keeps_key_ready_once():
+    handled = []
+    release = threading.Event()
+
+    def handler(key, item):
+        release.wait(5)
+        handled.append((key, item))
+
+    queue = WorkQueue(handler, workers=2, max_pending=1, policy=POLICY_DROP_OLDEST)
+    assert queue.submit("a", 1)
+    assert queue.submit("a", 2)  # Drops 1; "a" must not be queued as ready twice
+    assert list(queue._ready) == ["a"]
+
+    queue.start()
+    release.set()
+    queue.stop()
+    assert handled == [("a", 2)]
+    assert queue.stats()["errors"] == 0
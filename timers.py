@@ -0,0 +1,185 @@
+import logging
+import math
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+TIMER_RESOLUTION = 0.1  # Seconds per wheel tick
+WHEEL_SLOTS = 512  # Ticks per turn of the wheel; later timers wait a number of turns
+
+
+class Timer:
+    """Handle for a scheduled callback. Cancel it with cancel()."""
+
+    __slots__ = ("wheel", "callback", "args", "interval", "slot", "rounds", "active")
+
+    def __init__(self, wheel, callback, args, interval):
+        self.wheel = wheel
+        self.callback = callback
+        self.args = args
+        self.interval = interval  # Seconds between runs for a repeating timer, or None
+        self.slot = None
+        self.rounds = 0  # Full turns of the wheel left before the timer is due
+        self.active = False  # True until it has run or been cancelled
+
+    def cancel(self):
+        """Stop the timer from firing. Returns True if it was still pending."""
+        return self.wheel.cancel(self)
+
+
+class TimerWheel:
+    """
+    Hashed timing wheel shared by everything that needs to run later: game
+    rounds, idle timeouts and delayed messages.
+
+    Timers are placed in the slot of the tick they are due on, so scheduling and
+    cancelling are O(1). One thread sleeps until the next occupied slot, runs
+    the callbacks that are due and goes back to sleep; with no timers pending it
+    sleeps until one is added. Callbacks run on that thread and should be short;
+    they may push replies with interface.send_message.
+    clock returns the current time in seconds; replays pass the captured time.
+    """
+
+    def __init__(self, resolution=TIMER_RESOLUTION, slots=WHEEL_SLOTS, clock=time.monotonic):
+        self.resolution = resolution
+        self.clock = clock
+        self.slots = [dict() for _ in range(slots)]  # slot -> {Timer: None}, a set that keeps order
+        self._origin = clock()
+        self._tick = 0  # Last tick processed
+        self._pending = 0
+        self._condition = threading.Condition()
+        self._stopping = False
+        self._thread = None
+        self.fired = 0
+        self.cancelled = 0
+        self.errors = 0
+
+    def _now_tick(self):
+        return int((self.clock() - self._origin) / self.resolution)
+
+    def schedule(self, delay, callback, *args, interval=None):
+        """Run callback(*args) after delay seconds, then every interval seconds if given. Returns a Timer."""
+        timer = Timer(self, callback, args, interval)
+        with self._condition:
+            self._insert(timer, delay)
+            self._condition.notify()  # It may be due before the thread's next wakeup
+        return timer
+
+    def repeat(self, interval, callback, *args):
+        """Run callback(*args) every interval seconds. Returns a Timer."""
+        return self.schedule(interval, callback, *args, interval=interval)
+
+    def _insert(self, timer, delay):
+        if not self._pending:
+            self._tick = max(self._tick, self._now_tick())  # Nothing was waiting, so no ticks need replaying
+        now = self.clock() - self._origin
+        due = max(int(now / self.resolution) + 1, math.ceil((now + delay) / self.resolution))  # Never early
+        offset = max(1, due - self._tick)
+        timer.slot = (self._tick + offset) % len(self.slots)
+        timer.rounds = (offset - 1) // len(self.slots)
+        timer.active = True
+        self.slots[timer.slot][timer] = None
+        self._pending += 1
+
+    def cancel(self, timer):
+        with self._condition:
+            if not timer.active:
+                return False
+            if timer.slot is not None:
+                del self.slots[timer.slot][timer]
+                timer.slot = None
+                self._pending -= 1
+            timer.active = False  # Also stops a timer that is due but has not run yet
+            self.cancelled += 1
+            return True
+
+    def __len__(self):
+        return self._pending
+
+    def start(self):
+        """Start the timer thread."""
+        if not self._thread:
+            self._stopping = False
+            self._thread = threading.Thread(target=self._run, name="timer-wheel", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        """Stop the timer thread. Pending timers are dropped without running."""
+        with self._condition:
+            self._stopping = True
+            self._condition.notify()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+
+    def _ticks_to_next(self):
+        """Ticks until the next occupied slot, or None when no timers are pending."""
+        if not self._pending:
+            return None
+        count = len(self.slots)
+        for offset in range(1, count + 1):
+            if self.slots[(self._tick + offset) % count]:
+                return offset
+        return count
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._stopping:
+                    ticks = self._ticks_to_next()
+                    if ticks is None:
+                        self._condition.wait()
+                        continue
+                    wait = (self._tick + ticks) * self.resolution - (self.clock() - self._origin)
+                    if wait <= 0:
+                        break
+                    self._condition.wait(wait)
+                if self._stopping:
+                    return
+                due = self.advance()
+            self._fire(due)
+
+    def advance(self):
+        """Move the wheel up to the current time and return the timers that are due. Caller holds the lock."""
+        due = []
+        target = self._now_tick()
+        count = len(self.slots)
+        while self._tick < target and self._pending:
+            self._tick += 1
+            slot = self.slots[self._tick % count]
+            for timer in list(slot):
+                if timer.rounds:
+                    timer.rounds -= 1
+                    continue
+                del slot[timer]
+                timer.slot = None
+                self._pending -= 1
+                due.append(timer)
+        for timer in due:
+            if timer.interval:
+                self._insert(timer, timer.interval)  # Rescheduled before it runs, so it can cancel itself
+        return due
+
+    def _fire(self, due):
+        for timer in due:
+            with self._condition:
+                if not timer.active:
+                    continue  # Cancelled by an earlier callback in this batch
+                if not timer.interval:
+                    timer.active = False
+            try:
+                timer.callback(*timer.args)
+            except Exception as e:
+                self.errors += 1
+                logger.error(f"Error in timer callback {getattr(timer.callback, '__name__', timer.callback)}: {e}")
+            self.fired += 1
+
+    def stats(self):
+        """Return the timer counters."""
+        return {
+            "pending": self._pending,
+            "fired": self.fired,
+            "cancelled": self.cancelled,
+            "errors": self.errors,
+        }
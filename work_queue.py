@@ -0,0 +1,146 @@
+import logging
+import threading
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+# What to do with a new item when the queue is already full
+POLICY_REJECT = "reject"  # Refuse the new item
+POLICY_DROP_OLDEST = "drop_oldest"  # Drop the sender's oldest waiting item to make room
+
+
+class WorkQueue:
+    """
+    Bounded work queue drained by a pool of worker threads.
+
+    Items are grouped by key (the sender's node id). Items with the same key are
+    handled one at a time in arrival order, while different keys are handled in
+    parallel, so one slow user never holds up the others.
+    """
+
+    def __init__(self, handler, workers=4, max_pending=256, policy=POLICY_REJECT, name="worker"):
+        if policy not in (POLICY_REJECT, POLICY_DROP_OLDEST):
+            raise ValueError(f"Unknown queue policy: {policy}")
+        self.handler = handler  # Called as handler(key, item) on a worker thread
+        self.workers = max(1, int(workers))
+        self.max_pending = max(1, int(max_pending))
+        self.policy = policy
+        self.name = name
+
+        self._lock = threading.Lock()
+        self._ready_signal = threading.Condition(self._lock)
+        self._pending = {}  # key -> deque of waiting items
+        self._ready = deque()  # Keys with waiting items that no worker holds yet
+        self._active = set()  # Keys currently held by a worker
+        self._size = 0
+        self._threads = []
+        self._running = False
+
+        # Backpressure counters
+        self.submitted = 0
+        self.processed = 0
+        self.rejected = 0
+        self.dropped = 0
+        self.errors = 0
+        self.high_water = 0
+
+    def start(self):
+        """Start the worker threads."""
+        with self._lock:
+            if self._running:
+                return
+            self._running = True
+        for index in range(self.workers):
+            thread = threading.Thread(target=self._worker, name=f"{self.name}-{index}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self, timeout=5.0):
+        """Stop the workers after the items already queued have been handled."""
+        with self._lock:
+            self._running = False
+            self._ready_signal.notify_all()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    def submit(self, key, item):
+        """
+        Queue an item for the given key without blocking.
+        Returns False if the item was refused because the queue is full.
+        """
+        with self._lock:
+            self.submitted += 1
+            items = self._pending.get(key)
+            # A key is ready only if it had nothing waiting and no worker holds
+            # it; otherwise it is already in _ready, or the worker picks the
+            # item up once it finishes the current one.
+            was_idle = not items and key not in self._active
+            if self._size >= self.max_pending:
+                if self.policy == POLICY_DROP_OLDEST and items:
+                    items.popleft()
+                    self._size -= 1
+                    self.dropped += 1
+                else:
+                    self.rejected += 1
+                    return False
+
+            if items is None:
+                items = self._pending[key] = deque()
+            items.append(item)
+            self._size += 1
+            if self._size > self.high_water:
+                self.high_water = self._size
+
+            if was_idle:
+                self._ready.append(key)
+                self._ready_signal.notify()
+            return True
+
+    def busy(self, key):
+        """Return True if the key has items waiting or being handled."""
+        with self._lock:
+            return key in self._active or key in self._pending
+
+    def stats(self):
+        """Return a snapshot of the queue counters."""
+        with self._lock:
+            return {
+                "pending": self._size,
+                "active": len(self._active),
+                "submitted": self.submitted,
+                "processed": self.processed,
+                "rejected": self.rejected,
+                "dropped": self.dropped,
+                "errors": self.errors,
+                "high_water": self.high_water,
+            }
+
+    def _worker(self):
+        """Take one item at a time from the next ready key and handle it."""
+        while True:
+            with self._lock:
+                while not self._ready and self._running:
+                    self._ready_signal.wait()
+                if not self._ready:
+                    return  # Stopped and nothing left to do
+                key = self._ready.popleft()
+                item = self._pending[key].popleft()
+                self._size -= 1
+                self._active.add(key)
+
+            try:
+                self.handler(key, item)
+            except Exception as e:
+                logger.error(f"Error handling queued item from {key}: {e}")
+                with self._lock:
+                    self.errors += 1
+
+            with self._lock:
+                self.processed += 1
+                self._active.discard(key)
+                if self._pending[key]:
+                    self._ready.append(key)  # Go to the back so other keys get a turn
+                    self._ready_signal.notify()
+                else:
+                    del self._pending[key]